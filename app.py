@@ -1,12 +1,40 @@
 import streamlit as st
 import sys
 import os
+import threading
+import uuid
 from pathlib import Path
 
 src_path = Path(__file__).parent / "src"
 sys.path.append(str(src_path))
 
-from main import query_agent
+# Importing main is cheap: the vector store, retriever and graph are built on first use
+from main import stream_agent, warm_answer_cache, load_resources, list_collections, DEFAULT_COLLECTION
+from telemetry import start_metrics_server
+
+@st.cache_resource
+def load_agent(collection_id: str):
+    """Build the agent graph and open the paper's vector store once per process, not once per rerun."""
+    load_resources(collection_id)
+    return True
+
+@st.cache_resource
+def start_answer_cache_warm_up():
+    """Precompute answers to the example questions once per process (set WARM_ANSWER_CACHE=1)."""
+    thread = threading.Thread(target=warm_answer_cache, daemon=True)
+    thread.start()
+    return thread
+
+if os.getenv("WARM_ANSWER_CACHE") == "1":
+    start_answer_cache_warm_up()
+
+@st.cache_resource
+def start_metrics_endpoint():
+    """Serve Prometheus metrics on METRICS_PORT once per process."""
+    return start_metrics_server()
+
+if os.getenv("METRICS_PORT"):
+    start_metrics_endpoint()
 
 # Configure page
 st.set_page_config(
@@ -35,7 +63,22 @@ with st.sidebar:
     st.markdown("---")
     
     st.markdown("### 🎯 Current Focus")
-    st.info("Analyzing: *On the Biology of a Large Language Model* from Transformer Circuits")
+    # Any ingested paper can be selected, or linked to directly with ?paper=<id>
+    papers = list_collections() or [DEFAULT_COLLECTION]
+    requested_paper = st.query_params.get("paper", DEFAULT_COLLECTION)
+    collection_id = st.selectbox(
+        "📄 Paper",
+        papers,
+        index=papers.index(requested_paper) if requested_paper in papers else 0,
+    )
+    search_all = len(papers) > 1 and st.checkbox("🔀 Search across all papers")
+    collection_ids = papers if search_all else None
+    if search_all:
+        st.info(f"Analyzing: all {len(papers)} papers")
+    elif collection_id == "biology":
+        st.info("Analyzing: *On the Biology of a Large Language Model* from Transformer Circuits")
+    else:
+        st.info(f"Analyzing: *{collection_id}*")
     
     st.markdown("### 🔗 Resources")
     st.markdown("""
@@ -127,6 +170,16 @@ st.markdown("---")
 st.markdown("### 💬 Ask Me Anything About the Research")
 
 # Initialize session state
+if "thread_id" not in st.session_state:
+    # Each browser session gets its own conversation on the agent side
+    st.session_state["thread_id"] = uuid.uuid4().hex
+
+if st.session_state.get("collection_id") != (collection_id, search_all):
+    # Switching papers starts a fresh chat, on a new thread so the agent's memory starts empty too
+    st.session_state["collection_id"] = (collection_id, search_all)
+    st.session_state["thread_id"] = uuid.uuid4().hex
+    st.session_state.pop("messages", None)
+
 if "messages" not in st.session_state:
     st.session_state["messages"] = [
         {
@@ -162,8 +215,21 @@ if prompt := st.chat_input("💭 Ask me about the research... (e.g., 'What are t
         message_placeholder = st.empty()
         
         try:
-            with st.spinner("🔍 Analyzing research documents and generating response..."):
-                response = query_agent(prompt)
+            response = ""
+            with st.spinner("Loading the research index..."):
+                load_agent(collection_id)
+            message_placeholder.markdown("🔍 Analyzing research documents...")
+            for event in stream_agent(prompt, thread_id=st.session_state.thread_id, collection_id=collection_id, collection_ids=collection_ids):
+                if event["type"] == "tool_call":
+                    response = ""
+                    message_placeholder.markdown(f"🔍 Searching the document for *{event['query']}*...")
+                elif event["type"] == "tool_result":
+                    message_placeholder.markdown("📚 Reading the retrieved passages...")
+                elif event["type"] == "token":
+                    response += event["content"]
+                    message_placeholder.markdown(response + "▌")
+                elif event["type"] == "final":
+                    response = event["content"]
             
             if response and response.strip():
                 message_placeholder.markdown(response)
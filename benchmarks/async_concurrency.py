@@ -0,0 +1,88 @@
+"""
+Checks that CreateRagAgent multiplexes conversations on one event loop.
+
+N questions are answered concurrently with `aquery_agent` against a chat model and a
+retriever that each sleep for a fixed latency. Every question makes two LLM calls and one
+retrieval, so one question takes ~(2 * llm_latency + retrieval_latency); N concurrent
+questions should take about the same, not N times as long.
+
+    python benchmarks/async_concurrency.py --queries 20 --llm-latency 0.2
+"""
+import os
+import sys
+import time
+import json
+import asyncio
+import argparse
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parent.parent / "src"))
+
+# The answer cache falls back to the Azure embedding client; placeholders let it be built offline
+for key, value in {
+    "AZURE_OPENAI_ENDPOINT": "http://localhost",
+    "AZURE_OPENAI_API_KEY": "offline",
+    "AZURE_OPENAI_API_VERSION": "2024-12-01-preview",
+}.items():
+    os.environ.setdefault(key, value)
+
+from langchain_core.documents import Document
+from fake_models import FakeChatModel
+from mas import CreateRagAgent
+
+
+class SleepyRetriever:
+    def __init__(self, latency: float):
+        self.latency = latency
+
+    def _docs(self, query: str) -> list:
+        return [Document(page_content=f"Passage {i} relevant to: {query}") for i in range(3)]
+
+    def invoke(self, query: str) -> list:
+        time.sleep(self.latency)
+        return self._docs(query)
+
+    async def ainvoke(self, query: str) -> list:
+        await asyncio.sleep(self.latency)
+        return self._docs(query)
+
+
+async def run(queries: int, llm_latency: float, retrieval_latency: float) -> dict:
+    agent = CreateRagAgent(SleepyRetriever(retrieval_latency), chat_model=FakeChatModel(latency=llm_latency))
+
+    started = time.perf_counter()
+    await agent.aquery_agent("What is this research about?", use_cache=False, thread_id="single")
+    single = time.perf_counter() - started
+
+    started = time.perf_counter()
+    answers = await asyncio.gather(*(
+        agent.aquery_agent(f"Question number {i}", use_cache=False, thread_id=f"concurrent-{i}")
+        for i in range(queries)
+    ))
+    concurrent = time.perf_counter() - started
+
+    assert all(answer.startswith("Based on the document") for answer in answers), answers
+    return {
+        "queries": queries,
+        "single_query_seconds": single,
+        "concurrent_seconds": concurrent,
+        "serial_estimate_seconds": single * queries,
+        "speedup": single * queries / concurrent,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--queries", type=int, default=20)
+    parser.add_argument("--llm-latency", type=float, default=0.2)
+    parser.add_argument("--retrieval-latency", type=float, default=0.05)
+    args = parser.parse_args()
+
+    result = asyncio.run(run(args.queries, args.llm_latency, args.retrieval_latency))
+    print(json.dumps(result, indent=2))
+
+    # N concurrent queries should finish in roughly the time of one
+    if result["concurrent_seconds"] > 2 * result["single_query_seconds"]:
+        print("FAIL: concurrent queries were not multiplexed")
+        sys.exit(1)
+    print("OK")
@@ -0,0 +1,255 @@
+"""
+Offline performance suite for the ingest and query paths.
+
+Every model call goes to the deterministic fakes (MODEL_BACKEND=fake, see src/model.py),
+each sleeping for a configurable latency, so the numbers measure this project's own code
+and are comparable between commits. Against the bundled biology paper it measures:
+
+    chunking    content.md through the streaming chunker (chunks/s, MB/s)
+    indexing    embedding + vector store + BM25 into a fresh store, an unchanged re-index, and
+                the store's estimated resident size (Chroma, or the memory-mapped index
+                with --vector-store mmap)
+    retrieval   hybrid search latency, cold (query embedded) and warm (cached), p50/p99
+    agent       end-to-end `main.query_agent` latency and its overhead beyond the model calls,
+                in the tool-loop or the prefetch graph mode (--agent-mode)
+
+Results are printed and, with --output, written as JSON for regression tracking.
+
+    python benchmarks/offline_suite.py --output benchmark_results.json
+    python benchmarks/offline_suite.py --llm-latency 0.2 --embedding-latency 0.05 --only retrieval agent
+    python benchmarks/offline_suite.py --llm-latency 0.2 --only agent --agent-mode prefetch
+"""
+import io
+import os
+import sys
+import json
+import math
+import time
+import platform
+import argparse
+import tempfile
+import statistics
+import subprocess
+import contextlib
+from pathlib import Path
+from datetime import datetime
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.append(str(ROOT / "src"))
+
+DEFAULT_PAPER = ROOT / "artifacts" / "research_papers" / "biology" / "content.md"
+COLLECTION = "benchmark"
+SUITES = ["chunking", "indexing", "retrieval", "agent"]
+# FakeChatModel asks for the retriever once, then answers: two model calls per question,
+# or one when the retrieval is prefetched
+LLM_CALLS_PER_QUERY = {"tools": 2, "prefetch": 1}
+
+QUERIES = [
+    "What is this paper about?",
+    "How does the model plan rhymes in poems?",
+    "Explain multi-step reasoning in the introductory example",
+    "How are multilingual circuits shared across languages?",
+    "How does the model perform addition?",
+    "What happens in medical diagnoses?",
+    "How do entity recognition and hallucinations interact?",
+    "Why does the model refuse harmful requests?",
+    "What are jailbreaks and how do they work?",
+    "Is chain-of-thought reasoning faithful?",
+    "What are the limitations of attribution graphs?",
+    "Figure 36",
+    "Dallas Austin Texas capital",
+    "replacement model error nodes",
+]
+
+
+def percentile(values: list, q: float) -> float:
+    """Nearest-rank percentile of `values` (q in 0..100)."""
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(q / 100 * len(ordered)) - 1)]
+
+
+def summarize(seconds: list) -> dict:
+    return {
+        "count": len(seconds),
+        "p50_ms": percentile(seconds, 50) * 1000,
+        "p99_ms": percentile(seconds, 99) * 1000,
+        "mean_ms": statistics.fmean(seconds) * 1000,
+        "max_ms": max(seconds) * 1000,
+    }
+
+
+@contextlib.contextmanager
+def quiet(enabled: bool = True):
+    """Swallow the progress prints of the code under test."""
+    if not enabled:
+        yield
+        return
+    with contextlib.redirect_stdout(io.StringIO()):
+        yield
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def bench_chunking(paper: Path, runs: int) -> dict:
+    from markdown_chunker import MarkdownChunker
+
+    size = paper.stat().st_size
+    timings = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        chunks = sum(1 for _ in MarkdownChunker().split_file(paper))
+        timings.append(time.perf_counter() - started)
+    best = min(timings)
+    return {
+        "bytes": size,
+        "chunks": chunks,
+        "runs": runs,
+        "best_seconds": best,
+        "median_seconds": statistics.median(timings),
+        "chunks_per_second": chunks / best,
+        "mb_per_second": size / best / 1024 / 1024,
+    }
+
+
+def bench_indexing(paper: Path, directory: Path, embedding_concurrency: int, verbose: bool, vector_store: str = "chroma"):
+    from retriever import chunk_markdown, index_chunks
+    from collection_registry import estimate_footprint
+
+    chunks = list(chunk_markdown(paper))
+
+    started = time.perf_counter()
+    with quiet(not verbose):
+        retriever = index_chunks(iter(chunks), COLLECTION, directory, embedding_concurrency=embedding_concurrency, vector_store=vector_store)
+    first = time.perf_counter() - started
+
+    # Same chunks again: nothing is embedded, the collection diff and BM25 rebuild remain
+    started = time.perf_counter()
+    with quiet(not verbose):
+        retriever = index_chunks(iter(chunks), COLLECTION, directory, embedding_concurrency=embedding_concurrency, vector_store=vector_store)
+    unchanged = time.perf_counter() - started
+
+    return {
+        "chunks": len(chunks),
+        "index_seconds": first,
+        "chunks_per_second": len(chunks) / first,
+        "unchanged_reindex_seconds": unchanged,
+        "vector_store": vector_store,
+        "footprint_mb": estimate_footprint(directory / COLLECTION) / 1024 / 1024,
+    }, retriever
+
+
+def bench_retrieval(retriever, rounds: int) -> dict:
+    cold = []
+    for query in QUERIES:
+        started = time.perf_counter()
+        retriever.search(query)
+        cold.append(time.perf_counter() - started)
+
+    warm = []
+    for _ in range(rounds):
+        for query in QUERIES:
+            started = time.perf_counter()
+            retriever.search(query)
+            warm.append(time.perf_counter() - started)
+
+    return {"queries": len(QUERIES), "cold": summarize(cold), "warm": summarize(warm)}
+
+
+def bench_agent(llm_latency: float, rounds: int, verbose: bool, mode: str = "tools") -> dict:
+    # main reads its configuration when imported
+    os.environ["DEFAULT_COLLECTION"] = COLLECTION
+    os.environ["AGENT_MODE"] = mode
+    import main
+
+    with quiet(not verbose):
+        main.load_resources()
+
+    latencies = []
+    for round_number in range(rounds):
+        for i, query in enumerate(QUERIES):
+            started = time.perf_counter()
+            with quiet(not verbose):
+                main.query_agent(query, use_cache=False, thread_id=f"benchmark-{round_number}-{i}")
+            latencies.append(time.perf_counter() - started)
+
+    model_seconds = LLM_CALLS_PER_QUERY[mode] * llm_latency
+    return {
+        "mode": mode,
+        "llm_latency_seconds": llm_latency,
+        "llm_calls_per_query": LLM_CALLS_PER_QUERY[mode],
+        "end_to_end": summarize(latencies),
+        "overhead": summarize([max(0.0, latency - model_seconds) for latency in latencies]),
+    }
+
+
+def run(args) -> dict:
+    from model import use_fake_models
+    use_fake_models(llm_latency=args.llm_latency, embedding_latency=args.embedding_latency)
+
+    suites = args.only or SUITES
+    results = {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "paper": str(args.paper),
+        "settings": {
+            "llm_latency": args.llm_latency,
+            "embedding_latency": args.embedding_latency,
+            "embedding_concurrency": args.embedding_concurrency,
+            "rounds": args.rounds,
+            "agent_mode": args.agent_mode,
+            "vector_store": args.vector_store,
+        },
+    }
+
+    if "chunking" in suites:
+        results["chunking"] = bench_chunking(args.paper, args.rounds)
+
+    if not {"indexing", "retrieval", "agent"} & set(suites):
+        return results
+
+    with tempfile.TemporaryDirectory(prefix="rag-benchmark-") as directory:
+        # Stores, embedding cache and query cache all live in the throwaway directory
+        os.environ["VECTOR_DB_DIRECTORY"] = directory
+        os.environ.pop("QUERY_CACHE_PATH", None)
+
+        # Retrieval and the agent need an index, so it is always built when they run
+        indexing, retriever = bench_indexing(args.paper, Path(directory), args.embedding_concurrency, args.verbose, args.vector_store)
+        if "indexing" in suites:
+            results["indexing"] = indexing
+        if "retrieval" in suites:
+            results["retrieval"] = bench_retrieval(retriever, args.rounds)
+        if "agent" in suites:
+            results["agent"] = bench_agent(args.llm_latency, args.rounds, args.verbose, args.agent_mode)
+
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--paper", type=Path, default=DEFAULT_PAPER, help="content.md to benchmark against")
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="seconds per fake chat model call")
+    parser.add_argument("--embedding-latency", type=float, default=0.0, help="seconds per fake embedding request")
+    parser.add_argument("--embedding-concurrency", type=int, default=4)
+    parser.add_argument("--rounds", type=int, default=5, help="repetitions of each measurement")
+    parser.add_argument("--only", nargs="+", choices=SUITES, help="run only these suites")
+    parser.add_argument("--vector-store", choices=["chroma", "mmap"], default="chroma", help="store to index into (see src/vector_index.py)")
+    parser.add_argument("--agent-mode", choices=["tools", "prefetch"], default="tools", help="agent graph to benchmark (see src/prefetch.py)")
+    parser.add_argument("--output", type=Path, help="write the results to this JSON file")
+    parser.add_argument("--verbose", action="store_true", help="show the output of the code under test")
+    args = parser.parse_args()
+
+    results = run(args)
+    print(json.dumps(results, indent=2))
+    if args.output:
+        args.output.parent.mkdir(parents=True, exist_ok=True)
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
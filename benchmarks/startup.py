@@ -0,0 +1,118 @@
+"""
+Tracks cold-start time and import cost of the query path.
+
+Each run starts a fresh interpreter, imports `main` the way app.py does and, with
+--cold-start, builds the vector store, retriever and agent graph with `load_resources()`.
+`-X importtime` output is used to list the most expensive imports. No model calls are made:
+placeholder Azure settings are enough to construct the clients.
+
+The check fails if importing `main` pulls in ingestion-only modules (the markdown loader,
+unstructured, image captioning).
+
+    python benchmarks/startup.py --runs 5 --cold-start
+"""
+import os
+import re
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+INGEST_ONLY_MODULES = [
+    "retriever",
+    "image_info",
+    "scrapper",
+    "unstructured",
+    "langchain_community.document_loaders",
+]
+
+CHILD = """
+import sys, time, json
+sys.path.append({src!r})
+started = time.perf_counter()
+import main
+imported = time.perf_counter()
+result = {{"import_seconds": imported - started}}
+if {cold_start!r}:
+    main.load_resources()
+    result["load_resources_seconds"] = time.perf_counter() - imported
+result["ingest_modules_loaded"] = [m for m in {forbidden!r} if m in sys.modules]
+print(json.dumps(result))
+"""
+
+IMPORTTIME_LINE = re.compile(r"import time:\s+(\d+)\s+\|\s+(\d+)\s+\|\s*(\S+)")
+
+
+def run_once(cold_start: bool) -> tuple:
+    env = dict(os.environ)
+    for key, value in {
+        "AZURE_OPENAI_ENDPOINT": "http://localhost",
+        "AZURE_OPENAI_API_KEY": "offline",
+        "AZURE_OPENAI_API_VERSION": "2024-12-01-preview",
+    }.items():
+        env.setdefault(key, value)
+
+    code = CHILD.format(src=str(ROOT / "src"), cold_start=cold_start, forbidden=INGEST_ONLY_MODULES)
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=ROOT, env=env, capture_output=True, text=True,
+    )
+    if process.returncode != 0:
+        raise RuntimeError(process.stderr[-2000:])
+
+    # Cumulative time includes nested imports, so a slow module shows up with its importers
+    imports = []
+    for line in process.stderr.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if match:
+            imports.append((match.group(3), int(match.group(2)) / 1e6))
+    return json.loads(process.stdout.strip().splitlines()[-1]), imports
+
+
+def run(runs: int, cold_start: bool, top: int) -> dict:
+    results = []
+    imports = []
+    for _ in range(runs):
+        result, imports = run_once(cold_start)
+        results.append(result)
+
+    report = {
+        "runs": runs,
+        "import_seconds_median": statistics.median(r["import_seconds"] for r in results),
+        "import_seconds_max": max(r["import_seconds"] for r in results),
+        "ingest_modules_loaded": sorted({m for r in results for m in r["ingest_modules_loaded"]}),
+        "slowest_imports": [
+            {"module": module, "cumulative_seconds": seconds}
+            for module, seconds in sorted(imports, key=lambda item: item[1], reverse=True)[:top]
+        ],
+    }
+    if cold_start:
+        report["load_resources_seconds_median"] = statistics.median(r["load_resources_seconds"] for r in results)
+        report["cold_start_seconds_median"] = statistics.median(
+            r["import_seconds"] + r["load_resources_seconds"] for r in results
+        )
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--cold-start", action="store_true", help="also build the vector store, retriever and graph")
+    parser.add_argument("--top", type=int, default=15, help="number of slowest imports to list")
+    parser.add_argument("--max-import-seconds", type=float, default=None, help="fail if importing main takes longer")
+    args = parser.parse_args()
+
+    report = run(args.runs, args.cold_start, args.top)
+    print(json.dumps(report, indent=2))
+
+    if report["ingest_modules_loaded"]:
+        print(f"FAIL: the query path imports ingestion-only modules: {report['ingest_modules_loaded']}")
+        sys.exit(1)
+    if args.max_import_seconds is not None and report["import_seconds_median"] > args.max_import_seconds:
+        print(f"FAIL: importing main took {report['import_seconds_median']:.2f}s")
+        sys.exit(1)
+    print("OK")
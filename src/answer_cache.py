@@ -0,0 +1,132 @@
+import math
+import time
+import threading
+from collections import OrderedDict
+
+# Questions suggested in the Streamlit sidebar; answers to these can be precomputed
+DEFAULT_FAQ = [
+    "What is this research about?",
+    "Explain the key findings",
+    "What methods were used?",
+    "How does this relate to AI safety?",
+]
+
+
+def normalize_question(question: str) -> str:
+    return " ".join(question.lower().split()).rstrip("?!. ")
+
+
+def _cosine(a: list, b: list) -> float:
+    dot = sum(x * y for x, y in zip(a, b))
+    norm = math.sqrt(sum(x * x for x in a)) * math.sqrt(sum(y * y for y in b))
+    return dot / norm if norm else 0.0
+
+
+class SemanticAnswerCache:
+    """
+    Returns stored answers for questions that are near-duplicates of ones already answered.
+
+    Exact repeats (after normalisation) are answered without any network call. Other
+    questions are embedded and compared with the stored questions; the best match above
+    `threshold` is returned. Entries expire after `ttl_seconds`, the least recently used
+    entries are evicted past `max_entries`, and every entry is dropped once the collection
+    version it was answered against changes.
+    """
+
+    def __init__(self, embedding_model, threshold: float = 0.95, max_entries: int = 256, ttl_seconds: float = 3600):
+        self.embedding_model = embedding_model
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.version = None
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _sync_version(self, version: str) -> None:
+        if version != self.version:
+            self._entries.clear()
+            self.version = version
+
+    def _expire(self) -> None:
+        now = time.time()
+        for key in [key for key, entry in self._entries.items() if now - entry["created"] > self.ttl_seconds]:
+            del self._entries[key]
+
+    def lookup(self, question: str, version: str):
+        """
+        Return (answer, embedding) for a cached near-duplicate, or (None, embedding) on a miss.
+
+        The embedding is handed back so that `store` does not have to compute it again.
+        """
+        key = normalize_question(question)
+        with self._lock:
+            self._sync_version(version)
+            self._expire()
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]["answer"], self._entries[key]["embedding"]
+            candidates = list(self._entries.items())
+
+        if not candidates:
+            with self._lock:
+                self.misses += 1
+            return None, None
+
+        embedding = self.embedding_model.embed_query(key)
+        best_key, best_score = None, -1.0
+        for candidate_key, entry in candidates:
+            score = _cosine(embedding, entry["embedding"])
+            if score > best_score:
+                best_key, best_score = candidate_key, score
+
+        with self._lock:
+            if best_score >= self.threshold and best_key in self._entries and self.version == version:
+                self._entries.move_to_end(best_key)
+                self.hits += 1
+                print(f"Answer cache hit ({best_score:.3f}): '{question}' ~ '{self._entries[best_key]['question']}'")
+                return self._entries[best_key]["answer"], embedding
+            self.misses += 1
+        return None, embedding
+
+    def store(self, question: str, answer: str, version: str, embedding: list = None) -> None:
+        if not answer or not answer.strip():
+            return
+        key = normalize_question(question)
+        if embedding is None:
+            embedding = self.embedding_model.embed_query(key)
+
+        with self._lock:
+            self._sync_version(version)
+            self._entries[key] = {
+                "question": question,
+                "answer": answer,
+                "embedding": embedding,
+                "created": time.time(),
+            }
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def warm_up(self, questions: list, answer_fn, version: str) -> None:
+        """Precompute answers for `questions` with `answer_fn(question) -> str`."""
+        for question in questions:
+            answer, embedding = self.lookup(question, version)
+            if answer is None:
+                print(f"Warming answer cache: {question}")
+                self.store(question, answer_fn(question), version, embedding)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": len(self._entries),
+        }
@@ -0,0 +1,261 @@
+import os
+import re
+import json
+import math
+import asyncio
+from pathlib import Path
+from collections import Counter, defaultdict
+from langchain_core.documents import Document
+from indexing import read_index_version
+
+TOKEN_PATTERN = re.compile(r"\w+")
+QUOTED_PATTERN = re.compile(r'"[^"]+"')
+# Figure / table / equation / section references, e.g. "Figure 36", "tab. 2", "Eq 4"
+LABEL_PATTERN = re.compile(r"\b(fig(ure)?|tab(le)?|eq(uation)?|section|appendix)\.?\s*\d+", re.IGNORECASE)
+INDEX_FILE = "bm25_index.json"
+
+
+def tokenize(text: str) -> list:
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+class BM25Index:
+    """
+    In-memory inverted index with Okapi BM25 scoring, persisted as JSON next to the Chroma store.
+    """
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.version = None
+        self.docs = {}
+        self.doc_lengths = {}
+        self.postings = defaultdict(dict)
+        self.total_length = 0
+
+    @classmethod
+    def build(cls, ids: list, docs: list, version: str = None, **kwargs):
+        index = cls(**kwargs)
+        for doc_id, doc in zip(ids, docs):
+            index.add(doc_id, doc.page_content, doc.metadata)
+        index.version = version
+        return index
+
+    @classmethod
+    def from_vectorstore(cls, vectorstore, **kwargs):
+        """Build the index from the chunks already stored in a Chroma collection (no embedding calls)."""
+        stored = vectorstore.get(include=["documents", "metadatas"])
+        docs = [
+            Document(page_content=text or "", metadata=metadata or {})
+            for text, metadata in zip(stored["documents"], stored["metadatas"])
+        ]
+        return cls.build(stored["ids"], docs, version=read_index_version(vectorstore), **kwargs)
+
+    def add(self, doc_id: str, text: str, metadata: dict = None) -> None:
+        if doc_id in self.docs:
+            self.remove(doc_id)
+        terms = Counter(tokenize(text))
+        self.docs[doc_id] = {"text": text, "metadata": metadata or {}}
+        self.doc_lengths[doc_id] = sum(terms.values())
+        self.total_length += self.doc_lengths[doc_id]
+        for term, frequency in terms.items():
+            self.postings[term][doc_id] = frequency
+
+    def remove(self, doc_id: str) -> None:
+        if doc_id not in self.docs:
+            return
+        for term in set(tokenize(self.docs[doc_id]["text"])):
+            self.postings[term].pop(doc_id, None)
+            if not self.postings[term]:
+                del self.postings[term]
+        self.total_length -= self.doc_lengths.pop(doc_id)
+        del self.docs[doc_id]
+
+    def __len__(self) -> int:
+        return len(self.docs)
+
+    def search(self, query: str, k: int = 20) -> list:
+        """Return the top-k [(Document, BM25 score)], best first."""
+        if not self.docs:
+            return []
+        n = len(self.docs)
+        average_length = self.total_length / n
+        scores = defaultdict(float)
+
+        for term in set(tokenize(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (n - len(postings) + 0.5) / (len(postings) + 0.5))
+            for doc_id, frequency in postings.items():
+                norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[doc_id] / average_length)
+                scores[doc_id] += idf * frequency * (self.k1 + 1) / (frequency + norm)
+
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+        return [
+            (Document(id=doc_id, page_content=self.docs[doc_id]["text"], metadata=self.docs[doc_id]["metadata"]), score)
+            for doc_id, score in ranked
+        ]
+
+    def save(self, path: Path) -> None:
+        path = Path(path)
+        tmp_path = path.with_suffix(".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({
+                "k1": self.k1,
+                "b": self.b,
+                "version": self.version,
+                "docs": self.docs,
+            }, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: Path):
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        index = cls(k1=data["k1"], b=data["b"])
+        for doc_id, doc in data["docs"].items():
+            index.add(doc_id, doc["text"], doc["metadata"])
+        index.version = data.get("version")
+        return index
+
+
+def reciprocal_rank_fusion(result_lists: list, k: int = 60, limit: int = None) -> list:
+    """
+    Fuse several ranked [(Document, score)] lists by reciprocal rank.
+
+    Returns [(Document, fused score)] best first, with fused scores scaled so the best is 1.0.
+    """
+    fused = defaultdict(float)
+    docs = {}
+    for results in result_lists:
+        for rank, (doc, _) in enumerate(results):
+            key = doc.id or doc.page_content
+            fused[key] += 1.0 / (k + rank + 1)
+            docs.setdefault(key, doc)
+
+    ranked = sorted(fused.items(), key=lambda item: item[1], reverse=True)[:limit]
+    if not ranked:
+        return []
+    top = ranked[0][1]
+    return [(docs[key], score / top) for key, score in ranked]
+
+
+def is_keyword_query(query: str, max_words: int = 4) -> bool:
+    """
+    Heuristic for lookups that lexical search answers well on its own: short queries made of
+    a quoted phrase, a figure / table label, or identifier-like tokens (numbers, snake_case).
+
+    Anything else, including short questions about acronyms ("How does RLHF work"), is a
+    semantic question and gets fused results.
+    """
+    # A quoted phrase counts as one word, so 'find "attribution graphs"' is short
+    words = QUOTED_PATTERN.sub('""', query).split()
+    if not words or len(words) > max_words:
+        return False
+    if QUOTED_PATTERN.search(query) or LABEL_PATTERN.search(query):
+        return True
+    return any(re.search(r"\d", word) or "_" in word.strip("_") for word in words)
+
+
+class HybridRetriever:
+    """
+    Fuses vector search with BM25 by reciprocal rank fusion.
+
+    Keyword lookups (see `is_keyword_query`) take a lexical-only fast path with no network
+    calls. Fused scores are rank-based rather than similarities, which `similarity_scores`
+    tells the context packer.
+    """
+
+    similarity_scores = False
+
+    def __init__(self, vector_retriever, bm25_index: BM25Index, k: int = None, rrf_k: int = 60):
+        self.vector_retriever = vector_retriever
+        self.bm25_index = bm25_index
+        self.k = k or vector_retriever.k
+        self.rrf_k = rrf_k
+
+    @property
+    def vectorstore(self):
+        return self.vector_retriever.vectorstore
+
+    @classmethod
+    def from_directory(cls, vector_retriever, persist_directory: Path):
+        """
+        Attach the BM25 index persisted in `persist_directory`.
+
+        Collections indexed before BM25 existed, or whose index is out of date, get one built
+        from the stored chunks and saved for next time.
+        """
+        path = Path(persist_directory) / INDEX_FILE
+        version = read_index_version(vector_retriever.vectorstore)
+        bm25_index = BM25Index.load(path) if path.exists() else None
+        if bm25_index is None or (version and bm25_index.version != version):
+            bm25_index = BM25Index.from_vectorstore(vector_retriever.vectorstore)
+            try:
+                bm25_index.save(path)
+            except OSError as e:
+                print(f"Could not save BM25 index: {e}")
+        return cls(vector_retriever, bm25_index)
+
+    def lexical_search(self, query: str, k: int = None) -> list:
+        results = self.bm25_index.search(query, k or self.k)
+        if not results:
+            return []
+        top = results[0][1]
+        return [(doc, score / top) for doc, score in results]
+
+    def search(self, query: str, k: int = None) -> list:
+        k = k or self.k
+        if is_keyword_query(query):
+            results = self.lexical_search(query, k)
+            if results:
+                return results
+        return reciprocal_rank_fusion(
+            [self.vector_retriever.search(query, k), self.bm25_index.search(query, k)],
+            k=self.rrf_k,
+            limit=k,
+        )
+
+    def search_with_embedding(self, query: str, embedding: list, k: int = None) -> list:
+        """
+        Fused search with a query embedding computed by the caller.
+
+        Scores are scaled by the best vector relevance, so results from different collections
+        can be ranked against each other.
+        """
+        k = k or self.k
+        vector_results = self.vector_retriever.search_with_embedding(query, embedding, k)
+        fused = reciprocal_rank_fusion([vector_results, self.bm25_index.search(query, k)], k=self.rrf_k, limit=k)
+        top_relevance = max((score for _, score in vector_results), default=0.0)
+        return [(doc, score * top_relevance) for doc, score in fused]
+
+    async def asearch(self, query: str, k: int = None) -> list:
+        k = k or self.k
+        if is_keyword_query(query):
+            results = self.lexical_search(query, k)
+            if results:
+                return results
+        vector_results, lexical_results = await asyncio.gather(
+            self.vector_retriever.asearch(query, k),
+            asyncio.to_thread(self.bm25_index.search, query, k),
+        )
+        return reciprocal_rank_fusion([vector_results, lexical_results], k=self.rrf_k, limit=k)
+
+    def invoke(self, query: str) -> list:
+        return [doc for doc, _ in self.search(query)]
+
+    async def ainvoke(self, query: str) -> list:
+        return [doc for doc, _ in await self.asearch(query)]
+
+    def embed_query(self, text: str) -> list:
+        return self.vector_retriever.embed_query(text)
+
+    async def aembed_query(self, text: str) -> list:
+        return await self.vector_retriever.aembed_query(text)
+
+    def get_embeddings(self, ids: list) -> dict:
+        return self.vector_retriever.get_embeddings(ids)
+
+    def stats(self) -> dict:
+        return self.vector_retriever.stats()
@@ -0,0 +1,238 @@
+import os
+import threading
+from pathlib import Path
+from collections import OrderedDict
+from contextlib import contextmanager
+from concurrent.futures import Future
+from answer_cache import SemanticAnswerCache
+from query_cache import QueryCache, CachedRetriever
+from bm25 import HybridRetriever
+
+# Files Chroma reads page by page rather than holding in memory
+PAGED_FILES = {"chroma.sqlite3", "chroma.sqlite3-wal", "chroma.sqlite3-shm"}
+
+
+def default_vector_db_directory() -> Path:
+    """Directory holding one vector store per ingested paper (`<directory>/<collection id>`)."""
+    if os.getenv("VECTOR_DB_DIRECTORY"):
+        return Path(os.getenv("VECTOR_DB_DIRECTORY"))
+    if os.path.exists("/app/artifacts/Vector_databases"):
+        return Path("/app/artifacts/Vector_databases")
+    return Path("artifacts/Vector_databases")
+
+
+def estimate_footprint(persist_directory: Path) -> int:
+    """
+    Rough resident size in bytes of an open store: its HNSW segment files, or the quantized
+    vectors and manifest of a memory-mapped index, and its BM25 index.
+    """
+    from vector_index import has_vector_index, is_paged_file
+
+    persist_directory = Path(persist_directory)
+    indexed = has_vector_index(persist_directory)
+    # A memory-mapped index is served on its own; Chroma's segments (in subdirectories) stay closed
+    paths = persist_directory.iterdir() if indexed else persist_directory.rglob("*")
+    total = 0
+    for path in paths:
+        if path.is_file() and path.name not in PAGED_FILES and not (indexed and is_paged_file(path.name)):
+            total += path.stat().st_size
+    return total
+
+
+def _release(vectorstore) -> None:
+    """Best effort: stop the Chroma system behind a store so its segments are freed."""
+    if not hasattr(vectorstore, "_client"):
+        # Memory-mapped indexes are unmapped once nothing refers to them
+        return
+    try:
+        from chromadb.api.client import SharedSystemClient
+        system = SharedSystemClient._identifier_to_system.pop(vectorstore._client._identifier, None)
+        if system is not None:
+            system.stop()
+    except Exception as e:
+        print(f"Could not release vector store: {e}")
+
+
+class OpenCollection:
+    """A collection's vector store with the retriever and answer cache built on top of it."""
+
+    def __init__(self, collection_id: str, vectorstore, retriever, answer_cache: SemanticAnswerCache, footprint: int):
+        self.collection_id = collection_id
+        self.vectorstore = vectorstore
+        self.retriever = retriever
+        self.answer_cache = answer_cache
+        self.footprint = footprint
+        # Searches using the store right now; an evicted store is released when they finish
+        self.leases = 0
+        self.evicted = False
+
+
+class CollectionRegistry:
+    """
+    Serves many ingested papers from one process without loading every index at start-up.
+
+    Papers are discovered as subdirectories of `directory`, one vector store each (Chroma, or
+    the memory-mapped index of vector_index.py), named by collection ID (the `page_identifier`
+    the pipeline ingests them under). A store is opened on its first query, outside the
+    registry lock, so other papers are served while it loads and concurrent first queries
+    share one open. At most `max_open` stores stay open, and their estimated footprint is
+    kept under `max_memory_mb`; past either limit the least recently used store is closed.
+    Searches hold a `lease` on their collection, and a store evicted while leased is only
+    released once its last lease ends.
+    """
+
+    def __init__(
+        self,
+        directory: Path = None,
+        embedding_model=None,
+        max_open: int = 8,
+        max_memory_mb: float = 1024,
+        k: int = 20,
+        query_cache: QueryCache = None,
+    ):
+        self.directory = Path(directory or default_vector_db_directory())
+        self.embedding_model = embedding_model
+        self.max_open = max_open
+        self.max_memory_bytes = int(max_memory_mb * 1024 * 1024)
+        self.k = k
+        # One query cache for all collections: a question embedded for one paper is reused for the others
+        self.query_cache = query_cache or QueryCache()
+        self.opened = 0
+        self.evictions = 0
+        self._open = OrderedDict()
+        self._opening = {}
+        self._lock = threading.RLock()
+
+    def discover(self) -> list:
+        """IDs of the collections on disk, sorted."""
+        if not self.directory.exists():
+            return []
+        return sorted(
+            path.name for path in self.directory.iterdir()
+            if path.is_dir() and not path.name.startswith(".")
+        )
+
+    def __contains__(self, collection_id: str) -> bool:
+        return (self.directory / collection_id).is_dir()
+
+    def get_embedding_model(self):
+        if self.embedding_model is None:
+            from model import get_embedding_model
+            self.embedding_model = get_embedding_model()
+        return self.embedding_model
+
+    def _open_collection(self, collection_id: str) -> OpenCollection:
+        # Imported here so that importing the registry does not load the Chroma client or NumPy
+        from vector_index import open_vectorstore
+
+        persist_directory = self.directory / collection_id
+        vectorstore = open_vectorstore(collection_id, persist_directory, self.get_embedding_model())
+        retriever = HybridRetriever.from_directory(
+            CachedRetriever(vectorstore, k=self.k, cache=self.query_cache), persist_directory
+        )
+        return OpenCollection(
+            collection_id,
+            vectorstore,
+            retriever,
+            SemanticAnswerCache(retriever),
+            estimate_footprint(persist_directory),
+        )
+
+    def _get(self, collection_id: str, lease: bool) -> OpenCollection:
+        while True:
+            with self._lock:
+                collection = self._open.get(collection_id)
+                if collection is not None:
+                    self._open.move_to_end(collection_id)
+                    collection.leases += lease
+                    return collection
+
+                opening = self._opening.get(collection_id)
+                if opening is None:
+                    if collection_id not in self:
+                        raise KeyError(f"Unknown collection {collection_id!r}; available: {self.discover()}")
+                    opening = self._opening[collection_id] = Future()
+                    break
+            # Another thread is opening it: wait for that, then take it from `_open` (it may
+            # already have been evicted again, in which case it is opened anew)
+            opening.result()
+
+        try:
+            collection = self._open_collection(collection_id)
+        except BaseException as e:
+            with self._lock:
+                del self._opening[collection_id]
+            opening.set_exception(e)
+            raise
+
+        with self._lock:
+            del self._opening[collection_id]
+            self._open[collection_id] = collection
+            self.opened += 1
+            collection.leases += lease
+            idle = self._evict()
+        opening.set_result(collection)
+        for evicted in idle:
+            _release(evicted.vectorstore)
+        return collection
+
+    def get(self, collection_id: str) -> OpenCollection:
+        """Return the open collection, opening it (and closing others if needed) on first use."""
+        return self._get(collection_id, lease=False)
+
+    @contextmanager
+    def lease(self, collection_id: str):
+        """`get`, keeping the collection's store open until the block ends even if it is evicted."""
+        collection = self._get(collection_id, lease=True)
+        try:
+            yield collection
+        finally:
+            with self._lock:
+                collection.leases -= 1
+                idle = collection.evicted and not collection.leases
+            if idle:
+                _release(collection.vectorstore)
+
+    def retriever(self, collection_id: str):
+        return self.get(collection_id).retriever
+
+    def _footprint(self) -> int:
+        return sum(collection.footprint for collection in self._open.values())
+
+    def _remove(self, collection_id: str) -> list:
+        """Take a collection out of the open set; returns it if it can be released right away."""
+        collection = self._open.pop(collection_id, None)
+        if collection is None:
+            return []
+        collection.evicted = True
+        return [collection] if not collection.leases else []
+
+    def _evict(self) -> list:
+        # The most recently used store is never closed, even if it alone is over the memory limit
+        idle = []
+        while len(self._open) > 1 and (len(self._open) > self.max_open or self._footprint() > self.max_memory_bytes):
+            idle += self._remove(next(iter(self._open)))
+            self.evictions += 1
+        return idle
+
+    def close(self, collection_id: str) -> None:
+        with self._lock:
+            idle = self._remove(collection_id)
+        for collection in idle:
+            _release(collection.vectorstore)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "available": len(self.discover()),
+                "open": list(self._open),
+                "footprint_mb": round(self._footprint() / (1024 * 1024), 2),
+                "opened": self.opened,
+                "evictions": self.evictions,
+            }
+
+    def answer_cache_stats(self) -> dict:
+        """Answer cache hits, misses and entries summed over the open collections."""
+        with self._lock:
+            caches = [collection.answer_cache.stats() for collection in self._open.values()]
+        return {key: sum(stats[key] for stats in caches) for key in ("hits", "misses", "entries")}
@@ -0,0 +1,196 @@
+import math
+import re
+from tokens import count_tokens
+
+WORD_PATTERN = re.compile(r"\w+")
+
+
+def _cosine(a: list, b: list) -> float:
+    dot = sum(x * y for x, y in zip(a, b))
+    norm = math.sqrt(sum(x * x for x in a)) * math.sqrt(sum(y * y for y in b))
+    return dot / norm if norm else 0.0
+
+
+def _jaccard(a: set, b: set) -> float:
+    return len(a & b) / len(a | b) if a or b else 0.0
+
+
+def cut_by_score(results: list, score_gap: float = 0.1, max_score_drop: float = 0.25) -> list:
+    """
+    Adaptive k: keep results until the score falls off.
+
+    Stops at the first gap between consecutive scores larger than `score_gap`, and drops
+    everything more than `max_score_drop` below the best score. `score_gap=None` disables
+    the cut, for scores that are not similarities.
+    """
+    if not results:
+        return []
+    if score_gap is None:
+        return list(results)
+    kept = [results[0]]
+    top_score = results[0][1]
+    for previous, current in zip(results, results[1:]):
+        if previous[1] - current[1] > score_gap or top_score - current[1] > max_score_drop:
+            break
+        kept.append(current)
+    return kept
+
+
+def mmr_order(results: list, embeddings: dict = None, lambda_mult: float = 0.7) -> list:
+    """
+    Reorder results by maximal marginal relevance, trading relevance against redundancy.
+
+    Similarity between chunks uses their embeddings when `embeddings` ({chunk id: vector})
+    covers them, and word overlap otherwise.
+    """
+    if len(results) <= 2:
+        return list(results)
+
+    scores = [score for _, score in results]
+    low, high = min(scores), max(scores)
+    relevance = [(score - low) / (high - low) if high > low else 1.0 for score in scores]
+
+    embeddings = embeddings or {}
+    use_embeddings = all(doc.id in embeddings for doc, _ in results)
+    words = [set(WORD_PATTERN.findall(doc.page_content.lower())) for doc, _ in results]
+
+    def similarity(i: int, j: int) -> float:
+        if use_embeddings:
+            return _cosine(embeddings[results[i][0].id], embeddings[results[j][0].id])
+        return _jaccard(words[i], words[j])
+
+    selected = [0]
+    remaining = list(range(1, len(results)))
+    while remaining:
+        best = max(
+            remaining,
+            key=lambda i: lambda_mult * relevance[i] - (1 - lambda_mult) * max(similarity(i, j) for j in selected),
+        )
+        selected.append(best)
+        remaining.remove(best)
+    return [results[i] for i in selected]
+
+
+def _overlap(left: str, right: str, min_overlap: int = 30, window: int = 600) -> int:
+    """Length of the suffix of `left` that is also a prefix of `right` (0 if shorter than min_overlap)."""
+    probe = right[:min_overlap]
+    if len(probe) < min_overlap:
+        return 0
+    start = max(0, len(left) - window)
+    position = left.find(probe, start)
+    while position != -1:
+        if right.startswith(left[position:]):
+            return len(left) - position
+        position = left.find(probe, position + 1)
+    return 0
+
+
+def merge_spans(results: list, adjacency_gap: int = 0) -> list:
+    """
+    Merge chunks that overlap or touch back into contiguous spans.
+
+    Uses the `start_index` metadata from the splitter when present and falls back to
+    detecting shared text at chunk boundaries.
+
+    Returns:
+        list of {"text", "score", "ids", "metadata"} dicts, best score first
+    """
+    spans = [
+        {
+            "text": doc.page_content,
+            "score": score,
+            "ids": [doc.id],
+            "metadata": dict(doc.metadata or {}),
+            "start": (doc.metadata or {}).get("start_index"),
+        }
+        for doc, score in results
+    ]
+
+    merged = True
+    while merged:
+        merged = False
+        for i in range(len(spans)):
+            for j in range(len(spans)):
+                if i == j:
+                    continue
+                left, right = spans[i], spans[j]
+                if left["metadata"].get("source") != right["metadata"].get("source"):
+                    continue
+
+                if left["start"] is not None and right["start"] is not None:
+                    left_end = left["start"] + len(left["text"])
+                    if not (left["start"] <= right["start"] <= left_end + adjacency_gap):
+                        continue
+                    shared = max(0, left_end - right["start"])
+                    if shared >= len(right["text"]):
+                        text = left["text"]
+                    else:
+                        text = left["text"] + ("\n" if right["start"] > left_end else "") + right["text"][shared:]
+                else:
+                    shared = _overlap(left["text"], right["text"])
+                    if not shared:
+                        continue
+                    text = left["text"] + right["text"][shared:]
+
+                left["text"] = text
+                left["score"] = max(left["score"], right["score"])
+                left["ids"] += right["ids"]
+                spans.pop(j)
+                merged = True
+                break
+            if merged:
+                break
+
+    for span in spans:
+        span.pop("start")
+    return sorted(spans, key=lambda span: span["score"], reverse=True)
+
+
+def pack_context(
+    results: list,
+    token_budget: int = 2500,
+    embeddings: dict = None,
+    score_gap: float = 0.1,
+    max_score_drop: float = 0.25,
+    lambda_mult: float = 0.7,
+) -> list:
+    """
+    Turn ranked retrieval results into a compact, diverse context within a token budget.
+
+    Args:
+        results: [(Document, relevance score)] best first, e.g. from CachedRetriever.search
+        token_budget: maximum number of tokens of context to return
+        embeddings: optional {chunk id: vector} used for MMR similarity
+
+    Results are cut where the scores fall off, ordered by MMR, and added while the merged
+    spans still fit the budget. Overlapping neighbours are merged so shared text is only
+    sent once.
+    """
+    candidates = mmr_order(cut_by_score(results, score_gap, max_score_drop), embeddings, lambda_mult)
+
+    chosen = []
+    spans = []
+    for candidate in candidates:
+        trial = merge_spans(chosen + [candidate])
+        if sum(count_tokens(span["text"]) for span in trial) > token_budget:
+            continue
+        chosen.append(candidate)
+        spans = trial
+
+    if not spans and candidates:
+        # Even the best chunk is over budget: send a truncated version of it
+        spans = merge_spans(candidates[:1])
+        while count_tokens(spans[0]["text"]) > token_budget:
+            spans[0]["text"] = spans[0]["text"][: int(len(spans[0]["text"]) * 0.9)]
+    return spans
+
+
+def format_context(spans: list) -> str:
+    if not spans:
+        return "I found no relevant information in the document."
+    # Spans from a multi-paper search say which paper they came from
+    return "\n\n".join(
+        f"Document {i+1}" + (f" (paper: {span['metadata']['collection_id']})" if span["metadata"].get("collection_id") else "")
+        + f":\n{span['text']}"
+        for i, span in enumerate(spans)
+    )
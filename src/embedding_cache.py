@@ -0,0 +1,194 @@
+import os
+import asyncio
+import sqlite3
+import hashlib
+import threading
+import time
+from array import array
+from pathlib import Path
+from langchain_core.embeddings import Embeddings
+
+
+def embedding_model_signature(embedding_model) -> tuple:
+    """
+    Return the (deployment, api_version) pair that identifies the vectors produced by a model.
+
+    Vectors from different deployments or API versions are not interchangeable, so both
+    are part of the cache key.
+    """
+    deployment = (
+        getattr(embedding_model, "deployment", None)
+        or getattr(embedding_model, "model", None)
+        or os.getenv("AZURE_OPENAI_EMBEDDING_DEPLOYMENT", "")
+    )
+    api_version = (
+        getattr(embedding_model, "openai_api_version", None)
+        or os.getenv("AZURE_OPENAI_API_VERSION", "")
+    )
+    return str(deployment), str(api_version)
+
+
+class EmbeddingCache:
+    """
+    Content-addressed embedding store backed by a single SQLite file.
+
+    Rows are keyed by sha256(deployment, api_version, text) and hold the vector as a
+    float32 blob. When the cache grows past ``max_entries`` the least recently used
+    rows are evicted.
+    """
+
+    def __init__(self, path: Path, max_entries: int = 200_000):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS embeddings (
+                key TEXT PRIMARY KEY,
+                dim INTEGER NOT NULL,
+                vector BLOB NOT NULL,
+                last_used REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_last_used ON embeddings(last_used)")
+        self._conn.commit()
+
+    @staticmethod
+    def make_key(text: str, deployment: str, api_version: str) -> str:
+        digest = hashlib.sha256()
+        for part in (deployment, api_version, text):
+            digest.update(part.encode("utf-8"))
+            digest.update(b"\x00")
+        return digest.hexdigest()
+
+    def get_many(self, keys: list) -> dict:
+        """Return {key: vector} for every key present in the cache."""
+        found = {}
+        if not keys:
+            return found
+
+        with self._lock:
+            unique_keys = list(dict.fromkeys(keys))
+            # SQLite limits the number of bound parameters per statement
+            for start in range(0, len(unique_keys), 500):
+                batch = unique_keys[start:start + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})",
+                    batch,
+                ).fetchall()
+                for key, blob in rows:
+                    vector = array("f")
+                    vector.frombytes(blob)
+                    found[key] = vector.tolist()
+
+            if found:
+                now = time.time()
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_used = ? WHERE key = ?",
+                    [(now, key) for key in found],
+                )
+                self._conn.commit()
+
+            self.hits += sum(1 for key in keys if key in found)
+            self.misses += sum(1 for key in keys if key not in found)
+        return found
+
+    def put_many(self, items: dict) -> None:
+        """Store {key: vector} and evict the oldest rows if the cache is over its bound."""
+        if not items:
+            return
+
+        now = time.time()
+        rows = [
+            (key, len(vector), array("f", vector).tobytes(), now)
+            for key, vector in items.items()
+        ]
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, dim, vector, last_used) VALUES (?, ?, ?, ?)",
+                rows,
+            )
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self) -> None:
+        count = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        overflow = count - self.max_entries
+        if overflow > 0:
+            self._conn.execute(
+                """
+                DELETE FROM embeddings WHERE key IN (
+                    SELECT key FROM embeddings ORDER BY last_used ASC LIMIT ?
+                )
+                """,
+                (overflow,),
+            )
+            self.evictions += overflow
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "entries": len(self),
+            "max_entries": self.max_entries,
+        }
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Wraps an embedding model so that document embeddings are served from an EmbeddingCache.
+
+    Only cache misses are sent to the wrapped model. Query embeddings are passed straight
+    through, they are handled by the query path.
+    """
+
+    def __init__(self, embedding_model, cache: EmbeddingCache):
+        self.embedding_model = embedding_model
+        self.cache = cache
+        self.deployment, self.api_version = embedding_model_signature(embedding_model)
+
+    def embed_documents(self, texts: list) -> list:
+        keys = [EmbeddingCache.make_key(text, self.deployment, self.api_version) for text in texts]
+        cached = self.cache.get_many(keys)
+
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in cached and key not in missing:
+                missing[key] = text
+
+        if missing:
+            print(f"Embedding cache: {len(missing)} new chunks to embed, {len(texts) - len(missing)} served from cache")
+            vectors = self.embedding_model.embed_documents(list(missing.values()))
+            fresh = dict(zip(missing.keys(), vectors))
+            self.cache.put_many(fresh)
+            cached.update(fresh)
+
+        return [cached[key] for key in keys]
+
+    def embed_query(self, text: str) -> list:
+        return self.embedding_model.embed_query(text)
+
+    async def aembed_documents(self, texts: list) -> list:
+        return await asyncio.to_thread(self.embed_documents, texts)
+
+    async def aembed_query(self, text: str) -> list:
+        return await self.embedding_model.aembed_query(text)
@@ -0,0 +1,189 @@
+import os
+import time
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+from langchain_core.embeddings import Embeddings
+from tokens import count_tokens
+from telemetry import span
+
+load_dotenv()
+
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
+
+
+def _status_code(error: Exception):
+    status = getattr(error, "status_code", None)
+    if status is None and getattr(error, "response", None) is not None:
+        status = getattr(error.response, "status_code", None)
+    return status
+
+
+def _retry_after(error: Exception):
+    """Seconds the server asked us to wait, from Retry-After / retry-after-ms headers."""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        if headers.get("retry-after"):
+            return float(headers["retry-after"])
+    except (TypeError, ValueError):
+        pass
+    return None
+
+
+def _is_retryable(error: Exception) -> bool:
+    status = _status_code(error)
+    if status is not None:
+        return status in RETRYABLE_STATUS_CODES
+    # Connection resets and timeouts carry no status code
+    return type(error).__name__ in {"APIConnectionError", "APITimeoutError", "ConnectError", "ReadTimeout", "TimeoutError"}
+
+
+class EmbeddingEngine(Embeddings):
+    """
+    Embeds documents in token-budgeted batches, several batches in flight at once.
+
+    Args:
+        client: an `openai.OpenAI` / `openai.AzureOpenAI` client (or anything exposing `embeddings.create`)
+        model: model or Azure deployment name
+        max_batch_tokens: token budget per request
+        max_batch_size: maximum number of inputs per request
+        max_concurrency: number of requests in flight at once
+        max_retries: retries per batch on 429, 5xx and connection errors
+    """
+
+    def __init__(
+        self,
+        client,
+        model: str,
+        api_version: str = "",
+        max_batch_tokens: int = 20_000,
+        max_batch_size: int = 256,
+        max_concurrency: int = 4,
+        max_retries: int = 6,
+        base_delay: float = 1.0,
+        max_delay: float = 60.0,
+    ):
+        self.client = client
+        self.deployment = model
+        self.openai_api_version = api_version
+        self.max_batch_tokens = max_batch_tokens
+        self.max_batch_size = max_batch_size
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+        self._stats_lock = threading.Lock()
+        self.chunks_embedded = 0
+        self.requests = 0
+        self.retries = 0
+        self.rate_limited = 0
+        self.busy_seconds = 0.0
+
+    def make_batches(self, texts: list) -> list:
+        """Group text indices into batches that respect both the token and the size budget."""
+        batches = []
+        current = []
+        current_tokens = 0
+        for index, text in enumerate(texts):
+            tokens = count_tokens(text)
+            if current and (current_tokens + tokens > self.max_batch_tokens or len(current) >= self.max_batch_size):
+                batches.append(current)
+                current = []
+                current_tokens = 0
+            current.append(index)
+            current_tokens += tokens
+        if current:
+            batches.append(current)
+        return batches
+
+    def _embed_batch(self, texts: list) -> list:
+        attempt = 0
+        while True:
+            try:
+                with self._stats_lock:
+                    self.requests += 1
+                response = self.client.embeddings.create(input=texts, model=self.deployment)
+                data = sorted(response.data, key=lambda item: item.index)
+                return [item.embedding for item in data]
+
+            except Exception as e:
+                if attempt >= self.max_retries or not _is_retryable(e):
+                    raise
+
+                delay = _retry_after(e)
+                if delay is None:
+                    # Full jitter exponential backoff
+                    delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+                else:
+                    delay = min(self.max_delay, delay) * random.uniform(1.0, 1.25)
+
+                with self._stats_lock:
+                    self.retries += 1
+                    if _status_code(e) == 429:
+                        self.rate_limited += 1
+                print(f"Embedding request failed ({e.__class__.__name__}), retrying in {delay:.2f}s")
+                time.sleep(delay)
+                attempt += 1
+
+    def embed_documents(self, texts: list) -> list:
+        if not texts:
+            return []
+
+        batches = self.make_batches(texts)
+        vectors = [None] * len(texts)
+        started = time.perf_counter()
+
+        def run(batch):
+            return batch, self._embed_batch([texts[i] for i in batch])
+
+        with span("embedding", chunks=len(texts), batches=len(batches)):
+            with ThreadPoolExecutor(max_workers=max(1, min(self.max_concurrency, len(batches)))) as pool:
+                for batch, embeddings in pool.map(run, batches):
+                    for index, embedding in zip(batch, embeddings):
+                        vectors[index] = embedding
+
+        elapsed = time.perf_counter() - started
+        with self._stats_lock:
+            self.chunks_embedded += len(texts)
+            self.busy_seconds += elapsed
+        print(f"Embedded {len(texts)} chunks in {len(batches)} batches ({len(texts) / elapsed if elapsed else 0:.1f} chunks/s)")
+        return vectors
+
+    def embed_query(self, text: str) -> list:
+        return self._embed_batch([text])[0]
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            return {
+                "chunks_embedded": self.chunks_embedded,
+                "requests": self.requests,
+                "retries": self.retries,
+                "rate_limited": self.rate_limited,
+                "seconds": self.busy_seconds,
+                "chunks_per_second": self.chunks_embedded / self.busy_seconds if self.busy_seconds else 0.0,
+            }
+
+
+def build_embedding_engine(**kwargs) -> EmbeddingEngine:
+    """
+    Create an EmbeddingEngine for the configured embedding model (see model.py).
+
+    The client shares the process-wide connection pool (see http_pool.py) without its
+    transport retries, so the engine's Retry-After-aware backoff is the only retry layer.
+    With MODEL_BACKEND=local (or EMBEDDING_BASE_URL) it talks to an OpenAI-compatible server
+    such as `python src/openai_stub.py`; with MODEL_BACKEND=fake it uses the in-process fake
+    client from fake_models.py.
+    """
+    from model import uses_fake_models, get_openai_client
+    if uses_fake_models():
+        from fake_models import FakeEmbeddingsClient
+        client = FakeEmbeddingsClient(latency=float(os.getenv("FAKE_EMBEDDING_LATENCY", "0")))
+        return EmbeddingEngine(client, "fake-embedding", api_version="offline", **kwargs)
+
+    client, model = get_openai_client()
+    return EmbeddingEngine(client, model, api_version=os.getenv("AZURE_OPENAI_API_VERSION", ""), **kwargs)
@@ -0,0 +1,147 @@
+"""
+Deterministic stand-ins for the chat and embedding models, for offline runs and benchmarks.
+Selected for the whole process with MODEL_BACKEND=fake (see model.py).
+
+FakeChatModel follows the agent protocol: for every new question it first asks for the
+retriever tool, then answers from the retrieved text. Both models can inject latency.
+"""
+import time
+import json
+import asyncio
+import hashlib
+from types import SimpleNamespace
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, HumanMessage, ToolMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from openai_stub import hashed_embedding
+
+
+class FakeChatModel(BaseChatModel):
+    latency: float = 0.0
+    bound_tool_names: list = []
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat"
+
+    def bind_tools(self, tools, **kwargs):
+        return self.model_copy(update={"bound_tool_names": [getattr(t, "name", str(t)) for t in tools]})
+
+    def _reply(self, messages: list) -> AIMessage:
+        question = ""
+        tool_outputs = []
+        for message in messages:
+            if isinstance(message, HumanMessage):
+                question = message.content if isinstance(message.content, str) else str(message.content)
+                tool_outputs = []
+            elif isinstance(message, ToolMessage):
+                tool_outputs.append(str(message.content))
+
+        prompt_tokens = sum(len(str(message.content).split()) for message in messages)
+
+        if self.bound_tool_names and not tool_outputs:
+            call_id = "call_" + hashlib.sha1(question.encode("utf-8")).hexdigest()[:12]
+            return AIMessage(
+                content="",
+                tool_calls=[{"name": self.bound_tool_names[0], "args": {"query": question}, "id": call_id, "type": "tool_call"}],
+                usage_metadata={"input_tokens": prompt_tokens, "output_tokens": 8, "total_tokens": prompt_tokens + 8},
+            )
+
+        context = " ".join(" ".join(tool_outputs).split()[:50])
+        content = f"Based on the document: {context}" if context else f"I found no relevant information in the document about: {question}"
+        output_tokens = len(content.split())
+        return AIMessage(
+            content=content,
+            usage_metadata={"input_tokens": prompt_tokens, "output_tokens": output_tokens, "total_tokens": prompt_tokens + output_tokens},
+        )
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        if self.latency:
+            time.sleep(self.latency)
+        return ChatResult(generations=[ChatGeneration(message=self._reply(messages))])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return ChatResult(generations=[ChatGeneration(message=self._reply(messages))])
+
+    def _chunks(self, message: AIMessage):
+        if message.tool_calls:
+            yield AIMessageChunk(
+                content="",
+                tool_call_chunks=[
+                    {"name": t["name"], "args": json.dumps(t["args"]), "id": t["id"], "index": i}
+                    for i, t in enumerate(message.tool_calls)
+                ],
+                usage_metadata=message.usage_metadata,
+            )
+            return
+        words = message.content.split(" ")
+        for i, word in enumerate(words):
+            yield AIMessageChunk(
+                content=word if i == len(words) - 1 else word + " ",
+                usage_metadata=message.usage_metadata if i == len(words) - 1 else None,
+            )
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        if self.latency:
+            time.sleep(self.latency)
+        for chunk in self._chunks(self._reply(messages)):
+            if run_manager and chunk.content:
+                run_manager.on_llm_new_token(chunk.content, chunk=ChatGenerationChunk(message=chunk))
+            yield ChatGenerationChunk(message=chunk)
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        for chunk in self._chunks(self._reply(messages)):
+            if run_manager and chunk.content:
+                await run_manager.on_llm_new_token(chunk.content, chunk=ChatGenerationChunk(message=chunk))
+            yield ChatGenerationChunk(message=chunk)
+
+
+class FakeEmbeddings(Embeddings):
+    """Bag-of-words hashed embeddings: texts sharing words get similar vectors."""
+
+    def __init__(self, dim: int = 256, latency: float = 0.0):
+        self.dim = dim
+        self.latency = latency
+        self.deployment = "fake-embedding"
+        self.openai_api_version = "offline"
+
+    def embed_documents(self, texts: list) -> list:
+        if self.latency:
+            time.sleep(self.latency)
+        return [hashed_embedding(text, self.dim) for text in texts]
+
+    def embed_query(self, text: str) -> list:
+        return self.embed_documents([text])[0]
+
+    async def aembed_documents(self, texts: list) -> list:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return [hashed_embedding(text, self.dim) for text in texts]
+
+    async def aembed_query(self, text: str) -> list:
+        return (await self.aembed_documents([text]))[0]
+
+
+class FakeEmbeddingsClient:
+    """
+    Stand-in for an `openai.OpenAI` client's `embeddings.create`, producing FakeEmbeddings
+    vectors, so the EmbeddingEngine's batching and concurrency run offline.
+    """
+
+    def __init__(self, dim: int = 256, latency: float = 0.0):
+        self.dim = dim
+        self.latency = latency
+        self.embeddings = self
+
+    def create(self, input: list, model: str = None, **kwargs) -> SimpleNamespace:
+        if self.latency:
+            time.sleep(self.latency)
+        return SimpleNamespace(data=[
+            SimpleNamespace(index=i, embedding=hashed_embedding(text, self.dim))
+            for i, text in enumerate(input)
+        ])
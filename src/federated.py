@@ -0,0 +1,145 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor, wait
+from langchain_core.documents import Document
+from query_cache import normalize_query
+from telemetry import span
+
+
+def _attribute(results: list, collection_id: str) -> list:
+    """Copy results with the collection they came from recorded in their metadata."""
+    return [
+        (Document(id=doc.id, page_content=doc.page_content, metadata={**(doc.metadata or {}), "collection_id": collection_id}), score)
+        for doc, score in results
+    ]
+
+
+def merge_results(results_by_collection: dict, k: int) -> list:
+    """Merge per-collection [(Document, score)] lists into one top-k list, best score first."""
+    merged = [
+        item
+        for collection_id, results in results_by_collection.items()
+        for item in _attribute(results, collection_id)
+    ]
+    return sorted(merged, key=lambda item: item[1], reverse=True)[:k]
+
+
+class FederatedRetriever:
+    """
+    Searches several paper collections at once.
+
+    The query is embedded once and the same vector is searched in every collection in
+    parallel, so a cross-paper question costs one embedding call and takes about as long as
+    the slowest collection. Every collection gets its own thread for the query, so its
+    `timeout` (opening the store included) runs from when its search starts; collections
+    that do not answer in time are skipped for that query and reported with its results.
+
+    Scores are vector relevances from the shared embedding (hybrid retrievers scale their
+    fused scores by the same), so results from different papers are ranked against each
+    other directly. Each result carries its paper in `metadata["collection_id"]`.
+    """
+
+    def __init__(self, registry, collection_ids: list = None, k: int = 20, timeout: float = 5.0):
+        self.registry = registry
+        self.collection_ids = collection_ids
+        self.k = k
+        self.timeout = timeout
+
+    def _collections(self, collection_ids: list = None) -> list:
+        return list(collection_ids or self.collection_ids or self.registry.discover())
+
+    def embed_query(self, query: str) -> list:
+        key = normalize_query(query)
+        embedding = self.registry.query_cache.embeddings.get(key)
+        if embedding is None:
+            with span("embed_query"):
+                embedding = self.registry.get_embedding_model().embed_query(key)
+            self.registry.query_cache.embeddings.put(key, embedding)
+        return embedding
+
+    async def aembed_query(self, query: str) -> list:
+        key = normalize_query(query)
+        embedding = self.registry.query_cache.embeddings.get(key)
+        if embedding is None:
+            with span("embed_query"):
+                embedding = await self.registry.get_embedding_model().aembed_query(key)
+            self.registry.query_cache.embeddings.put(key, embedding)
+        return embedding
+
+    def _search_one(self, collection_id: str, query: str, embedding: list, k: int) -> list:
+        # Leased, so searching more papers than stay open does not close one mid-search
+        with self.registry.lease(collection_id) as collection:
+            return collection.retriever.search_with_embedding(query, embedding, k)
+
+    @staticmethod
+    def _pool(collections: list) -> ThreadPoolExecutor:
+        """A thread per collection for one query, so no search waits for a worker."""
+        return ThreadPoolExecutor(max_workers=max(len(collections), 1), thread_name_prefix="federated-search")
+
+    def search(self, query: str, k: int = None, collection_ids: list = None) -> tuple:
+        """
+        Search the collections for `query`.
+
+        Returns:
+            tuple: the top-k [(Document, score)] across collections, best first, and
+            {"timeouts": [collection ids], "errors": {collection id: error}} for the
+            collections left out
+        """
+        k = k or self.k
+        embedding = self.embed_query(query)
+        collections = self._collections(collection_ids)
+        pool = self._pool(collections)
+        futures = {
+            pool.submit(self._search_one, collection_id, query, embedding, k): collection_id
+            for collection_id in collections
+        }
+        # A search that overruns its timeout finishes in the background
+        pool.shutdown(wait=False)
+        done, not_done = wait(futures, timeout=self.timeout)
+
+        results_by_collection = {}
+        failures = {"timeouts": sorted(futures[future] for future in not_done), "errors": {}}
+        for future in done:
+            try:
+                results_by_collection[futures[future]] = future.result()
+            except Exception as e:
+                failures["errors"][futures[future]] = str(e)
+                print(f"Search in {futures[future]} failed: {e}")
+        if failures["timeouts"]:
+            print(f"Search timed out in: {failures['timeouts']}")
+        return merge_results(results_by_collection, k), failures
+
+    async def asearch(self, query: str, k: int = None, collection_ids: list = None) -> tuple:
+        """Async version of `search`."""
+        k = k or self.k
+        embedding = await self.aembed_query(query)
+        collections = self._collections(collection_ids)
+        pool = self._pool(collections)
+        loop = asyncio.get_running_loop()
+        searches = [
+            loop.run_in_executor(pool, self._search_one, collection_id, query, embedding, k)
+            for collection_id in collections
+        ]
+        pool.shutdown(wait=False)
+        outcomes = await asyncio.gather(
+            *(asyncio.wait_for(search, self.timeout) for search in searches),
+            return_exceptions=True,
+        )
+
+        results_by_collection = {}
+        failures = {"timeouts": [], "errors": {}}
+        for collection_id, outcome in zip(collections, outcomes):
+            if isinstance(outcome, asyncio.TimeoutError):
+                failures["timeouts"].append(collection_id)
+            elif isinstance(outcome, Exception):
+                failures["errors"][collection_id] = str(outcome)
+            else:
+                results_by_collection[collection_id] = outcome
+        return merge_results(results_by_collection, k), failures
+
+    def get_embeddings(self, ids_by_collection: dict) -> dict:
+        """Stored chunk embeddings as {chunk id: vector} for {collection id: [chunk ids]}."""
+        embeddings = {}
+        for collection_id, ids in ids_by_collection.items():
+            with self.registry.lease(collection_id) as collection:
+                embeddings.update(collection.retriever.get_embeddings(ids))
+        return embeddings
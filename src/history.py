@@ -0,0 +1,116 @@
+import hashlib
+from langchain_core.messages import HumanMessage, SystemMessage
+from query_cache import LRUCache
+from tokens import count_tokens
+
+
+def split_turns(messages: list) -> list:
+    """Group messages into turns, each starting at a HumanMessage."""
+    turns = []
+    for message in messages:
+        if isinstance(message, HumanMessage) or not turns:
+            turns.append([])
+        turns[-1].append(message)
+    return turns
+
+
+def _message_tokens(message) -> int:
+    return count_tokens(message.content if isinstance(message.content, str) else str(message.content))
+
+
+def extractive_summary(messages: list, max_chars_per_message: int = 200) -> str:
+    """Cheap summary without an LLM call: each earlier question with the start of its answer."""
+    lines = []
+    for message in messages:
+        content = message.content if isinstance(message.content, str) else str(message.content)
+        content = " ".join(content.split())
+        if not content:
+            continue
+        if len(content) > max_chars_per_message:
+            content = content[:max_chars_per_message] + "..."
+        lines.append(f"- {'User' if isinstance(message, HumanMessage) else 'Assistant'}: {content}")
+    return "\n".join(lines)
+
+
+def llm_summarizer(llm):
+    """Build a summarizer that asks `llm` for a short summary of the earlier conversation."""
+    def summarize(messages: list) -> str:
+        transcript = extractive_summary(messages, max_chars_per_message=1000)
+        response = llm.invoke([
+            SystemMessage(content="Summarize this conversation between a user and a research assistant in a few sentences. Keep names, numbers and conclusions."),
+            HumanMessage(content=transcript),
+        ])
+        return response.content
+    return summarize
+
+
+class HistoryManager:
+    """
+    Keeps the prompt for each LLM call within a token budget, however long the conversation is.
+
+    The current turn is always sent in full. Earlier turns are reduced to the question and the
+    final answer (tool calls and retrieved chunks are stale by then). If they still exceed
+    `history_token_budget`, the oldest turns are replaced with a summary, which is cached so it
+    is only computed once per set of dropped turns.
+    """
+
+    def __init__(self, history_token_budget: int = 3000, summarizer=extractive_summary, summary_token_budget: int = 400):
+        self.history_token_budget = history_token_budget
+        self.summarizer = summarizer
+        self.summary_token_budget = summary_token_budget
+        self._summaries = LRUCache(256)
+
+    @staticmethod
+    def _compact_turn(turn: list) -> list:
+        """Keep the question and the final answer of a finished turn."""
+        compact = [turn[0]]
+        for message in turn[1:]:
+            if getattr(message, "type", None) == "ai" and not getattr(message, "tool_calls", None) and message.content:
+                compact.append(message)
+        return compact
+
+    def _summarize(self, messages: list) -> str:
+        digest = hashlib.sha1()
+        for message in messages:
+            digest.update(str(message.content).encode("utf-8"))
+            digest.update(b"\x00")
+        key = digest.hexdigest()
+
+        summary = self._summaries.get(key)
+        if summary is None:
+            summary = self.summarizer(messages)
+            # Summaries must respect their own budget too; the most recent part is kept
+            while summary and count_tokens(summary) > self.summary_token_budget:
+                summary = summary[len(summary) // 5:]
+            self._summaries.put(key, summary)
+        return summary
+
+    def prepare(self, messages: list) -> list:
+        """Return the messages to send to the LLM for this call."""
+        turns = split_turns(list(messages))
+        if len(turns) <= 1:
+            return list(messages)
+
+        current = turns[-1]
+        previous = [self._compact_turn(turn) if isinstance(turn[0], HumanMessage) else turn for turn in turns[:-1]]
+
+        kept = []
+        used = 0
+        # Walk backwards so the most recent turns are the ones that survive
+        for turn in reversed(previous):
+            tokens = sum(_message_tokens(message) for message in turn)
+            if used + tokens > self.history_token_budget:
+                break
+            kept.insert(0, turn)
+            used += tokens
+
+        dropped = [message for turn in previous[: len(previous) - len(kept)] for message in turn]
+        prepared = []
+        if dropped:
+            summary = self._summarize(dropped)
+            if summary:
+                prepared.append(SystemMessage(content=f"Summary of the earlier conversation:\n{summary}"))
+        for turn in kept:
+            prepared.extend(turn)
+        prepared.extend(current)
+        return prepared
@@ -0,0 +1,235 @@
+"""
+Shared HTTP connection pool for every model call (chat, vision, embeddings).
+
+One keep-alive `httpx.Client` (and one `httpx.AsyncClient`) per process, so calls reuse warm
+TLS connections instead of each client opening its own. Requests get explicit connect / read
+timeouts, and failed requests (connection errors, timeouts, 429 and 5xx) are retried by the
+transport under a process-wide retry budget: retries may add at most `MODEL_RETRY_RATIO` of
+the request volume (plus a small floor), so an outage does not multiply the load on the
+provider. The SDK clients are created with `max_retries=0` and leave retrying to the pool.
+The embedding engine retries on its own (it waits out the provider's full Retry-After during
+bulk ingestion), so its client uses the same connections without transport retries.
+
+Settings (environment):
+    MODEL_MAX_CONNECTIONS      connections in the pool (default 32)
+    MODEL_KEEPALIVE_SECONDS    idle time before a pooled connection is closed (default 60)
+    MODEL_CONNECT_TIMEOUT      seconds to establish a connection (default 5)
+    MODEL_MAX_RETRIES          retries per request (default 2)
+    MODEL_RETRY_RATIO          retry budget as a fraction of requests (default 0.2)
+"""
+import os
+import time
+import random
+import asyncio
+import weakref
+import threading
+from functools import cache
+import httpx
+from telemetry import metrics
+
+RETRYABLE_STATUS = {408, 429, 500, 502, 503, 504}
+RETRYABLE_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.ReadTimeout, httpx.WriteTimeout, httpx.PoolTimeout, httpx.RemoteProtocolError)
+
+
+class RetryBudget:
+    """
+    Token bucket limiting retries to a fraction of requests.
+
+    Every request deposits `ratio` tokens and every retry spends one. `min_per_second`
+    tokens trickle in regardless, so a quiet process can still retry.
+    """
+
+    def __init__(self, ratio: float = 0.2, min_per_second: float = 1.0, max_tokens: float = 20.0):
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.max_tokens = max_tokens
+        self.tokens = max_tokens
+        self.requests = 0
+        self.retries = 0
+        self.exhausted = 0
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, amount: float) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.max_tokens, self.tokens + amount + (now - self._updated) * self.min_per_second)
+        self._updated = now
+
+    def record_request(self) -> None:
+        with self._lock:
+            self.requests += 1
+            self._refill(self.ratio)
+
+    def try_spend(self) -> bool:
+        with self._lock:
+            self._refill(0.0)
+            if self.tokens >= 1.0:
+                self.tokens -= 1.0
+                self.retries += 1
+                return True
+            self.exhausted += 1
+            return False
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"requests": self.requests, "retries": self.retries, "exhausted": self.exhausted, "tokens": round(self.tokens, 2)}
+
+
+def _retry_delay(attempt: int, response: httpx.Response = None, max_delay: float = 8.0) -> float:
+    if response is not None:
+        retry_after = response.headers.get("retry-after-ms")
+        if retry_after:
+            try:
+                return min(max_delay, float(retry_after) / 1000)
+            except ValueError:
+                pass
+        retry_after = response.headers.get("retry-after")
+        if retry_after:
+            try:
+                return min(max_delay, float(retry_after))
+            except ValueError:
+                pass
+    # Full jitter exponential backoff
+    return random.uniform(0, min(max_delay, 0.5 * 2 ** attempt))
+
+
+def _should_retry(attempt: int, max_retries: int, budget: RetryBudget, reason: str) -> bool:
+    if attempt >= max_retries:
+        return False
+    if not budget.try_spend():
+        metrics.inc("rag_model_retry_budget_exhausted_total", help="Retries skipped because the retry budget was spent")
+        return False
+    metrics.inc("rag_model_retries_total", help="Model API requests retried", reason=reason)
+    return True
+
+
+class RetryTransport(httpx.BaseTransport):
+    """Sync transport retrying failed requests under a shared RetryBudget."""
+
+    def __init__(self, transport: httpx.BaseTransport, budget: RetryBudget, max_retries: int = 2):
+        self.transport = transport
+        self.budget = budget
+        self.max_retries = max_retries
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        self.budget.record_request()
+        attempt = 0
+        while True:
+            try:
+                response = self.transport.handle_request(request)
+            except RETRYABLE_ERRORS as e:
+                if not _should_retry(attempt, self.max_retries, self.budget, type(e).__name__):
+                    raise
+                time.sleep(_retry_delay(attempt))
+            else:
+                if response.status_code not in RETRYABLE_STATUS or not _should_retry(attempt, self.max_retries, self.budget, str(response.status_code)):
+                    return response
+                response.read()
+                response.close()
+                time.sleep(_retry_delay(attempt, response))
+            attempt += 1
+
+    def close(self) -> None:
+        self.transport.close()
+
+
+class AsyncRetryTransport(httpx.AsyncBaseTransport):
+    """
+    Async counterpart of RetryTransport.
+
+    Pooled connections belong to the event loop that opened them, and some callers (e.g.
+    image descriptions) run each batch in a fresh `asyncio.run`, so each loop gets its own
+    pool from `transport_factory`.
+    """
+
+    def __init__(self, transport_factory, budget: RetryBudget, max_retries: int = 2):
+        self.transport_factory = transport_factory
+        self.budget = budget
+        self.max_retries = max_retries
+        self._transports = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+
+    @property
+    def transport(self) -> httpx.AsyncBaseTransport:
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            transport = self._transports.get(loop)
+            if transport is None:
+                transport = self._transports[loop] = self.transport_factory()
+            return transport
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        self.budget.record_request()
+        transport = self.transport
+        attempt = 0
+        while True:
+            try:
+                response = await transport.handle_async_request(request)
+            except RETRYABLE_ERRORS as e:
+                if not _should_retry(attempt, self.max_retries, self.budget, type(e).__name__):
+                    raise
+                await asyncio.sleep(_retry_delay(attempt))
+            else:
+                if response.status_code not in RETRYABLE_STATUS or not _should_retry(attempt, self.max_retries, self.budget, str(response.status_code)):
+                    return response
+                await response.aread()
+                await response.aclose()
+                await asyncio.sleep(_retry_delay(attempt, response))
+            attempt += 1
+
+    async def aclose(self) -> None:
+        await self.transport.aclose()
+
+
+def _limits() -> httpx.Limits:
+    max_connections = int(os.getenv("MODEL_MAX_CONNECTIONS", "32"))
+    return httpx.Limits(
+        max_connections=max_connections,
+        max_keepalive_connections=max_connections,
+        keepalive_expiry=float(os.getenv("MODEL_KEEPALIVE_SECONDS", "60")),
+    )
+
+
+def default_timeout(read: float = 60.0) -> httpx.Timeout:
+    """Connect quickly or fail; `read` bounds the wait for a response."""
+    return httpx.Timeout(read, connect=float(os.getenv("MODEL_CONNECT_TIMEOUT", "5")))
+
+
+@cache
+def get_retry_budget() -> RetryBudget:
+    budget = RetryBudget(ratio=float(os.getenv("MODEL_RETRY_RATIO", "0.2")))
+    metrics.register_collector(lambda: {f"rag_model_retry_budget_{key}": value for key, value in budget.stats().items()})
+    return budget
+
+
+@cache
+def _http_transport() -> httpx.HTTPTransport:
+    return httpx.HTTPTransport(limits=_limits())
+
+
+@cache
+def get_http_client(retry: bool = True) -> httpx.Client:
+    """
+    Process-wide keep-alive client shared by the sync chat, vision and embedding clients.
+    With `retry=False` the same connections are used without the retrying transport, for
+    callers that retry themselves.
+    """
+    if not retry:
+        return httpx.Client(transport=_http_transport(), timeout=default_timeout())
+    transport = RetryTransport(
+        _http_transport(),
+        get_retry_budget(),
+        max_retries=int(os.getenv("MODEL_MAX_RETRIES", "2")),
+    )
+    return httpx.Client(transport=transport, timeout=default_timeout())
+
+
+@cache
+def get_async_http_client() -> httpx.AsyncClient:
+    """Process-wide keep-alive client for async calls; shares the retry budget with the sync one."""
+    transport = AsyncRetryTransport(
+        lambda: httpx.AsyncHTTPTransport(limits=_limits()),
+        get_retry_budget(),
+        max_retries=int(os.getenv("MODEL_MAX_RETRIES", "2")),
+    )
+    return httpx.AsyncClient(transport=transport, timeout=default_timeout())
@@ -1,61 +1,203 @@
 import os
+import re
+import json
 import base64
+import asyncio
+import hashlib
 from pathlib import Path
-from model import llm
+from concurrent.futures import ThreadPoolExecutor
+from model import get_vision_llm
+from telemetry import span, traced, record_llm_call
 
-def get_image_info(directory: Path) -> dict:
+IMAGE_PROMPT = "Describe the image in detail."
+SIDECAR_FILE = "image_descriptions.json"
+# Blocks that older versions appended to content.md on every run, one "### file" entry per image
+LEGACY_BLOCKS = re.compile(r"(?:\n\n## Image Descriptions\n\n(?:### [^\n]+\n\n.*?\n\n-{50}\n\n)*)+\Z", re.S)
+LEGACY_ENTRY = re.compile(r"### ([^\n]+)\n\n(.*?)\n\n-{50}\n\n", re.S)
+
+
+def image_cache_key(file_path: Path, prompt: str = IMAGE_PROMPT) -> str:
+    """SHA-256 of the image bytes plus the prompt, so a changed image or prompt gets a fresh description."""
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as image_file:
+        for block in iter(lambda: image_file.read(1 << 20), b""):
+            digest.update(block)
+    digest.update(b"\x00")
+    digest.update(prompt.encode("utf-8"))
+    return digest.hexdigest()
+
+
+def _load_sidecar(directory: Path) -> dict:
+    sidecar_path = Path(directory) / SIDECAR_FILE
+    if not sidecar_path.exists():
+        return {"files": {}, "descriptions": {}}
+    with open(sidecar_path, "r", encoding="utf-8") as f:
+        sidecar = json.load(f)
+    sidecar.setdefault("files", {})
+    sidecar.setdefault("descriptions", {})
+    return sidecar
+
+
+def _save_sidecar(directory: Path, sidecar: dict) -> None:
+    sidecar_path = Path(directory) / SIDECAR_FILE
+    tmp_path = sidecar_path.with_suffix(".json.tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(sidecar, f, indent=2, ensure_ascii=False)
+    os.replace(tmp_path, sidecar_path)
+
+
+def _migrate_content(directory: Path, sidecar: dict, keys: dict) -> None:
+    """
+    Move the Image Descriptions blocks older versions appended to content.md into a new
+    sidecar, so they are not indexed twice. `keys` maps the current images to their cache keys.
+    """
+    content_path = Path(directory) / "content.md"
+    if not content_path.exists():
+        return
+    content = content_path.read_text(encoding="utf-8")
+    match = LEGACY_BLOCKS.search(content)
+    if not match:
+        return
+
+    # Later blocks are newer, so they win
+    for file, description in LEGACY_ENTRY.findall(match.group(0)):
+        if file in keys and not description.startswith("Error processing image:"):
+            sidecar["descriptions"][keys[file]] = description
+    sidecar["files"] = {file: key for file, key in keys.items() if key in sidecar["descriptions"]}
+    # The sidecar is written first, so an interrupted move loses nothing
+    _save_sidecar(directory, sidecar)
+    tmp_path = content_path.with_suffix(".md.tmp")
+    tmp_path.write_text(content[:match.start()] + "\n", encoding="utf-8")
+    os.replace(tmp_path, content_path)
+    print(f"Moved the image descriptions in {content_path} to {SIDECAR_FILE}")
+
+
+def load_image_descriptions(directory: Path) -> dict:
+    """Return {file name: description} for the images recorded in the sidecar, in file-name order."""
+    sidecar = _load_sidecar(directory)
+    descriptions = {}
+    for file in sorted(sidecar["files"]):
+        description = sidecar["descriptions"].get(sidecar["files"][file])
+        if description is not None:
+            descriptions[file] = description
+    return descriptions
+
+
+def render_image_descriptions(descriptions: dict) -> str:
+    """Markdown view of the image descriptions, merged into the document at chunking time."""
+    if not descriptions:
+        return ""
+    parts = ["## Image Descriptions\n\n"]
+    for file, description in descriptions.items():
+        parts.append(f"### {file}\n\n{description}\n\n")
+    return "".join(parts)
+
+
+def _build_message(file_path: Path) -> dict:
+    # Read and encode the image as base64
+    with open(file_path, "rb") as image_file:
+        image_data = base64.b64encode(image_file.read()).decode('utf-8')
+
+    # Determine the MIME type
+    mime_type = "image/png"
+
+    # Create the message with base64 data URL
+    return {
+        "role": "user",
+        "content": [
+            {"type": "text", "text": IMAGE_PROMPT},
+            {"type": "image_url", "image_url": {"url": f"data:{mime_type};base64,{image_data}"}}
+        ]
+    }
+
+
+async def _describe_image(file_path: Path, semaphore: asyncio.Semaphore, timeout: float) -> str:
+    async with semaphore:
+        print(f"Processing: {file_path.name}")
+        message = await asyncio.to_thread(_build_message, file_path)
+        with span("describe_image", image=file_path.name):
+            response = await asyncio.wait_for(get_vision_llm().ainvoke([message]), timeout=timeout)
+        record_llm_call(response, agent="vision")
+        print(f'Response for {file_path.name}: {response.content}')
+        return response.content
+
+
+async def _describe_images(file_paths: list, max_concurrency: int, timeout: float) -> list:
+    semaphore = asyncio.Semaphore(max_concurrency)
+    return await asyncio.gather(
+        *(_describe_image(file_path, semaphore, timeout) for file_path in file_paths),
+        return_exceptions=True,
+    )
+
+
+def _run(coro):
+    """Run a coroutine to completion, also from code that already has an event loop running (e.g. notebooks)."""
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coro)
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        return pool.submit(asyncio.run, coro).result()
+
+
+@traced("get_image_info")
+def get_image_info(directory: Path, max_concurrency: int = 4, timeout: float = 120.0) -> dict:
+    """
+    Describe every PNG in `directory` with the vision model and record the descriptions in
+    the image_descriptions.json sidecar.
+
+    Descriptions are cached by the SHA-256 of the image bytes plus the prompt, so unchanged
+    images are never sent to the model twice, and those of images no longer in `directory`
+    are dropped. The sidecar is merged into the document view at chunking time (see
+    `load_image_descriptions`); content.md itself is left untouched, except that descriptions
+    older versions appended to it are moved to the sidecar when it is first created.
+
+    Up to `max_concurrency` images are described at once and each request is abandoned after
+    `timeout` seconds. Failed images are not cached and are retried on the next run.
+
+    Returns:
+        dict: {file name: description or error message}
+    """
+    descriptions = {}
     try:
-        content_file = directory / "content.md"
-        png_files = [file for file in os.listdir(directory) if file.endswith(".png")]
+        directory = Path(directory)
+        png_files = sorted(file for file in os.listdir(directory) if file.endswith(".png"))
 
         if not png_files:
             print("No PNG files found in the directory")
-        else:
-            # Open the content.md file in append mode
-            with open(content_file, "a", encoding="utf-8") as md_file:
-                md_file.write("\n\n## Image Descriptions\n\n")
-                
-                for file in png_files:
-                    file_path = Path(directory, file)
-                    print(f"Found: {file_path}")
-                    
-                    if file_path.exists():
-                        print(f"Processing: {file_path.name}")
-                        
-                        try:
-                            # Read and encode the image as base64
-                            with open(file_path, "rb") as image_file:
-                                image_data = base64.b64encode(image_file.read()).decode('utf-8')
-                            
-                            # Determine the MIME type
-                            mime_type = "image/png"
-                            
-                            # Create the message with base64 data URL
-                            message = {
-                                "role": "user",
-                                "content": [
-                                    {"type": "text", "text": "Describe the image in detail."},
-                                    {"type": "image_url", "image_url": {"url": f"data:{mime_type};base64,{image_data}"}}
-                                ]
-                            }
-                            
-                            response = llm.invoke([message])
-                            print(f'Response for {file}: {response.content}')
-                            
-                            # Write to markdown file
-                            md_file.write(f"### {file}\n\n")
-                            md_file.write(f"{response.content}\n\n")
-                            md_file.write("-" * 50 + "\n\n")
-                            
-                        except Exception as e:
-                            print(f"Error processing {file}: {e}")
-                            md_file.write(f"### {file}\n\n")
-                            md_file.write(f"Error processing image: {e}\n\n")
-                            md_file.write("-" * 50 + "\n\n")
-                    else:
-                        print(f"File not found: {file_path}")
+            return descriptions
+
+        sidecar = _load_sidecar(directory)
+        keys = {file: image_cache_key(Path(directory, file)) for file in png_files}
+        if not (directory / SIDECAR_FILE).exists():
+            _migrate_content(directory, sidecar, keys)
+
+        pending = [file for file in png_files if keys[file] not in sidecar["descriptions"]]
+        for file in png_files:
+            print(f"Found: {Path(directory, file)}{'' if file in pending else ' (cached)'}")
+
+        results = _run(_describe_images([Path(directory, file) for file in pending], max_concurrency, timeout)) if pending else []
+
+        for file, result in zip(pending, results):
+            if isinstance(result, BaseException):
+                error = "timed out" if isinstance(result, asyncio.TimeoutError) else result
+                print(f"Error processing {file}: {error}")
+                descriptions[file] = f"Error processing image: {error}"
+            else:
+                sidecar["descriptions"][keys[file]] = result
+
+        sidecar["files"] = {file: keys[file] for file in png_files if keys[file] in sidecar["descriptions"]}
+        current = set(sidecar["files"].values())
+        sidecar["descriptions"] = {key: description for key, description in sidecar["descriptions"].items() if key in current}
+        _save_sidecar(directory, sidecar)
+
+        for file in png_files:
+            if file in sidecar["files"]:
+                descriptions[file] = sidecar["descriptions"][keys[file]]
 
     except FileNotFoundError:
-        print(f"Directory not found: {biology_dir}")
+        print(f"Directory not found: {directory}")
     except Exception as e:
-        print(f"Error accessing directory: {e}")
\ No newline at end of file
+        print(f"Error accessing directory: {e}")
+
+    return dict(sorted(descriptions.items()))
@@ -0,0 +1,127 @@
+import os
+import hashlib
+from pathlib import Path
+
+VERSION_FILE = "index_version"
+
+
+def chunk_id(text: str, occurrence: int = 0) -> str:
+    """
+    Stable ID for a chunk, derived from its content.
+
+    Identical chunks in the same document are told apart by their occurrence number,
+    so the same document always produces the same ID set.
+    """
+    digest = hashlib.sha256(text.encode("utf-8"))
+    if occurrence:
+        digest.update(f"#{occurrence}".encode("utf-8"))
+    return digest.hexdigest()
+
+
+def iter_chunk_ids(docs):
+    """Yield (stable ID, document) for each document of an iterable, without holding the texts."""
+    seen = {}
+    for doc in docs:
+        base_id = chunk_id(doc.page_content)
+        occurrence = seen.get(base_id, 0)
+        seen[base_id] = occurrence + 1
+        yield (base_id if not occurrence else chunk_id(doc.page_content, occurrence)), doc
+
+
+def assign_chunk_ids(docs: list) -> list:
+    """Return one stable ID per document, in order."""
+    return [doc_id for doc_id, _ in iter_chunk_ids(docs)]
+
+
+def sync_collection(vectorstore, docs, batch_size: int = 1000) -> dict:
+    """
+    Bring a vector store collection in line with `docs` without re-adding what it already holds.
+
+    Chunks whose IDs are already stored are left alone, new chunks are embedded and added,
+    and chunks that are no longer part of the document are deleted. Running it twice on
+    the same documents is a no-op.
+
+    `docs` may be a lazy iterable: new chunks are embedded and added a batch at a time as
+    they arrive, so only one batch of chunks is waiting to be embedded at once. The chunk
+    IDs of the whole document are kept, to find the stale ones.
+
+    Returns:
+        dict: counts of added, deleted and unchanged chunks
+    """
+    existing_ids = set(vectorstore.get(include=[])["ids"])
+
+    ids = []
+    added = 0
+    new_docs = []
+    new_ids = []
+
+    def flush():
+        vectorstore.add_documents(documents=new_docs, ids=new_ids)
+        new_docs.clear()
+        new_ids.clear()
+
+    for doc_id, doc in iter_chunk_ids(docs):
+        ids.append(doc_id)
+        if doc_id not in existing_ids:
+            new_docs.append(doc)
+            new_ids.append(doc_id)
+            added += 1
+            if len(new_docs) >= batch_size:
+                flush()
+    if new_docs:
+        flush()
+
+    stale_ids = list(existing_ids - set(ids))
+
+    # Stores whose deletes rewrite the whole index take every stale ID in one call
+    delete_batch_size = getattr(vectorstore, "delete_batch_size", batch_size) or max(len(stale_ids), 1)
+    for start in range(0, len(stale_ids), delete_batch_size):
+        vectorstore.delete(ids=stale_ids[start:start + delete_batch_size])
+
+    if added or stale_ids or read_index_version(vectorstore) is None:
+        write_index_version(vectorstore, ids)
+
+    stats = {
+        "added": added,
+        "deleted": len(stale_ids),
+        "unchanged": len(ids) - added,
+    }
+    print(f"Index sync: {stats['added']} added, {stats['deleted']} deleted, {stats['unchanged']} unchanged")
+    return stats
+
+
+def _version_path(vectorstore):
+    persist_directory = getattr(vectorstore, "_persist_directory", None)
+    return Path(persist_directory) / VERSION_FILE if persist_directory else None
+
+
+def write_index_version(vectorstore, ids: list) -> str:
+    """Record a fingerprint of the collection contents next to the persisted store."""
+    version = hashlib.sha256("\n".join(sorted(ids)).encode("utf-8")).hexdigest()[:16]
+    path = _version_path(vectorstore)
+    if path is not None:
+        tmp_path = path.with_suffix(".tmp")
+        tmp_path.write_text(version, encoding="utf-8")
+        os.replace(tmp_path, path)
+    return version
+
+
+def read_index_version(vectorstore):
+    path = _version_path(vectorstore)
+    if path is None or not path.exists():
+        return None
+    return path.read_text(encoding="utf-8").strip()
+
+
+def collection_version(vectorstore) -> str:
+    """
+    Cheap identifier that changes whenever the collection contents change.
+
+    Uses the fingerprint written by sync_collection and falls back to the chunk count for
+    collections that were built before it existed.
+    """
+    version = read_index_version(vectorstore)
+    if version is not None:
+        return version
+    # Chroma counts through its collection, the memory-mapped index directly
+    return f"count:{getattr(vectorstore, '_collection', vectorstore).count()}"
@@ -0,0 +1,346 @@
+"""
+Non-interactive ingestion of many papers.
+
+Each URL goes through four stages, run as concurrent workers connected by bounded queues,
+so one paper is being scraped while another is described or embedded:
+
+    scrape -> describe (image descriptions) -> chunk -> embed (vector store + BM25)
+
+The chunk stage hands each paper to the embed stage before chunking it and then feeds it its
+chunks through a bounded queue, so the paper is chunked while the embed stage indexes it, a
+batch at a time, and only up to `chunk_queue_size` chunks wait between the two.
+
+Progress is recorded per paper and stage in a JSON manifest. Re-running with the same
+manifest skips finished papers and resumes the others after their last completed stage.
+With --refresh, finished papers are checked for changes instead: pages the server reports
+as not modified, or whose content hash is unchanged, stop after the scrape stage.
+
+    python src/ingest.py --urls urls.txt --manifest artifacts/ingest_manifest.json
+    python src/ingest.py --urls urls.txt --manifest artifacts/ingest_manifest.json --refresh
+"""
+import os
+import json
+import time
+import queue
+import argparse
+import threading
+from pathlib import Path
+from datetime import datetime
+from scrapper import scrape_if_changed
+from image_info import get_image_info
+import retriever
+
+STAGES = ["scrape", "describe", "chunk", "embed"]
+_DONE = object()
+
+
+class _ChunkingFailed(Exception):
+    """Ends a chunk stream whose chunking failed; the chunk stage reports the failure."""
+
+
+class _ChunkStream:
+    """Chunks of one paper, passed from the chunk stage to the embed stage through a bounded queue."""
+
+    def __init__(self, size: int):
+        self.queue = queue.Queue(maxsize=size)
+        self.finished = False
+
+    def put(self, chunk) -> None:
+        self.queue.put(chunk)
+
+    def __iter__(self):
+        while not self.finished:
+            chunk = self.queue.get()
+            if chunk is _DONE or isinstance(chunk, _ChunkingFailed):
+                self.finished = True
+                if chunk is not _DONE:
+                    raise chunk
+                return
+            yield chunk
+
+    def discard(self) -> None:
+        """Drop the rest of the stream, so a chunk stage waiting on a full queue can finish."""
+        while not self.finished:
+            chunk = self.queue.get()
+            self.finished = chunk is _DONE or isinstance(chunk, _ChunkingFailed)
+
+
+class IngestManifest:
+    """
+    JSON record of ingestion progress: {url: {"page_identifier", "output_dir", "stages": {stage: info}, "error"}}.
+
+    Saved atomically after every update, so a crash loses at most the stage in progress.
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        self.papers = {}
+        if self.path.exists():
+            with open(self.path, "r", encoding="utf-8") as f:
+                self.papers = json.load(f)
+
+    def _save(self) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_suffix(".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.papers, f, indent=2, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+    def paper(self, url: str) -> dict:
+        with self._lock:
+            return json.loads(json.dumps(self.papers.get(url, {"stages": {}})))
+
+    def is_done(self, url: str, stage: str) -> bool:
+        with self._lock:
+            return stage in self.papers.get(url, {}).get("stages", {})
+
+    def complete(self, url: str, stage: str, seconds: float, **info) -> None:
+        with self._lock:
+            paper = self.papers.setdefault(url, {"stages": {}})
+            paper.update(info)
+            paper["stages"][stage] = {"seconds": round(seconds, 3), "finished_at": datetime.now().isoformat()}
+            paper.pop("error", None)
+            self._save()
+
+    def fail(self, url: str, stage: str, error: str) -> None:
+        with self._lock:
+            paper = self.papers.setdefault(url, {"stages": {}})
+            paper["error"] = {"stage": stage, "message": error}
+            self._save()
+
+    def clear_stages(self, url: str, stages: list) -> None:
+        """Forget `stages` for `url`, so they run again."""
+        with self._lock:
+            paper = self.papers.get(url)
+            if paper:
+                for stage in stages:
+                    paper["stages"].pop(stage, None)
+                self._save()
+
+    def reset(self, url: str) -> None:
+        with self._lock:
+            self.papers.pop(url, None)
+            self._save()
+
+
+class IngestRunner:
+    """
+    Ingest a list of URLs through the scrape -> describe -> chunk -> embed pipeline.
+
+    Args:
+        manifest_path: JSON file recording progress, used to resume
+        scraper: Firecrawl-compatible client (e.g. firecrawl_stub.LocalFirecrawlApp); Firecrawl by default
+        papers_directory / vector_db_directory: where scraped content and vector stores go
+        workers: {stage: number of worker threads}
+        queue_size: papers waiting between two stages; a slow stage makes earlier ones wait
+        chunk_queue_size: chunks of a paper waiting between the chunk and embed stages
+        describe_images: set False to skip the vision model (e.g. offline)
+        conditional_fetch: ask the server whether a page changed (HEAD with ETag /
+            Last-Modified) before scraping it again; set False for offline scrapers
+    """
+
+    def __init__(
+        self,
+        manifest_path: Path,
+        scraper=None,
+        papers_directory: Path = None,
+        vector_db_directory: Path = None,
+        workers: dict = None,
+        queue_size: int = 4,
+        chunk_queue_size: int = 512,
+        describe_images: bool = True,
+        embedding_concurrency: int = 4,
+        conditional_fetch: bool = True,
+    ):
+        self.manifest = IngestManifest(manifest_path)
+        self.scraper = scraper
+        self.papers_directory = papers_directory
+        self.vector_db_directory = vector_db_directory
+        self.workers = {"scrape": 2, "describe": 2, "chunk": 1, "embed": 1, **(workers or {})}
+        self.queue_size = queue_size
+        self.chunk_queue_size = chunk_queue_size
+        self.describe_images = describe_images
+        self.embedding_concurrency = embedding_concurrency
+        self.conditional_fetch = conditional_fetch
+
+    # Stages: each takes and returns a work item dict {"url", "output_dir", "page_identifier", ...}
+
+    def _scrape(self, item: dict) -> dict:
+        output_dir, page_identifier, changed = scrape_if_changed(
+            item["url"], self.papers_directory, app=self.scraper, conditional=self.conditional_fetch
+        )
+        if changed:
+            # New content: everything after the scrape has to be redone
+            self.manifest.clear_stages(item["url"], STAGES[1:])
+        return {**item, "output_dir": str(output_dir), "page_identifier": page_identifier, "changed": changed}
+
+    def _describe(self, item: dict) -> dict:
+        if self.describe_images:
+            get_image_info(Path(item["output_dir"]))
+        return item
+
+    def _chunk(self, item: dict, outbox: queue.Queue) -> dict:
+        content = Path(item["output_dir"]) / "content.md"
+        if not content.exists():
+            raise FileNotFoundError(f"No scraped content at {content}")
+
+        # Handed on first, so the embed stage indexes the chunks while they are produced
+        chunks = _ChunkStream(self.chunk_queue_size)
+        outbox.put({**item, "chunks": chunks})
+        count = 0
+        try:
+            for chunk in retriever.chunk_markdown(content):
+                chunks.put(chunk)
+                count += 1
+        except Exception as e:
+            chunks.put(_ChunkingFailed(str(e)))
+            raise
+        chunks.put(_DONE)
+        return {**item, "chunk_count": count, "handed_on": True}
+
+    def _embed(self, item: dict) -> dict:
+        chunks = item.pop("chunks")
+        try:
+            retriever.index_chunks(
+                iter(chunks),
+                item["page_identifier"],
+                self.vector_db_directory,
+                embedding_concurrency=self.embedding_concurrency,
+            )
+        finally:
+            chunks.discard()
+        return item
+
+    def _run_stage(self, stage: str, item: dict, outbox: queue.Queue = None) -> dict:
+        """Run one stage for one paper, unless the manifest says it is already done."""
+        url = item["url"]
+        # The chunk stream is not persisted, so chunking is redone unless the paper was embedded
+        resumable = stage in ("scrape", "describe", "embed")
+        if resumable and self.manifest.is_done(url, stage) and not (stage == "scrape" and item.get("refresh")):
+            return item
+
+        started = time.perf_counter()
+        item = self._chunk(item, outbox) if stage == "chunk" else getattr(self, f"_{stage}")(item)
+        info = {key: item[key] for key in ("output_dir", "page_identifier") if key in item}
+        if stage == "chunk":
+            info["chunks"] = item.pop("chunk_count")
+        self.manifest.complete(url, stage, time.perf_counter() - started, **info)
+        print(f"[{stage}] {url} done in {time.perf_counter() - started:.2f}s")
+        return item
+
+    def _worker(self, stage: str, inbox: queue.Queue, outbox: queue.Queue, results: list):
+        while True:
+            item = inbox.get()
+            if item is _DONE:
+                # Pass the end marker on so the other workers of this stage stop too
+                inbox.put(_DONE)
+                return
+            try:
+                item = self._run_stage(stage, item, outbox)
+            except _ChunkingFailed:
+                # Already reported by the chunk stage
+                continue
+            except Exception as e:
+                print(f"[{stage}] {item['url']} failed: {e}")
+                self.manifest.fail(item["url"], stage, str(e))
+                results.append({"url": item["url"], "status": "failed", "stage": stage, "error": str(e)})
+                continue
+            if item.pop("handed_on", False):
+                continue
+            if item.get("changed") is False and self.manifest.is_done(item["url"], STAGES[-1]):
+                # Refreshed and unchanged: the stored descriptions, chunks and vectors are current
+                results.append({"url": item["url"], "status": "unchanged", "page_identifier": item.get("page_identifier")})
+            elif outbox is None:
+                results.append({"url": item["url"], "status": "ingested", "page_identifier": item.get("page_identifier")})
+            else:
+                outbox.put(item)
+
+    def run(self, urls: list, force: bool = False, refresh: bool = False) -> list:
+        """
+        Ingest `urls` and return one {"url", "status", ...} result per URL.
+
+        Papers that finished every stage in an earlier run are reported as "skipped",
+        unless `force` is set (ingest again from scratch) or `refresh` is set (scrape
+        again, and stop there with status "unchanged" if the page has not changed).
+        """
+        results = []
+        pending = []
+        for url in dict.fromkeys(urls):
+            if force:
+                self.manifest.reset(url)
+            if self.manifest.is_done(url, STAGES[-1]) and not refresh:
+                results.append({"url": url, "status": "skipped", "page_identifier": self.manifest.paper(url).get("page_identifier")})
+            else:
+                paper = self.manifest.paper(url)
+                pending.append({"url": url, "refresh": refresh, **{key: paper[key] for key in ("output_dir", "page_identifier") if key in paper}})
+
+        queues = [queue.Queue(maxsize=self.queue_size) for _ in STAGES]
+        threads = {}
+        for i, stage in enumerate(STAGES):
+            outbox = queues[i + 1] if i + 1 < len(STAGES) else None
+            threads[stage] = [
+                threading.Thread(target=self._worker, args=(stage, queues[i], outbox, results), name=f"ingest-{stage}-{n}", daemon=True)
+                for n in range(self.workers[stage])
+            ]
+            for thread in threads[stage]:
+                thread.start()
+
+        started = time.perf_counter()
+        for item in pending:
+            queues[0].put(item)
+        queues[0].put(_DONE)
+
+        # Stages shut down in order: once every worker of one stage has stopped, the next
+        # stage has received everything it will get
+        for i, stage in enumerate(STAGES):
+            for thread in threads[stage]:
+                thread.join()
+            if i + 1 < len(STAGES):
+                queues[i + 1].put(_DONE)
+
+        print(f"Ingested {sum(r['status'] == 'ingested' for r in results)} papers, "
+              f"skipped {sum(r['status'] == 'skipped' for r in results)}, "
+              f"unchanged {sum(r['status'] == 'unchanged' for r in results)}, "
+              f"failed {sum(r['status'] == 'failed' for r in results)} in {time.perf_counter() - started:.1f}s")
+        return results
+
+
+def load_urls(path: Path) -> list:
+    """One URL per line; blank lines and lines starting with # are ignored."""
+    with open(path, "r", encoding="utf-8") as f:
+        return [line.strip() for line in f if line.strip() and not line.strip().startswith("#")]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--urls", required=True, help="text file with one URL per line")
+    parser.add_argument("--manifest", default="artifacts/ingest_manifest.json", help="progress file used to resume")
+    parser.add_argument("--queue-size", type=int, default=4)
+    parser.add_argument("--scrape-workers", type=int, default=2)
+    parser.add_argument("--describe-workers", type=int, default=2)
+    parser.add_argument("--no-images", action="store_true", help="skip image descriptions")
+    parser.add_argument("--local-scraper", action="store_true", help="use the offline Firecrawl stand-in")
+    parser.add_argument("--force", action="store_true", help="re-ingest papers the manifest marks as done")
+    parser.add_argument("--refresh", action="store_true", help="re-check finished papers and re-ingest the changed ones")
+    args = parser.parse_args()
+
+    # Long ingests can be watched on METRICS_PORT like the app
+    from telemetry import start_metrics_server
+    start_metrics_server()
+
+    scraper = None
+    if args.local_scraper:
+        from firecrawl_stub import LocalFirecrawlApp
+        scraper = LocalFirecrawlApp()
+
+    runner = IngestRunner(
+        args.manifest,
+        scraper=scraper,
+        workers={"scrape": args.scrape_workers, "describe": args.describe_workers},
+        queue_size=args.queue_size,
+        describe_images=not args.no_images,
+        conditional_fetch=not args.local_scraper,
+    )
+    for result in runner.run(load_urls(args.urls), force=args.force, refresh=args.refresh):
+        print(json.dumps(result, ensure_ascii=False))
@@ -1,15 +1,72 @@
 import logging
+import json
 import os
+import sys
 from datetime import datetime
 
-LOG_FILE=f"{datetime.now().strftime('%m_%d_%Y_%H_%M_%S')}.log"
-logs_path=os.path.join(os.getcwd(),"logs",LOG_FILE)
-os.makedirs(logs_path,exist_ok=True)
+# One file per day under LOG_DIR, shared by every process (and appended to across restarts)
+LOG_DIR = os.getenv("LOG_DIR", os.path.join(os.getcwd(), "logs"))
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
 
-LOG_FILE_PATH=os.path.join(logs_path,LOG_FILE)
 
-logging.basicConfig(
-    filename=LOG_FILE_PATH,
-    format="[ %(asctime)s ] %(lineno)d %(name)s - %(levelname)s - %(message)s",
-    level=logging.INFO,
-)
\ No newline at end of file
+def log_file_path(day: datetime = None) -> str:
+    return os.path.join(LOG_DIR, f"{(day or datetime.now()).strftime('%Y_%m_%d')}.log")
+
+
+class DailyFileHandler(logging.FileHandler):
+    """Appends each record to the file of the day it was logged, so a long-running process moves to a new file at midnight."""
+
+    def __init__(self):
+        super().__init__(log_file_path(), encoding="utf-8", delay=True)
+
+    def emit(self, record: logging.LogRecord) -> None:
+        # Called with the handler lock held
+        path = os.path.abspath(log_file_path(datetime.fromtimestamp(record.created)))
+        if path != self.baseFilename:
+            if self.stream is not None:
+                self.stream.close()
+                self.stream = None
+            self.baseFilename = path
+        super().emit(record)
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line; structured fields passed as `extra={"fields": {...}}` are merged in."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            **getattr(record, "fields", {}),
+        }
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+def get_logger(name: str = "rag") -> logging.Logger:
+    """
+    Logger writing JSON lines to LOG_DIR/<date>.log (and to stderr with LOG_TO_STDERR=1).
+
+    Handlers are attached to the "rag" logger once per process; `rag.<module>` loggers share them.
+    """
+    root = logging.getLogger("rag")
+    if not root.handlers:
+        formatter = JsonFormatter()
+        try:
+            os.makedirs(LOG_DIR, exist_ok=True)
+            handler = DailyFileHandler()
+        except OSError:
+            # Read-only file system: log to stderr instead
+            handler = logging.StreamHandler(sys.stderr)
+        handler.setFormatter(formatter)
+        root.addHandler(handler)
+        if os.getenv("LOG_TO_STDERR") == "1" and isinstance(handler, logging.FileHandler):
+            stream_handler = logging.StreamHandler(sys.stderr)
+            stream_handler.setFormatter(formatter)
+            root.addHandler(stream_handler)
+        root.setLevel(LOG_LEVEL)
+        root.propagate = False
+    return root if name == "rag" else root.getChild(name.removeprefix("rag."))
@@ -1,35 +1,91 @@
 from dotenv import load_dotenv
 from langgraph.graph import StateGraph, END
 from typing import TypedDict, Annotated, Sequence
-from langchain_core.messages import BaseMessage, SystemMessage, HumanMessage, ToolMessage
+from langchain_core.messages import BaseMessage, SystemMessage, HumanMessage
 from operator import add as add_messages
 from langchain_core.tools import tool
-from model import llm, embedding_model
-from retriever import retriever
-from langchain_chroma import Chroma
+from langchain_core.runnables import RunnableConfig
+from model import get_llm, get_embedding_model
 from langgraph.checkpoint.memory import MemorySaver
+from answer_cache import DEFAULT_FAQ
+from indexing import collection_version
+from query_cache import QueryCache
+from collection_registry import CollectionRegistry
+from federated import FederatedRetriever
+from streaming import stream_events, final_answer, has_history, record_answer
+from history import HistoryManager
+from context_packing import pack_context, format_context
+from telemetry import span, request, record_llm_call, metrics, flatten_stats, start_metrics_server
+from tool_executor import run_tool_calls
+from prefetch import agent_mode, max_tool_rounds, tool_rounds, prefetch
+from functools import cache, wraps
+from contextvars import ContextVar
+from contextlib import contextmanager
+import threading
 import os
 
 load_dotenv()
 
 memory = MemorySaver()
 
-# Determine the correct path for vector database
-import os
-if os.path.exists("/app/artifacts/Vector_databases/biology"):
-    persist_directory = "/app/artifacts/Vector_databases/biology"
-else:
-    persist_directory = "artifacts/Vector_databases/biology"
-
-vectorstore = Chroma(
-    collection_name="biology",
-    embedding_function=embedding_model,
-    persist_directory=persist_directory,
-)
-retriever = vectorstore.as_retriever(
-    search_type="similarity",
-    search_kwargs={"k": 20}
-)
+# Collection served when no paper is named; others are opened on demand by the registry
+DEFAULT_COLLECTION = os.getenv("DEFAULT_COLLECTION", "biology")
+
+# "prefetch" retrieves for the question before the first LLM call (see prefetch.py)
+AGENT_MODE = agent_mode()
+MAX_TOOL_ROUNDS = max_tool_rounds()
+
+# Nothing below talks to Chroma or Azure at import time: each resource is built on first
+# use and then shared by the whole process
+_init_lock = threading.RLock()
+
+def _lazy(factory):
+    """Build a process-wide resource on first call; concurrent first calls build it once."""
+    cached = cache(factory)
+
+    @wraps(factory)
+    def get():
+        with _init_lock:
+            return cached()
+
+    get.cache_clear = cached.cache_clear
+    return get
+
+@_lazy
+def get_registry():
+    registry = CollectionRegistry(
+        embedding_model=get_embedding_model(),
+        max_open=int(os.getenv("MAX_OPEN_COLLECTIONS", "8")),
+        max_memory_mb=float(os.getenv("MAX_COLLECTION_MEMORY_MB", "1024")),
+        query_cache=QueryCache(path=os.getenv("QUERY_CACHE_PATH") or None),
+    )
+    metrics.register_collector(lambda: _cache_metrics(registry))
+    return registry
+
+def _cache_metrics(registry: CollectionRegistry) -> dict:
+    """Cache and registry gauges for the /metrics endpoint."""
+    gauges = flatten_stats("rag_query_cache", registry.query_cache.stats())
+    gauges.update(flatten_stats("rag_collections", registry.stats()))
+    gauges.update(flatten_stats("rag_answer_cache", registry.answer_cache_stats()))
+    return gauges
+
+def list_collections() -> list:
+    """IDs of the papers that have been ingested and can be queried."""
+    return get_registry().discover()
+
+@_lazy
+def get_federated_retriever():
+    return FederatedRetriever(
+        get_registry(),
+        k=20,
+        timeout=float(os.getenv("COLLECTION_SEARCH_TIMEOUT", "5")),
+    )
+
+# The collection(s) the current tool call searches; set by take_action from the run config
+_current_collection = ContextVar("current_collection", default=DEFAULT_COLLECTION)
+_current_collections = ContextVar("current_collections", default=None)
+
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "2500"))
     
 @tool
 def retriever_tool(query: str) -> str:
@@ -37,21 +93,53 @@ def retriever_tool(query: str) -> str:
     This tool searches and returns the information from the document.
     """
 
-    docs = retriever.invoke(query)
+    collection_id = _current_collection.get()
+    # Leased, so the store stays open for this search even if another paper evicts it
+    with span("retriever_tool", collection=collection_id) as attrs, get_registry().lease(collection_id) as collection:
+        retriever = collection.retriever
+        results = retriever.search(query)
+        embeddings = retriever.get_embeddings([doc.id for doc, _ in results])
 
-    if not docs:
-        return "I found no relevant information in the document."
-    
-    results = []
-    for i, doc in enumerate(docs):
-        results.append(f"Document {i+1}:\n{doc.page_content}")
-    
-    return "\n\n".join(results)
+        # Merge overlapping chunks, drop the low-scoring tail and keep the context within budget.
+        # Rank-fused scores are not similarities, so the score cut-off does not apply to them
+        score_gap = 0.1 if getattr(retriever, "similarity_scores", True) else None
+        spans = pack_context(results, token_budget=CONTEXT_TOKEN_BUDGET, embeddings=embeddings, score_gap=score_gap)
+        context = format_context(spans)
+        attrs.update(results=len(results), spans=len(spans), context_chars=len(context))
+        return context
+
+@tool
+def search_papers_tool(query: str) -> str:
+    """
+    This tool searches all the selected papers at once and returns the information found, labelled with the paper it came from.
+    """
+
+    with span("search_papers_tool", collections=_current_collections.get()) as attrs:
+        retriever = get_federated_retriever()
+        results, failures = retriever.search(query, collection_ids=_current_collections.get())
+        ids_by_collection = {}
+        for doc, _ in results:
+            ids_by_collection.setdefault(doc.metadata["collection_id"], []).append(doc.id)
+        embeddings = retriever.get_embeddings(ids_by_collection)
+
+        # Hybrid collections return rank-fused scores, which are not similarities: no score cut-off
+        spans = pack_context(results, token_budget=CONTEXT_TOKEN_BUDGET, embeddings=embeddings, score_gap=None)
+        context = format_context(spans)
+        attrs.update(results=len(results), spans=len(spans), context_chars=len(context), timeouts=failures["timeouts"], errors=len(failures["errors"]))
+        return context
 
 
 tools = [retriever_tool]
+# Offered instead of retriever_tool when a question targets several papers
+federated_tools = [search_papers_tool]
+
+@_lazy
+def get_llm_with_tools():
+    return get_llm().bind_tools(tools)
 
-llm = llm.bind_tools(tools)
+@_lazy
+def get_llm_with_federated_tools():
+    return get_llm().bind_tools(federated_tools)
 
 class AgentState(TypedDict):
     messages: Annotated[Sequence[BaseMessage], add_messages]
@@ -67,84 +155,168 @@ system_prompt = """
     If you do not have enough information to answer the question, you should say "I don't know" or "I found no relevant information in the document." instead of making up an answer.
 """
 
-tools_dict = {our_tool.name: our_tool for our_tool in tools}
+tools_dict = {our_tool.name: our_tool for our_tool in tools + federated_tools}
 tools_dict
 
-def call_llm(state: AgentState) -> AgentState:
+history_manager = HistoryManager()
+
+def call_llm(state: AgentState, config: RunnableConfig) -> AgentState:
     """Function to call the LLM with the current state."""
-    messages = list(state['messages'])
-    messages = [SystemMessage(content=system_prompt)] + messages
-    message = llm.invoke(messages)
+    with span("call_llm") as attrs:
+        messages = history_manager.prepare(state['messages'])
+        messages = [SystemMessage(content=system_prompt)] + messages
+        if tool_rounds(state['messages']) >= MAX_TOOL_ROUNDS:
+            # Out of retrieval rounds: answer from the context gathered so far
+            message = get_llm().invoke(messages)
+        elif config["configurable"].get("collection_ids"):
+            message = get_llm_with_federated_tools().invoke(messages)
+        else:
+            message = get_llm_with_tools().invoke(messages)
+        record_llm_call(message, state['messages'])
+        attrs.update(usage=getattr(message, "usage_metadata", None), tool_calls=len(getattr(message, "tool_calls", None) or []))
     return {'messages': [message]}
 
+@contextmanager
+def _searching(config: dict):
+    """Point the tools at the collection(s) of this run."""
+    token = _current_collection.set(config["configurable"].get("collection_id", DEFAULT_COLLECTION))
+    collections_token = _current_collections.set(config["configurable"].get("collection_ids"))
+    try:
+        yield
+    finally:
+        _current_collection.reset(token)
+        _current_collections.reset(collections_token)
+
 # Retriever Agent
-def take_action(state: AgentState) -> AgentState:
+def take_action(state: AgentState, config: RunnableConfig) -> AgentState:
     """Execute tool calls from the LLM's response."""
     
     tool_calls = state['messages'][-1].tool_calls
-    results = []
     
-    for t in tool_calls:
-        print(f"Calling Tool: {t['name']} with query: {t['args'].get('query', 'No query provided')}")
-        
-        try:
-            if t['name'] not in tools_dict:
-                print(f"\nTool: {t['name']} does not exist.")
-                result = "Incorrect Tool Name, Please Retry and Select tool from List of Available tools."
-            else:
-                result = tools_dict[t['name']].invoke(t['args'].get('query', ''))
-                print(f"Result length: {len(str(result))}")
-                
-            # Always append the Tool Message with proper ID
-            results.append(ToolMessage(tool_call_id=t['id'], name=t['name'], content=str(result)))
-            
-        except Exception as e:
-            print(f"Error in tool execution: {e}")
-            # Even on error, we must respond to the tool call
-            error_result = f"Tool execution failed: {str(e)}"
-            results.append(ToolMessage(tool_call_id=t['id'], name=t['name'], content=error_result))
-
-    print("Tools Execution Complete. Back to the model!")
+    # Independent calls run in parallel and identical ones once; a failed call only
+    # fails its own ToolMessage
+    with _searching(config), span("take_action", tool_calls=len(tool_calls)):
+        results = run_tool_calls(tool_calls, tools_dict)
     return {'messages': results}
 
-graph = StateGraph(AgentState)
-graph.add_node("llm", call_llm)
-graph.add_node("retriever_agent", take_action)
+def prefetch_context(state: AgentState, config: RunnableConfig) -> AgentState:
+    """Retrieve for the question up front, as if the LLM had asked for it."""
+    tool = search_papers_tool if config["configurable"].get("collection_ids") else retriever_tool
+    with _searching(config), span("prefetch", tool=tool.name):
+        return {'messages': prefetch(state['messages'], tool.name, tools_dict)}
+
+@_lazy
+def get_rag_agent():
+    graph = StateGraph(AgentState)
+    graph.add_node("llm", call_llm)
+    graph.add_node("retriever_agent", take_action)
+
+    graph.add_conditional_edges(
+        "llm",
+        should_continue,
+        {True: "retriever_agent", False: END}
+    )
+    graph.add_edge("retriever_agent", "llm")
+    if AGENT_MODE == "prefetch":
+        graph.add_node("prefetch", prefetch_context)
+        graph.add_edge("prefetch", "llm")
+        graph.set_entry_point("prefetch")
+    else:
+        graph.set_entry_point("llm")
 
-graph.add_conditional_edges(
-    "llm",
-    should_continue,
-    {True: "retriever_agent", False: END}
-)
-graph.add_edge("retriever_agent", "llm")
-graph.set_entry_point("llm")
+    return graph.compile(checkpointer=memory)
+
+config = {"configurable": {"thread_id": "1", "collection_id": DEFAULT_COLLECTION}}
+
+def _config(thread_id: str = None, collection_id: str = None, collection_ids: list = None) -> dict:
+    """
+    Conversation config for a session and paper (or set of papers).
+
+    The shared default thread is used when no ID is given. Conversations are kept per paper,
+    so switching papers does not carry the previous paper's answers into the prompt.
+    """
+    if collection_ids:
+        collection_ids = sorted(collection_ids)
+        return {"configurable": {
+            "thread_id": f"{'+'.join(collection_ids)}:{thread_id or '1'}",
+            "collection_ids": collection_ids,
+        }}
+    collection_id = collection_id or DEFAULT_COLLECTION
+    if thread_id is None and collection_id == DEFAULT_COLLECTION:
+        return config
+    return {"configurable": {"thread_id": f"{collection_id}:{thread_id or '1'}", "collection_id": collection_id}}
+
+def load_resources(collection_id: str = None):
+    """Build everything the query path needs up front (e.g. once per Streamlit process)."""
+    get_rag_agent()
+    get_registry().get(collection_id or DEFAULT_COLLECTION)
+
+def _run_agent(user_input: str, run_config: dict) -> str:
+    return final_answer(stream_events(get_rag_agent(), user_input, run_config))
+
+def stream_agent(user_input: str, use_cache: bool = True, thread_id: str = None, collection_id: str = None, collection_ids: list = None):
+    """
+    Process a single user query and yield answer tokens and tool progress events as they arrive.
 
-rag_agent = graph.compile(checkpointer=memory)
+    Each `thread_id` is a separate conversation; the Streamlit app passes one per session.
+    `collection_id` names the paper to search (see `list_collections`), defaulting to
+    DEFAULT_COLLECTION. With `collection_ids` the question is answered across all of those
+    papers at once (answers to these are not cached).
 
-config = {"configurable": {"thread_id": "1"}}
+    The answer cache only serves and stores the first question of a conversation: follow-ups
+    ("can you elaborate?") depend on the turns before them. A cached answer is recorded in
+    the thread like any other.
 
-def query_agent(user_input: str) -> str:
+    See `streaming.stream_events` for the event format. The last event is always
+    {"type": "final", ...} carrying the complete answer.
+    """
+    run_config = _config(thread_id, collection_id, collection_ids)
+    configurable = run_config["configurable"]
+    with request("query", collection=configurable.get("collection_id") or configurable.get("collection_ids")) as trace:
+        if not use_cache or collection_ids or has_history(get_rag_agent(), run_config):
+            yield from stream_events(get_rag_agent(), user_input, run_config)
+            return
+
+        collection = get_registry().get(configurable["collection_id"])
+        version = collection_version(collection.vectorstore)
+        with span("answer_cache_lookup"):
+            cached_answer, embedding = collection.answer_cache.lookup(user_input, version)
+        trace.attrs["cached"] = cached_answer is not None
+        if cached_answer is not None:
+            record_answer(get_rag_agent(), run_config, user_input, cached_answer)
+            yield {"type": "final", "content": cached_answer, "cached": True}
+            return
+
+        for event in stream_events(get_rag_agent(), user_input, run_config):
+            if event["type"] == "final":
+                collection.answer_cache.store(user_input, event["content"], version, embedding)
+            yield event
+
+def query_agent(user_input: str, use_cache: bool = True, thread_id: str = None, collection_id: str = None, collection_ids: list = None) -> str:
     """
     Process a single user query and return the response.
+
+    Near-duplicates of previously answered questions are served from the semantic answer
+    cache without running the agent.
     """
-    messages = [HumanMessage(content=user_input)]
-    
-    events = rag_agent.stream(
-        {"messages": messages},
-        config,
-        stream_mode="values",
+    return final_answer(stream_agent(user_input, use_cache, thread_id, collection_id, collection_ids))
+
+def warm_answer_cache(questions: list = DEFAULT_FAQ, collection_id: str = None):
+    """
+    Precompute answers for a list of frequently asked questions.
+
+    Each question runs in its own conversation thread so the warm-up does not leak into
+    user conversations.
+    """
+    collection = get_registry().get(collection_id or DEFAULT_COLLECTION)
+    version = collection_version(collection.vectorstore)
+    collection.answer_cache.warm_up(
+        questions,
+        lambda question: _run_agent(question, _config(f"warmup-{question}", collection.collection_id)),
+        version,
     )
-    
-    final_response = ""
-    for event in events:
-        last_message = event["messages"][-1]
-        if hasattr(last_message, 'content') and hasattr(last_message, 'type'):
-            if last_message.type == "ai":
-                final_response = last_message.content
-    
-    return final_response
 
-def running_agent():
+def running_agent(collection_id: str = None):
     """
     Console version of the agent for testing.
     """
@@ -155,9 +327,12 @@ def running_agent():
         if user_input.lower() in ['exit', 'quit']:
             break
             
-        response = query_agent(user_input)
+        response = query_agent(user_input, collection_id=collection_id)
         print(f"\nAssistant: {response}")
 
 # Only run the console version if this file is executed directly
 if __name__ == "__main__":
-    running_agent()
+    import sys
+    start_metrics_server()
+    # Optional argument: the ID of the paper to chat with
+    running_agent(sys.argv[1] if len(sys.argv) > 1 else None)
@@ -0,0 +1,121 @@
+import re
+from pathlib import Path
+from langchain_core.documents import Document
+
+HEADING_PATTERN = re.compile(r"^(#{1,6})\s+(.+?)\s*#*\s*$")
+LINK_PATTERN = re.compile(r"\[([^\]]*)\]\([^)]*\)")
+# Preferred places to cut an oversized section, best first
+SEPARATORS = ["\n\n", "\n", ". ", " "]
+
+
+def clean_heading(text: str) -> str:
+    """Heading text without markdown links or emphasis, for metadata."""
+    text = LINK_PATTERN.sub(r"\1", text)
+    return " ".join(text.replace("*", "").replace("_", " ").split())
+
+
+class MarkdownChunker:
+    """
+    Streaming, header-aware markdown splitter.
+
+    The input is read line by line. Text is split at headings first, so no chunk spans two
+    sections, and sections longer than `chunk_size` characters are cut at the best
+    separator available (paragraph, line, sentence, word) with `chunk_overlap` characters
+    carried over. Only the current section is buffered, and only up to a few chunks of it,
+    so memory stays flat however large the page is.
+
+    Each chunk is a Document whose text is an exact slice of the input, with metadata:
+        source        where the text came from
+        section       heading path, e.g. "§ 3 Introductory Example > § 3.1 Validation"
+        heading_level level of the innermost heading (0 before the first heading)
+        start_index   character offset of the chunk in the input
+    """
+
+    def __init__(self, chunk_size: int = 1000, chunk_overlap: int = 200, buffer_chunks: int = 4):
+        if chunk_overlap >= chunk_size:
+            raise ValueError("chunk_overlap must be smaller than chunk_size")
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.buffer_size = chunk_size * buffer_chunks
+
+    def _cut(self, text: str) -> int:
+        """Length of the next chunk taken from the front of `text`."""
+        if len(text) <= self.chunk_size:
+            return len(text)
+        window = text[:self.chunk_size]
+        for separator in SEPARATORS:
+            position = window.rfind(separator, self.chunk_size // 2)
+            if position != -1:
+                return position + len(separator)
+        return self.chunk_size
+
+    def _next_start(self, text: str, cut: int) -> int:
+        """Where the chunk after one ending at `cut` starts: `chunk_overlap` back, on a word boundary."""
+        start = max(cut - self.chunk_overlap, 1)
+        space = text.find(" ", start, cut)
+        return space + 1 if space != -1 else cut
+
+    def _emit(self, text: str, offset: int, metadata: dict):
+        stripped = text.strip()
+        # Headings with no text of their own carry no information
+        if not stripped or ("\n" not in stripped and HEADING_PATTERN.match(stripped)):
+            return
+        start = offset + len(text) - len(text.lstrip())
+        yield Document(page_content=stripped, metadata={**metadata, "start_index": start})
+
+    def _split(self, buffer: str, offset: int, metadata: dict, final: bool):
+        """
+        Yield chunks from the front of `buffer` and return what is left (with its offset).
+
+        Unless `final`, text that could still grow into a longer chunk is kept.
+        """
+        while len(buffer) > self.chunk_size or (final and buffer):
+            cut = self._cut(buffer)
+            yield from self._emit(buffer[:cut], offset, metadata)
+            if cut >= len(buffer):
+                return "", offset + len(buffer)
+            start = self._next_start(buffer, cut)
+            buffer, offset = buffer[start:], offset + start
+            if not final and len(buffer) <= self.chunk_size:
+                break
+        return buffer, offset
+
+    def split_lines(self, lines, metadata: dict = None):
+        """Yield chunk Documents from an iterable of lines (each ending in its newline)."""
+        metadata = dict(metadata or {})
+        headings = []
+        buffer = ""
+        offset = 0
+        position = 0
+        section_metadata = {**metadata, "section": "", "heading_level": 0}
+
+        for line in lines:
+            match = HEADING_PATTERN.match(line)
+            if match:
+                # A heading closes the current section
+                buffer, offset = yield from self._split(buffer, offset, section_metadata, final=True)
+                level = len(match.group(1))
+                headings = [h for h in headings if h[0] < level] + [(level, clean_heading(match.group(2)))]
+                section_metadata = {
+                    **metadata,
+                    "section": " > ".join(title for _, title in headings),
+                    "heading_level": level,
+                }
+                offset = position
+
+            buffer += line
+            position += len(line)
+            if len(buffer) > self.buffer_size:
+                buffer, offset = yield from self._split(buffer, offset, section_metadata, final=False)
+
+        yield from self._split(buffer, offset, section_metadata, final=True)
+
+    def split_text(self, text: str, metadata: dict = None):
+        return self.split_lines(text.splitlines(keepends=True), metadata)
+
+    def split_file(self, path: Path, metadata: dict = None):
+        """Yield chunks of a markdown file, reading it incrementally."""
+        metadata = {"source": str(path), **(metadata or {})}
+        # newline="" keeps line endings as they are, so offsets match the file
+        with open(path, "r", encoding="utf-8", newline="") as f:
+            yield from self.split_lines(f, metadata)
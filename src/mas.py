@@ -1,20 +1,41 @@
 from dotenv import load_dotenv
 from langgraph.graph import StateGraph, END
 from typing import TypedDict, Annotated, Sequence
-from langchain_core.messages import BaseMessage, SystemMessage, HumanMessage, ToolMessage
+from langchain_core.messages import BaseMessage, SystemMessage, HumanMessage
 from operator import add as add_messages
-from langchain_core.tools import tool
-from model import llm, embedding_model
-from retriever import retriever
-from langchain_chroma import Chroma
+from langchain_core.tools import StructuredTool
+from langchain_core.runnables import RunnableLambda
+from model import get_llm, get_embedding_model
 from langgraph.checkpoint.memory import MemorySaver
+from answer_cache import SemanticAnswerCache, DEFAULT_FAQ
+from indexing import collection_version
+from query_cache import CachedRetriever
+from streaming import stream_events, astream_events, final_answer, afinal_answer, has_history, ahas_history, record_answer, arecord_answer
+from history import HistoryManager
+from context_packing import pack_context, format_context
+from telemetry import span, request, record_llm_call
+from tool_executor import run_tool_calls, arun_tool_calls
+from prefetch import agent_mode, max_tool_rounds, tool_rounds, prefetch, aprefetch, is_prefetched
 import os
+import asyncio
+
 
 class CreateRagAgent:
     
-    def __init__(self, retriever):
+    def __init__(self, retriever, answer_cache: SemanticAnswerCache = None, chat_model=None, history_manager: HistoryManager = None, context_token_budget: int = 2500, mode: str = None, max_rounds: int = None):
+        """
+        `mode` is "tools" (the LLM decides when to retrieve) or "prefetch" (retrieve for every
+        question first, usually saving an LLM call; see prefetch.py), defaulting to AGENT_MODE.
+        `max_rounds` caps the retrieval rounds per question, defaulting to MAX_TOOL_ROUNDS.
+        """
+        # Plain vector store retrievers get query embedding / result caching
+        if hasattr(retriever, "vectorstore") and not hasattr(retriever, "search"):
+            retriever = CachedRetriever.from_retriever(retriever)
         self.retriever = retriever
-        self.llm = llm
+        self.llm = chat_model or get_llm()
+        self.answer_cache = answer_cache or SemanticAnswerCache(
+            self.retriever if hasattr(self.retriever, "embed_query") else get_embedding_model()
+        )
         self.system_prompt = """
         you are TAZMIC, a research assistant specialized in providing information from a **document**, and provide concise and accurate response in **friendly** and **formal** manner to user queries only based on the content of the document.
         
@@ -23,6 +44,10 @@ class CreateRagAgent:
         
         load_dotenv()
         self.memory = MemorySaver()
+        self.history_manager = history_manager or HistoryManager()
+        self.context_token_budget = context_token_budget
+        self.mode = agent_mode(mode)
+        self.max_tool_rounds = max_tool_rounds(max_rounds)
         self.config = {"configurable": {"thread_id": "1"}}
         
         # Initialize tools and agent
@@ -31,13 +56,7 @@ class CreateRagAgent:
     
     def _setup_tools(self):
         """Setup the retriever tool"""
-        @tool
-        def retriever_tool(query: str) -> str:
-            """
-            This tool searches and returns the information from the document.
-            """
-            docs = self.retriever.invoke(query)
-
+        def format_docs(docs) -> str:
             if not docs:
                 return "I found no relevant information in the document."
             
@@ -46,6 +65,44 @@ class CreateRagAgent:
                 results.append(f"Document {i+1}:\n{doc.page_content}")
             
             return "\n\n".join(results)
+
+        def pack(results) -> str:
+            # Merge overlapping chunks, drop the low-scoring tail and keep the context within budget
+            embeddings = self.retriever.get_embeddings([doc.id for doc, _ in results])
+            # Rank-fused scores are not similarities, so the score cut-off does not apply to them
+            score_gap = 0.1 if getattr(self.retriever, "similarity_scores", True) else None
+            return format_context(pack_context(results, token_budget=self.context_token_budget, embeddings=embeddings, score_gap=score_gap))
+
+        def retriever_tool(query: str) -> str:
+            """
+            This tool searches and returns the information from the document.
+            """
+            with span("retriever_tool") as attrs:
+                if hasattr(self.retriever, "search"):
+                    context = pack(self.retriever.search(query))
+                else:
+                    context = format_docs(self.retriever.invoke(query))
+                attrs["context_chars"] = len(context)
+                return context
+
+        async def aretriever_tool(query: str) -> str:
+            """
+            This tool searches and returns the information from the document.
+            """
+            with span("retriever_tool") as attrs:
+                if hasattr(self.retriever, "asearch"):
+                    results = await self.retriever.asearch(query)
+                    context = await asyncio.to_thread(pack, results)
+                else:
+                    if hasattr(self.retriever, "ainvoke"):
+                        docs = await self.retriever.ainvoke(query)
+                    else:
+                        docs = await asyncio.to_thread(self.retriever.invoke, query)
+                    context = format_docs(docs)
+                attrs["context_chars"] = len(context)
+                return context
+
+        retriever_tool = StructuredTool.from_function(func=retriever_tool, coroutine=aretriever_tool)
         
         self.tools = [retriever_tool]
         self.tools_dict = {tool.name: tool for tool in self.tools}
@@ -60,8 +117,10 @@ class CreateRagAgent:
         
         # Create the graph
         self.graph = StateGraph(AgentState)
-        self.graph.add_node("llm", self._call_llm)
-        self.graph.add_node("retriever_agent", self._take_action)
+        # Each node has a sync and an async implementation, so the same graph serves
+        # invoke/stream and ainvoke/astream
+        self.graph.add_node("llm", RunnableLambda(self._call_llm, afunc=self._acall_llm))
+        self.graph.add_node("retriever_agent", RunnableLambda(self._take_action, afunc=self._atake_action))
 
         self.graph.add_conditional_edges(
             "llm",
@@ -69,7 +128,12 @@ class CreateRagAgent:
             {True: "retriever_agent", False: END}
         )
         self.graph.add_edge("retriever_agent", "llm")
-        self.graph.set_entry_point("llm")
+        if self.mode == "prefetch":
+            self.graph.add_node("prefetch", RunnableLambda(self._prefetch, afunc=self._aprefetch))
+            self.graph.add_edge("prefetch", "llm")
+            self.graph.set_entry_point("prefetch")
+        else:
+            self.graph.set_entry_point("llm")
 
         self.rag_agent = self.graph.compile(checkpointer=self.memory)
     
@@ -78,54 +142,167 @@ class CreateRagAgent:
         result = state['messages'][-1]
         return hasattr(result, 'tool_calls') and len(result.tool_calls) > 0
 
+    def _llm_for(self, state):
+        # Out of retrieval rounds: the LLM answers from the context gathered so far
+        return self.llm if tool_rounds(state['messages']) >= self.max_tool_rounds else self.llm_with_tools
+
     def _call_llm(self, state):
         """Function to call the LLM with the current state."""
-        messages = list(state['messages'])
-        messages = [SystemMessage(content=self.system_prompt)] + messages
-        message = self.llm_with_tools.invoke(messages)
+        with span("_call_llm") as attrs:
+            messages = self.history_manager.prepare(state['messages'])
+            messages = [SystemMessage(content=self.system_prompt)] + messages
+            message = self._llm_for(state).invoke(messages)
+            record_llm_call(message, state['messages'], agent="mas")
+            attrs.update(usage=getattr(message, "usage_metadata", None), tool_calls=len(getattr(message, "tool_calls", None) or []))
+        return {'messages': [message]}
+
+    async def _acall_llm(self, state):
+        """Async version of `_call_llm`."""
+        with span("_call_llm") as attrs:
+            messages = self.history_manager.prepare(state['messages'])
+            messages = [SystemMessage(content=self.system_prompt)] + messages
+            message = await self._llm_for(state).ainvoke(messages)
+            record_llm_call(message, state['messages'], agent="mas")
+            attrs.update(usage=getattr(message, "usage_metadata", None), tool_calls=len(getattr(message, "tool_calls", None) or []))
         return {'messages': [message]}
 
     def _take_action(self, state):
         """Execute tool calls from the LLM's response."""
         tool_calls = state['messages'][-1].tool_calls
-        results = []
         
-        for t in tool_calls:
-            print(f"Calling Tool: {t['name']} with query: {t['args'].get('query', 'No query provided')}")
-            
-            if t['name'] not in self.tools_dict:
-                print(f"\nTool: {t['name']} does not exist.")
-                result = "Incorrect Tool Name, Please Retry and Select tool from List of Available tools."
-            else:
-                result = self.tools_dict[t['name']].invoke(t['args'].get('query', ''))
-                print(f"Result length: {len(str(result))}")
-                
-            # Appends the Tool Message
-            results.append(ToolMessage(tool_call_id=t['id'], name=t['name'], content=str(result)))
+        # Independent calls run in parallel and identical ones once, results in call order
+        with span("_take_action", tool_calls=len(tool_calls)):
+            results = run_tool_calls(tool_calls, self.tools_dict)
+        return {'messages': results}
 
-        print("Tools Execution Complete. Back to the model!")
+    async def _atake_action(self, state):
+        """Async version of `_take_action`."""
+        tool_calls = state['messages'][-1].tool_calls
+        
+        with span("_take_action", tool_calls=len(tool_calls)):
+            results = await arun_tool_calls(tool_calls, self.tools_dict)
         return {'messages': results}
 
-    def query_agent(self, user_input: str) -> str:
+    def _prefetch(self, state):
+        """Retrieve for the question up front, as if the LLM had asked for it."""
+        with span("prefetch"):
+            return {'messages': prefetch(state['messages'], self.tools[0].name, self.tools_dict)}
+
+    async def _aprefetch(self, state):
+        """Async version of `_prefetch`."""
+        with span("prefetch"):
+            return {'messages': await aprefetch(state['messages'], self.tools[0].name, self.tools_dict)}
+
+    def _config(self, thread_id: str = None) -> dict:
+        if thread_id is None:
+            return self.config
+        return {"configurable": {"thread_id": thread_id}}
+
+    def _collection_version(self) -> str:
+        vectorstore = getattr(self.retriever, "vectorstore", None)
+        return collection_version(vectorstore) if vectorstore is not None else ""
+
+    def _run_agent(self, user_input: str, config: dict) -> str:
+        return final_answer(stream_events(self.rag_agent, user_input, config))
+
+    def stream_query(self, user_input: str, use_cache: bool = True, thread_id: str = None):
+        """
+        Process a single user query and yield answer tokens and tool progress events as they arrive.
+
+        See `streaming.stream_events` for the event format. The last event is always
+        {"type": "final", ...} carrying the complete answer.
+        """
+        config = self._config(thread_id)
+        with request("query") as trace:
+            # Follow-ups depend on the conversation, so only a thread's first question uses the cache
+            if not use_cache or has_history(self.rag_agent, config):
+                yield from stream_events(self.rag_agent, user_input, config)
+                return
+
+            version = self._collection_version()
+            with span("answer_cache_lookup"):
+                cached_answer, embedding = self.answer_cache.lookup(user_input, version)
+            trace.attrs["cached"] = cached_answer is not None
+            if cached_answer is not None:
+                record_answer(self.rag_agent, config, user_input, cached_answer)
+                yield {"type": "final", "content": cached_answer, "cached": True}
+                return
+
+            for event in stream_events(self.rag_agent, user_input, config):
+                if event["type"] == "final":
+                    self.answer_cache.store(user_input, event["content"], version, embedding)
+                yield event
+
+    def query_agent(self, user_input: str, use_cache: bool = True, thread_id: str = None) -> str:
         """
         Process a single user query and return the response.
+
+        Near-duplicates of previously answered questions are served from the semantic answer
+        cache without running the agent.
         """
-        messages = [HumanMessage(content=user_input)]
-        
-        events = self.rag_agent.stream(
-            {"messages": messages},
-            self.config,
-            stream_mode="values",
+        return final_answer(self.stream_query(user_input, use_cache, thread_id))
+
+    async def astream(self, user_input: str, use_cache: bool = True, thread_id: str = None):
+        """
+        Async version of `stream_query`.
+
+        Many conversations can be in flight on one event loop; give each its own `thread_id`.
+        """
+        config = self._config(thread_id)
+        with request("query") as trace:
+            if not use_cache or await ahas_history(self.rag_agent, config):
+                async for event in astream_events(self.rag_agent, user_input, config):
+                    yield event
+                return
+
+            version = await asyncio.to_thread(self._collection_version)
+            with span("answer_cache_lookup"):
+                cached_answer, embedding = await asyncio.to_thread(self.answer_cache.lookup, user_input, version)
+            trace.attrs["cached"] = cached_answer is not None
+            if cached_answer is not None:
+                await arecord_answer(self.rag_agent, config, user_input, cached_answer)
+                yield {"type": "final", "content": cached_answer, "cached": True}
+                return
+
+            async for event in astream_events(self.rag_agent, user_input, config):
+                if event["type"] == "final":
+                    await asyncio.to_thread(self.answer_cache.store, user_input, event["content"], version, embedding)
+                yield event
+
+    async def aquery_agent(self, user_input: str, use_cache: bool = True, thread_id: str = None) -> str:
+        """
+        Async version of `query_agent`.
+        """
+        return await afinal_answer(self.astream(user_input, use_cache, thread_id))
+
+    def thread_usage(self, thread_id: str) -> dict:
+        """Token usage and number of LLM calls recorded in a conversation thread."""
+        state = self.rag_agent.get_state(self._config(thread_id))
+        usage = {"llm_calls": 0, "input_tokens": 0, "output_tokens": 0, "total_tokens": 0}
+        for message in state.values.get("messages", []):
+            # The prefetch node's tool call is not an LLM call
+            if getattr(message, "type", None) != "ai" or is_prefetched(message):
+                continue
+            usage["llm_calls"] += 1
+            for key, value in (getattr(message, "usage_metadata", None) or {}).items():
+                if key in usage:
+                    usage[key] += value
+        return usage
+
+    def delete_thread(self, thread_id: str) -> None:
+        """Drop a conversation thread from the checkpointer."""
+        if hasattr(self.memory, "delete_thread"):
+            self.memory.delete_thread(thread_id)
+
+    def warm_answer_cache(self, questions: list = DEFAULT_FAQ):
+        """
+        Precompute answers for a list of frequently asked questions, each in its own conversation thread.
+        """
+        self.answer_cache.warm_up(
+            questions,
+            lambda question: self._run_agent(question, {"configurable": {"thread_id": f"warmup-{question}"}}),
+            self._collection_version(),
         )
-        
-        final_response = ""
-        for event in events:
-            last_message = event["messages"][-1]
-            if hasattr(last_message, 'content') and hasattr(last_message, 'type'):
-                if last_message.type == "ai":
-                    final_response = last_message.content
-        
-        return final_response
 
     def run_console_agent(self):
         """
@@ -1,20 +1,155 @@
-from langchain_openai import AzureChatOpenAI
-from langchain_openai import AzureOpenAIEmbeddings
+"""
+Model provider layer: the chat, vision and embedding clients used by every other module.
+
+Clients are built on first use, so importing this module is cheap and needs no credentials.
+All of them share one keep-alive HTTP connection pool with explicit timeouts and a retry
+budget (see http_pool.py), and each kind of call has its own read timeout:
+
+    MODEL_CHAT_TIMEOUT       seconds per chat completion (default 60)
+    MODEL_VISION_TIMEOUT     seconds per image description (default 120)
+    MODEL_EMBEDDING_TIMEOUT  seconds per embedding request (default 30)
+
+MODEL_BACKEND selects the provider:
+
+    azure  (default) Azure OpenAI deployments from the AZURE_OPENAI_* settings
+    local  any OpenAI-compatible server at MODEL_BASE_URL, e.g. `python src/openai_stub.py`
+    fake   in-process deterministic models from fake_models.py, with FAKE_LLM_LATENCY /
+           FAKE_EMBEDDING_LATENCY seconds of simulated latency per call
+"""
 from dotenv import load_dotenv
+from functools import cache
 import os
 
-load_dotenv()
+@cache
+def _load_env():
+    load_dotenv()
+
+def backend() -> str:
+    _load_env()
+    return os.getenv("MODEL_BACKEND", "azure").lower()
+
+def uses_fake_models() -> bool:
+    return backend() == "fake"
+
+def use_fake_models(llm_latency: float = 0.0, embedding_latency: float = 0.0):
+    """Serve every model in this process (and its subprocesses) from the offline fakes."""
+    os.environ["MODEL_BACKEND"] = "fake"
+    os.environ["FAKE_LLM_LATENCY"] = str(llm_latency)
+    os.environ["FAKE_EMBEDDING_LATENCY"] = str(embedding_latency)
+    get_llm.cache_clear()
+    get_vision_llm.cache_clear()
+    get_embedding_model.cache_clear()
+
+def _timeout(variable: str, default: float):
+    from http_pool import default_timeout
+    return default_timeout(float(os.getenv(variable, str(default))))
+
+def _local_base_url() -> str:
+    return os.getenv("MODEL_BASE_URL", "http://localhost:8000/v1")
+
+def _pooled() -> dict:
+    """Client settings shared by every model: the process-wide pool, which also does the retrying."""
+    from http_pool import get_http_client, get_async_http_client
+    return {"http_client": get_http_client(), "http_async_client": get_async_http_client(), "max_retries": 0}
+
+def _chat_model(deployment: str, timeout_variable: str, default_timeout: float):
+    if backend() == "local":
+        from langchain_openai import ChatOpenAI
+        return ChatOpenAI(
+            base_url=_local_base_url(),
+            api_key=os.getenv("MODEL_API_KEY", "stub"),
+            model=os.getenv("MODEL_NAME", "stub-chat"),
+            timeout=_timeout(timeout_variable, default_timeout),
+            **_pooled(),
+        )
+    from langchain_openai import AzureChatOpenAI
+    return AzureChatOpenAI(
+        azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT"),
+        azure_deployment=deployment,
+        api_version=os.getenv("AZURE_OPENAI_API_VERSION"),
+        api_key=os.getenv("AZURE_OPENAI_API_KEY"),
+        timeout=_timeout(timeout_variable, default_timeout),
+        **_pooled(),
+        )
+
+@cache
+def get_llm():
+    if uses_fake_models():
+        from fake_models import FakeChatModel
+        return FakeChatModel(latency=float(os.getenv("FAKE_LLM_LATENCY", "0")))
+    return _chat_model(os.getenv("AZURE_OPENAI_LLM_DEPLOYMENT"), "MODEL_CHAT_TIMEOUT", 60)
+
+@cache
+def get_vision_llm():
+    """Chat model for image descriptions: AZURE_OPENAI_VISION_DEPLOYMENT if set, with a longer timeout."""
+    if uses_fake_models():
+        return get_llm()
+    deployment = os.getenv("AZURE_OPENAI_VISION_DEPLOYMENT") or os.getenv("AZURE_OPENAI_LLM_DEPLOYMENT")
+    return _chat_model(deployment, "MODEL_VISION_TIMEOUT", 120)
+
+@cache
+def get_embedding_model():
+    if uses_fake_models():
+        from fake_models import FakeEmbeddings
+        return FakeEmbeddings(latency=float(os.getenv("FAKE_EMBEDDING_LATENCY", "0")))
+    if backend() == "local":
+        from langchain_openai import OpenAIEmbeddings
+        return OpenAIEmbeddings(
+            base_url=_local_base_url(),
+            api_key=os.getenv("MODEL_API_KEY", "stub"),
+            model=os.getenv("AZURE_OPENAI_EMBEDDING_DEPLOYMENT", "text-embedding-3-small"),
+            # The text is sent as is, not pre-tokenized, which any compatible server understands
+            check_embedding_ctx_length=False,
+            timeout=_timeout("MODEL_EMBEDDING_TIMEOUT", 30),
+            **_pooled(),
+        )
+    from langchain_openai import AzureOpenAIEmbeddings
+    return AzureOpenAIEmbeddings(
+        azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT"),
+        azure_deployment=os.getenv("AZURE_OPENAI_EMBEDDING_DEPLOYMENT"),
+        api_version=os.getenv("AZURE_OPENAI_API_VERSION"),
+        api_key=os.getenv("AZURE_OPENAI_API_KEY"),
+        timeout=_timeout("MODEL_EMBEDDING_TIMEOUT", 30),
+        **_pooled(),
+    )
+
+@cache
+def get_openai_client():
+    """
+    Raw `openai` client for batched document embedding (see embedding_engine.py), on the
+    shared pool but without its transport retries: the engine retries itself. Returns
+    (client, embedding model or deployment name).
+    """
+    from openai import OpenAI, AzureOpenAI
+    from http_pool import get_http_client
+
+    timeout = _timeout("MODEL_EMBEDDING_TIMEOUT", 30)
+    # EMBEDDING_BASE_URL is the older name for pointing ingestion at a local server
+    base_url = os.getenv("EMBEDDING_BASE_URL") or (_local_base_url() if backend() == "local" else None)
+    if base_url:
+        client = OpenAI(
+            base_url=base_url,
+            api_key=os.getenv("EMBEDDING_API_KEY") or os.getenv("MODEL_API_KEY", "stub"),
+            max_retries=0,
+            timeout=timeout,
+            http_client=get_http_client(retry=False),
+        )
+        return client, os.getenv("AZURE_OPENAI_EMBEDDING_DEPLOYMENT", "text-embedding-3-small")
 
-llm = AzureChatOpenAI(
-    azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT"),
-    azure_deployment=os.getenv("AZURE_OPENAI_LLM_DEPLOYMENT"), 
-    api_version=os.getenv("AZURE_OPENAI_API_VERSION"),
-    api_key=os.getenv("AZURE_OPENAI_API_KEY"),
+    client = AzureOpenAI(
+        azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT"),
+        api_version=os.getenv("AZURE_OPENAI_API_VERSION"),
+        api_key=os.getenv("AZURE_OPENAI_API_KEY"),
+        max_retries=0,
+        timeout=timeout,
+        http_client=get_http_client(retry=False),
     )
+    return client, os.getenv("AZURE_OPENAI_EMBEDDING_DEPLOYMENT")
 
-embedding_model = AzureOpenAIEmbeddings(
-    azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT"),
-    azure_deployment=os.getenv("AZURE_OPENAI_EMBEDDING_DEPLOYMENT"), 
-    api_version=os.getenv("AZURE_OPENAI_API_VERSION"),
-    api_key=os.getenv("AZURE_OPENAI_API_KEY"),
-)
\ No newline at end of file
+def __getattr__(name: str):
+    # `from model import llm, embedding_model` keeps working; the client is built at that point
+    if name == "llm":
+        return get_llm()
+    if name == "embedding_model":
+        return get_embedding_model()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,216 @@
+"""
+Minimal OpenAI-compatible server for offline runs of the ingestion and query paths.
+
+It answers `/v1/embeddings` and `/v1/chat/completions` (and the Azure
+`/openai/deployments/<name>/...` variants) with deterministic results, and can inject
+latency and 429 responses to exercise batching, concurrency and backoff.
+
+    python src/openai_stub.py --port 8000 --latency 0.05 --rate-limit-every 10
+"""
+import re
+import json
+import time
+import math
+import base64
+import hashlib
+import argparse
+import threading
+from array import array
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+TOKEN_PATTERN = re.compile(r"\w+")
+
+
+def hashed_embedding(text: str, dim: int = 256) -> list:
+    """Deterministic bag-of-words embedding: texts sharing words get similar vectors."""
+    vector = [0.0] * dim
+    for token in TOKEN_PATTERN.findall(text.lower()):
+        digest = hashlib.md5(token.encode("utf-8")).digest()
+        bucket = int.from_bytes(digest[:4], "little") % dim
+        vector[bucket] += 1.0 if digest[4] % 2 else -1.0
+    norm = math.sqrt(sum(v * v for v in vector)) or 1.0
+    return [v / norm for v in vector]
+
+
+def stub_chat_reply(messages: list, tools: list) -> dict:
+    """
+    Deterministic assistant turn: ask for retrieval once per user question, then answer
+    from the retrieved text.
+    """
+    last_user = ""
+    tool_outputs = []
+    for message in messages:
+        role = message.get("role")
+        if role == "user":
+            content = message.get("content")
+            last_user = content if isinstance(content, str) else json.dumps(content)
+            tool_outputs = []
+        elif role == "tool":
+            tool_outputs.append(message.get("content") or "")
+
+    if tools and not tool_outputs:
+        return {
+            "role": "assistant",
+            "content": None,
+            "tool_calls": [{
+                "id": "call_" + hashlib.sha1(last_user.encode("utf-8")).hexdigest()[:12],
+                "type": "function",
+                "function": {"name": tools[0]["function"]["name"], "arguments": json.dumps({"query": last_user})},
+            }],
+        }
+
+    context = " ".join(tool_outputs)[:300]
+    return {"role": "assistant", "content": f"Based on the document: {context}" if context else f"You asked: {last_user}"}
+
+
+class StubState:
+    def __init__(self, latency: float = 0.0, rate_limit_every: int = 0, retry_after: float = 0.1, dim: int = 256):
+        self.latency = latency
+        self.rate_limit_every = rate_limit_every
+        self.retry_after = retry_after
+        self.dim = dim
+        self.requests = 0
+        self.lock = threading.Lock()
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    state: StubState = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status: int, body: dict, headers: dict = None):
+        payload = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = json.loads(self.rfile.read(length) or b"{}")
+        path = self.path.split("?")[0]
+
+        with self.state.lock:
+            self.state.requests += 1
+            request_number = self.state.requests
+
+        if self.state.rate_limit_every and request_number % self.state.rate_limit_every == 0:
+            self._send_json(
+                429,
+                {"error": {"message": "Rate limit exceeded", "type": "rate_limit", "code": "429"}},
+                {"Retry-After": str(self.state.retry_after)},
+            )
+            return
+
+        if self.state.latency:
+            time.sleep(self.state.latency)
+
+        if path.endswith("/embeddings"):
+            self._embeddings(body)
+        elif path.endswith("/chat/completions"):
+            self._chat(body)
+        else:
+            self._send_json(404, {"error": {"message": f"Unknown path {path}"}})
+
+    def _embeddings(self, body: dict):
+        inputs = body.get("input", [])
+        if isinstance(inputs, str):
+            inputs = [inputs]
+        as_base64 = body.get("encoding_format") == "base64"
+
+        data = []
+        tokens = 0
+        for index, text in enumerate(inputs):
+            text = text if isinstance(text, str) else " ".join(map(str, text))
+            tokens += len(TOKEN_PATTERN.findall(text))
+            vector = hashed_embedding(text, self.state.dim)
+            if as_base64:
+                vector = base64.b64encode(array("f", vector).tobytes()).decode("ascii")
+            data.append({"object": "embedding", "index": index, "embedding": vector})
+
+        self._send_json(200, {
+            "object": "list",
+            "data": data,
+            "model": body.get("model", "stub-embedding"),
+            "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
+        })
+
+    def _chat(self, body: dict):
+        messages = body.get("messages", [])
+        message = stub_chat_reply(messages, body.get("tools") or [])
+        prompt_tokens = sum(len(TOKEN_PATTERN.findall(json.dumps(m.get("content")))) for m in messages)
+        completion_tokens = len(TOKEN_PATTERN.findall(message.get("content") or ""))
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens, "total_tokens": prompt_tokens + completion_tokens}
+        finish_reason = "tool_calls" if message.get("tool_calls") else "stop"
+        created = int(time.time())
+
+        if not body.get("stream"):
+            self._send_json(200, {
+                "id": "chatcmpl-stub",
+                "object": "chat.completion",
+                "created": created,
+                "model": body.get("model", "stub-chat"),
+                "choices": [{"index": 0, "message": message, "finish_reason": finish_reason}],
+                "usage": usage,
+            })
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.end_headers()
+
+        def emit(delta, finish=None, include_usage=False):
+            chunk = {
+                "id": "chatcmpl-stub",
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": body.get("model", "stub-chat"),
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish}],
+            }
+            if include_usage:
+                chunk["usage"] = usage
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+
+        if message.get("tool_calls"):
+            call = message["tool_calls"][0]
+            emit({"role": "assistant", "tool_calls": [{"index": 0, **call}]})
+        else:
+            emit({"role": "assistant", "content": ""})
+            for word in re.findall(r"\S+\s*", message["content"]):
+                emit({"content": word})
+        emit({}, finish=finish_reason, include_usage=True)
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+
+def start_stub_server(port: int = 0, **state_kwargs):
+    """
+    Start the stub server on a background thread.
+
+    Returns:
+        tuple: (server, base_url); call `server.shutdown()` to stop it
+    """
+    handler = type("BoundStubHandler", (StubHandler,), {"state": StubState(**state_kwargs)})
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/v1"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="OpenAI-compatible stub server")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every request")
+    parser.add_argument("--rate-limit-every", type=int, default=0, help="answer every Nth request with 429")
+    parser.add_argument("--retry-after", type=float, default=0.1)
+    parser.add_argument("--dim", type=int, default=256)
+    args = parser.parse_args()
+
+    handler = type("BoundStubHandler", (StubHandler,), {"state": StubState(args.latency, args.rate_limit_every, args.retry_after, args.dim)})
+    print(f"Serving OpenAI-compatible stub on http://127.0.0.1:{args.port}/v1")
+    ThreadingHTTPServer(("127.0.0.1", args.port), handler).serve_forever()
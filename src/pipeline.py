@@ -1,24 +1,56 @@
-from scrapper import scrape_url
+from scrapper import scrape_if_changed
 from retriever import retriever
 from pathlib import Path
 from mas import CreateRagAgent
+from collection_registry import CollectionRegistry, default_vector_db_directory
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import argparse
+import json
+import time
+import uuid
+
+def load_questions(source) -> list:
+    """
+    Load questions from a list or from a JSONL file.
+
+    Each JSONL line is either a JSON string or an object with a "question" field.
+    """
+    if isinstance(source, (list, tuple)):
+        return list(source)
+
+    questions = []
+    with open(source, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            record = json.loads(line)
+            questions.append(record["question"] if isinstance(record, dict) else str(record))
+    return questions
 
 class Pipeline:
-    def __init__(self):
+    def __init__(self, url: str = None, force: bool = False):
         
         print(f"{'*'*25}scrapper initialized{'*'*25}")
-        self.url = input("Enter the URL to scrape: ")
-        self.output_dir, self.page_identifier = scrape_url(self.url)
+        self.url = url or input("Enter the URL to scrape: ")
+        self.output_dir, self.page_identifier, self.changed = scrape_if_changed(self.url, force=force)
         print(f"{'*'*25}scrapper completed{'*'*25}")
 
         print(f"{'*'*25}retriever initialized{'*'*25}")
-        base_vector_db = Path(r"R:/TAZMIC/artifacts/Vector_databases")
+        # One store per paper at <base>/<page_identifier>, where the collection registry finds it
+        base_vector_db = default_vector_db_directory()
         self.vector_db_path = base_vector_db / self.page_identifier
-        self.retriever = retriever(
-            markdown_path=Path(self.output_dir) / "content.md",  
-            collection_name=self.page_identifier,
-            directory=self.vector_db_path
-        )
+        registry = CollectionRegistry(base_vector_db)
+        if not self.changed and self.page_identifier in registry:
+            # Same page as last time: reuse its image descriptions, chunks and vectors as they are
+            print(f"{self.url} is unchanged, using the existing index")
+            self.retriever = registry.retriever(self.page_identifier)
+        else:
+            self.retriever = retriever(
+                markdown_path=Path(self.output_dir) / "content.md",  
+                collection_name=self.page_identifier,
+                directory=base_vector_db
+            )
         print(f"{'*'*25}retriever completed{'*'*25}")
         
         print(f"{'*'*25}RAG agent initialized{'*'*25}")
@@ -39,26 +71,85 @@ class Pipeline:
         """
         self.rag_agent.run_console_agent()
     
-    def process_multiple_queries(self, questions: list) -> dict:
+    def _answer_isolated(self, index: int, question: str, use_cache: bool) -> dict:
+        """Answer one question in its own conversation thread and measure it."""
+        thread_id = f"batch-{uuid.uuid4().hex}"
+        started = time.perf_counter()
+        result = {"index": index, "question": question}
+        try:
+            result["answer"] = self.rag_agent.query_agent(question, use_cache=use_cache, thread_id=thread_id)
+        except Exception as e:
+            result["error"] = str(e)
+        result["latency_seconds"] = round(time.perf_counter() - started, 4)
+        result.update(self.rag_agent.thread_usage(thread_id))
+        self.rag_agent.delete_thread(thread_id)
+        return result
+
+    def run_batch(self, questions, max_workers: int = 4, output_path: Path = None, use_cache: bool = False):
+        """
+        Answer many questions in parallel and yield the results as they complete.
+
+        Args:
+            questions: list of questions or path to a JSONL file
+            max_workers: number of questions in flight at once
+            output_path: optional JSONL file; one line is appended per finished question
+            use_cache: serve near-duplicate questions from the answer cache (off by default for evaluations)
+
+        Each question runs in an isolated conversation thread, so earlier questions never end
+        up in later prompts. Results carry per-question latency and token counts.
+        """
+        questions = load_questions(questions)
+        output_file = open(output_path, "a", encoding="utf-8") if output_path else None
+        try:
+            with ThreadPoolExecutor(max_workers=max_workers) as pool:
+                futures = [
+                    pool.submit(self._answer_isolated, i, question, use_cache)
+                    for i, question in enumerate(questions)
+                ]
+                for done, future in enumerate(as_completed(futures), 1):
+                    result = future.result()
+                    print(f"Completed {done}/{len(questions)} ({result['latency_seconds']}s): {result['question']}")
+                    if output_file:
+                        output_file.write(json.dumps(result, ensure_ascii=False) + "\n")
+                        output_file.flush()
+                    yield result
+        finally:
+            if output_file:
+                output_file.close()
+
+    def process_multiple_queries(self, questions: list, max_workers: int = 4) -> dict:
         """
         Process multiple questions and return results
         """
         results = {}
-        for i, question in enumerate(questions, 1):
-            print(f"\nProcessing question {i}/{len(questions)}: {question}")
-            results[question] = self.rag_agent.query_agent(question)
-        return results
+        for result in self.run_batch(questions, max_workers=max_workers):
+            results[result["question"]] = result.get("answer", f"Error: {result.get('error')}")
+        return {question: results[question] for question in load_questions(questions) if question in results}
 
 if __name__ == "__main__":
-    pipeline = Pipeline()
-    
-    # Option 1: Single query
-    # response = pipeline.query("What is this document about?")
-    # print(f"Response: {response}")
-    
-    # Option 2: Interactive session
-    pipeline.run_interactive_session()
-    
+    parser = argparse.ArgumentParser(description="Scrape a paper, index it and ask it questions")
+    parser.add_argument("--url", help="URL of the paper (prompted for if omitted)")
+    parser.add_argument("--questions", help="JSONL file of questions to answer in batch mode")
+    parser.add_argument("--workers", type=int, default=4, help="questions answered in parallel in batch mode")
+    parser.add_argument("--output", help="JSONL file to append batch results to")
+    parser.add_argument("--force", action="store_true", help="scrape and index again even if the page is unchanged")
+    args = parser.parse_args()
+
+    pipeline = Pipeline(args.url, force=args.force)
+
+    if args.questions:
+        # Batch mode: results are streamed out as JSONL as they complete
+        for result in pipeline.run_batch(args.questions, max_workers=args.workers, output_path=args.output):
+            if not args.output:
+                print(json.dumps(result, ensure_ascii=False))
+    else:
+        # Option 1: Single query
+        # response = pipeline.query("What is this document about?")
+        # print(f"Response: {response}")
+
+        # Option 2: Interactive session
+        pipeline.run_interactive_session()
+
     # Option 3: Multiple queries
     # questions = [
     #     "What is the main topic?",
@@ -68,4 +159,4 @@ if __name__ == "__main__":
     # results = pipeline.process_multiple_queries(questions)
     # for question, answer in results.items():
     #     print(f"Q: {question}")
-    #     print(f"A: {answer}\n")
\ No newline at end of file
+    #     print(f"A: {answer}\n")
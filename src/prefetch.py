@@ -0,0 +1,75 @@
+"""
+Retrieve-then-answer fast path for the agent graphs of main.py and mas.py.
+
+In the "tools" mode every question costs at least two sequential LLM calls: one deciding
+to call the retriever and one answering from what it returned. In the "prefetch" mode a
+graph node retrieves for the question before the first LLM call and records it as if the
+LLM had asked for it (an AIMessage with the tool call, then its ToolMessage), so the
+conversation stays a valid tool-calling transcript and usually one LLM call answers.
+
+The LLM keeps its tools, so when the prefetched context is not enough it can still ask for
+more retrieval; the tool loop then runs as usual, for at most `max_tool_rounds` rounds per
+question (the prefetch included), after which the LLM is called without tools and has to
+answer from what it has.
+
+    AGENT_MODE       "tools" (default) or "prefetch"
+    MAX_TOOL_ROUNDS  retrieval rounds per question before the LLM must answer (default 3)
+"""
+import os
+import hashlib
+from langchain_core.messages import AIMessage, HumanMessage
+from history import split_turns
+from tool_executor import run_tool_calls, arun_tool_calls
+
+AGENT_MODES = ("tools", "prefetch")
+PREFETCH_ID_PREFIX = "prefetch_"
+
+
+def agent_mode(mode: str = None) -> str:
+    mode = (mode or os.getenv("AGENT_MODE", "tools")).lower()
+    if mode not in AGENT_MODES:
+        raise ValueError(f"Unknown agent mode {mode!r}, expected one of {AGENT_MODES}")
+    return mode
+
+
+def max_tool_rounds(rounds: int = None) -> int:
+    return rounds if rounds is not None else int(os.getenv("MAX_TOOL_ROUNDS", "3"))
+
+
+def current_question(messages: list) -> str:
+    for message in reversed(messages):
+        if isinstance(message, HumanMessage):
+            return message.content if isinstance(message.content, str) else str(message.content)
+    return ""
+
+
+def tool_rounds(messages: list) -> int:
+    """Tool-calling rounds so far in the current turn (since the last question)."""
+    turns = split_turns(messages)
+    return sum(1 for message in (turns[-1] if turns else []) if getattr(message, "tool_calls", None))
+
+
+def is_prefetched(message) -> bool:
+    """True for the tool call the prefetch node made on the LLM's behalf."""
+    tool_calls = getattr(message, "tool_calls", None) or []
+    return any(t["id"].startswith(PREFETCH_ID_PREFIX) for t in tool_calls)
+
+
+def _prefetch_call(tool_name: str, question: str) -> AIMessage:
+    call_id = PREFETCH_ID_PREFIX + hashlib.sha1(question.encode("utf-8")).hexdigest()[:12]
+    return AIMessage(
+        content="",
+        tool_calls=[{"name": tool_name, "args": {"query": question}, "id": call_id, "type": "tool_call"}],
+    )
+
+
+def prefetch(messages: list, tool_name: str, tools_dict: dict) -> list:
+    """Retrieve for the current question; returns the AIMessage tool call and its ToolMessage."""
+    call = _prefetch_call(tool_name, current_question(messages))
+    return [call] + run_tool_calls(call.tool_calls, tools_dict)
+
+
+async def aprefetch(messages: list, tool_name: str, tools_dict: dict) -> list:
+    """Async version of `prefetch`."""
+    call = _prefetch_call(tool_name, current_question(messages))
+    return [call] + await arun_tool_calls(call.tool_calls, tools_dict)
@@ -0,0 +1,214 @@
+import os
+import json
+import atexit
+import asyncio
+import hashlib
+import threading
+from array import array
+from pathlib import Path
+from collections import OrderedDict
+from langchain_core.documents import Document
+from indexing import collection_version
+from telemetry import span
+
+
+def normalize_query(query: str) -> str:
+    return " ".join(query.lower().split())
+
+
+def embedding_key(embedding: list) -> str:
+    return hashlib.sha1(array("f", embedding).tobytes()).hexdigest()
+
+
+class LRUCache:
+    """Thread-safe bounded mapping with hit/miss counters."""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return self._data[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, value) -> None:
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def items(self) -> list:
+        with self._lock:
+            return list(self._data.items())
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": len(self._data),
+        }
+
+
+class QueryCache:
+    """
+    Two-level cache for the query path.
+
+    - normalized query text -> query embedding
+    - (collection version, embedding, k) -> ranked [(chunk id, score)]
+
+    With a `path` the cache is loaded from and saved to a JSON file, so it survives restarts.
+    """
+
+    def __init__(self, max_embeddings: int = 2048, max_results: int = 2048, path: Path = None):
+        self.embeddings = LRUCache(max_embeddings)
+        self.results = LRUCache(max_results)
+        self.path = Path(path) if path else None
+        if self.path is not None:
+            self.load()
+            atexit.register(self.save)
+
+    def load(self) -> None:
+        if self.path is None or not self.path.exists():
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            for query, embedding in data.get("embeddings", []):
+                self.embeddings.put(query, embedding)
+            for key, ranked in data.get("results", []):
+                self.results.put(tuple(key), [tuple(item) for item in ranked])
+        except (OSError, ValueError) as e:
+            print(f"Could not load query cache from {self.path}: {e}")
+
+    def save(self) -> None:
+        if self.path is None:
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_suffix(".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({
+                "embeddings": self.embeddings.items(),
+                "results": [[list(key), ranked] for key, ranked in self.results.items()],
+            }, f)
+        os.replace(tmp_path, self.path)
+
+    def stats(self) -> dict:
+        return {
+            "embeddings": self.embeddings.stats(),
+            "results": self.results.stats(),
+        }
+
+
+class CachedRetriever:
+    """
+    Similarity retriever over a vector store that caches query embeddings and ranked results.
+
+    Exposes the `invoke(query)` interface of `vectorstore.as_retriever()` and also serves as an
+    embedding model (`embed_query`) so other query-path components share the embedding cache.
+    """
+
+    def __init__(self, vectorstore, k: int = 20, cache: QueryCache = None, embedding_model=None):
+        self.vectorstore = vectorstore
+        self.k = k
+        self.cache = cache or QueryCache()
+        self.embedding_model = embedding_model or vectorstore.embeddings
+        try:
+            self._relevance_fn = vectorstore._select_relevance_score_fn()
+        except (AttributeError, NotImplementedError, ValueError):
+            self._relevance_fn = lambda distance: distance
+
+    @classmethod
+    def from_retriever(cls, retriever, cache: QueryCache = None):
+        """Wrap a `vectorstore.as_retriever()` retriever, keeping its k."""
+        if isinstance(retriever, cls):
+            return retriever
+        k = getattr(retriever, "search_kwargs", {}).get("k", 20)
+        return cls(retriever.vectorstore, k=k, cache=cache)
+
+    def embed_query(self, text: str) -> list:
+        key = normalize_query(text)
+        embedding = self.cache.embeddings.get(key)
+        if embedding is None:
+            with span("embed_query"):
+                embedding = self.embedding_model.embed_query(key)
+            self.cache.embeddings.put(key, embedding)
+        return embedding
+
+    async def aembed_query(self, text: str) -> list:
+        key = normalize_query(text)
+        embedding = self.cache.embeddings.get(key)
+        if embedding is None:
+            with span("embed_query"):
+                embedding = await self.embedding_model.aembed_query(key)
+            self.cache.embeddings.put(key, embedding)
+        return embedding
+
+    def search(self, query: str, k: int = None) -> list:
+        """Return the top-k [(Document, relevance score)] for `query`, best first."""
+        return self._search_by_embedding(self.embed_query(query), k or self.k)
+
+    def search_with_embedding(self, query: str, embedding: list, k: int = None) -> list:
+        """`search` with a query embedding computed by the caller, e.g. once for several collections."""
+        return self._search_by_embedding(embedding, k or self.k)
+
+    async def asearch(self, query: str, k: int = None) -> list:
+        """Async `search`: the query embedding is awaited, the local vector search runs in a worker thread."""
+        embedding = await self.aembed_query(query)
+        return await asyncio.to_thread(self._search_by_embedding, embedding, k or self.k)
+
+    def _fetch_by_ids(self, ranked: list) -> list:
+        ids = [chunk_id for chunk_id, _ in ranked]
+        found = self.vectorstore.get(ids=ids, include=["documents", "metadatas"])
+        by_id = {
+            chunk_id: Document(id=chunk_id, page_content=text, metadata=metadata or {})
+            for chunk_id, text, metadata in zip(found["ids"], found["documents"], found["metadatas"])
+        }
+        return [(by_id[chunk_id], score) for chunk_id, score in ranked if chunk_id in by_id]
+
+    def _search_by_embedding(self, embedding: list, k: int) -> list:
+        key = (collection_version(self.vectorstore), embedding_key(embedding), k)
+
+        ranked = self.cache.results.get(key)
+        if ranked is not None:
+            results = self._fetch_by_ids(ranked)
+            if len(results) == len(ranked):
+                return results
+
+        results = [
+            (doc, self._relevance_fn(distance))
+            for doc, distance in self.vectorstore.similarity_search_by_vector_with_relevance_scores(embedding, k=k)
+        ]
+        if all(doc.id for doc, _ in results):
+            self.cache.results.put(key, [(doc.id, score) for doc, score in results])
+        return results
+
+    def get_embeddings(self, ids: list) -> dict:
+        """Stored chunk embeddings as {chunk id: vector}, for diversity-aware context packing."""
+        ids = [chunk_id for chunk_id in ids if chunk_id]
+        if not ids:
+            return {}
+        found = self.vectorstore.get(ids=ids, include=["embeddings"])
+        return {chunk_id: [float(x) for x in vector] for chunk_id, vector in zip(found["ids"], found["embeddings"])}
+
+    def invoke(self, query: str) -> list:
+        return [doc for doc, _ in self.search(query)]
+
+    async def ainvoke(self, query: str) -> list:
+        return [doc for doc, _ in await self.asearch(query)]
+
+    def stats(self) -> dict:
+        return self.cache.stats()
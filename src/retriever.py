@@ -1,31 +1,52 @@
 import os
-from langchain_community.document_loaders import UnstructuredMarkdownLoader
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from model import llm, embedding_model
-from langchain_chroma import Chroma
+from itertools import chain
 from pathlib import Path
-from image_info import get_image_info  
+from image_info import get_image_info, load_image_descriptions, render_image_descriptions, SIDECAR_FILE
+from embedding_cache import EmbeddingCache, CachedEmbeddings
+from embedding_engine import build_embedding_engine
+from indexing import sync_collection, iter_chunk_ids, read_index_version
+from markdown_chunker import MarkdownChunker
+from query_cache import CachedRetriever
+from bm25 import BM25Index, HybridRetriever, INDEX_FILE
+from collection_registry import default_vector_db_directory
+from vector_index import open_vectorstore
+from telemetry import traced_iter
 import os
 
-def retriever(markdown_path: Path, collection_name: str, directory: Path = Path(r"R:\TAZMIC\artifacts\Vector_databases")) -> object:
-    """Function to retrieve and process documents from a markdown file, split them into chunks, and store them in a vector database."""
+def chunk_markdown(markdown_path: Path, chunk_size: int = 1000, chunk_overlap: int = 200):
+    """
+    Lazily chunk a scraped paper: content.md split at headings and then by size, followed by
+    the image descriptions from the sidecar next to it.
+    """
+    # Offsets let the query path merge overlapping hits back into contiguous spans
+    chunker = MarkdownChunker(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+    chunks = chunker.split_file(markdown_path)
 
-    get_image_info(directory)
+    # Image descriptions live in a sidecar next to content.md and are chunked after the text
+    image_descriptions = render_image_descriptions(load_image_descriptions(Path(markdown_path).parent))
+    if image_descriptions:
+        sidecar = Path(markdown_path).parent / SIDECAR_FILE
+        chunks = chain(chunks, chunker.split_text(image_descriptions, {"source": str(sidecar)}))
+    # Chunking is interleaved with embedding, so only the time spent producing chunks is counted
+    return traced_iter("chunking", chunks, source=str(markdown_path))
 
-    loader = UnstructuredMarkdownLoader(
-        markdown_path,
-        mode="single",
-        strategy="fast",
-    )
-    
-    docs = loader.load()
 
-    text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=1000,
-        chunk_overlap=200
-    )
+def index_chunks(chunks, collection_name: str, directory: Path = None, embedding_cache_size: int = 200_000, incremental: bool = True, embedding_concurrency: int = 4, vector_store: str = None) -> object:
+    """
+    Embed and store a stream of chunks in the collection `collection_name` under `directory`,
+    write its BM25 index, and return a hybrid retriever over it.
 
-    pages_split = text_splitter.split_documents(docs) 
+    `vector_store` ("chroma" or "mmap", default VECTOR_STORE) picks the store for the
+    collection; without either, an existing collection keeps its store and new ones use Chroma.
+    """
+    directory = Path(directory or default_vector_db_directory())
+    bm25_index = BM25Index()
+
+    def index_lexically(chunks):
+        # The BM25 index is filled from the same stream that feeds the embeddings
+        for doc_id, doc in iter_chunk_ids(chunks):
+            bm25_index.add(doc_id, doc.page_content, doc.metadata)
+            yield doc
 
     persist_directory = Path(directory) / collection_name
     collection_name = collection_name
@@ -33,23 +54,69 @@ def retriever(markdown_path: Path, collection_name: str, directory: Path = Path(
     if not os.path.exists(persist_directory):
         os.makedirs(persist_directory)
         
+    embedding_cache = EmbeddingCache(Path(directory) / "embedding_cache.sqlite", max_entries=embedding_cache_size)
+    embedding_engine = build_embedding_engine(max_concurrency=embedding_concurrency)
+    cached_embedding_model = CachedEmbeddings(embedding_engine, embedding_cache)
+
     try:
-        vectorstore = Chroma.from_documents(
-            documents=pages_split,
-            embedding=embedding_model,
-            persist_directory=persist_directory,
-            collection_name=collection_name
+        vectorstore = open_vectorstore(
+            collection_name,
+            persist_directory,
+            cached_embedding_model,
+            backend=vector_store or os.getenv("VECTOR_STORE"),
         )
-        print(f"Created ChromaDB vector store!")
+        if not incremental:
+            vectorstore.reset_collection()
+
+        sync_collection(vectorstore, index_lexically(chunks), batch_size=256)
+        print(f"{type(vectorstore).__name__} vector store is up to date!")
+
+        bm25_index.version = read_index_version(vectorstore)
+        bm25_index.save(persist_directory / INDEX_FILE)
+        print(f"BM25 index built with {len(bm25_index)} chunks!")
+        print(f"Embedding cache stats: {embedding_cache.stats()}")
+        print(f"Embedding engine stats: {embedding_engine.stats()}")
         
     except Exception as e:
-        print(f"Error setting up ChromaDB: {str(e)}")
+        print(f"Error setting up the vector store: {str(e)}")
         raise
 
-    # Now we create our retriever 
-    retriever = vectorstore.as_retriever(
-        search_type="similarity",
-        search_kwargs={"k": 20}
-    )
+    # Now we create our retriever, with query embeddings and results cached, fused with BM25
+    retriever = HybridRetriever(CachedRetriever(vectorstore, k=20), bm25_index)
     
-    return retriever
\ No newline at end of file
+    return retriever
+
+
+def retriever(markdown_path: Path, collection_name: str, directory: Path = None, embedding_cache_size: int = 200_000, incremental: bool = True, embedding_concurrency: int = 4, vector_store: str = None) -> object:
+    """Function to retrieve and process documents from a markdown file, split them into chunks, and store them in a vector database.
+
+    Chunk embeddings are served from an on-disk cache shared by every collection under
+    `directory`, so only chunks that have never been embedded reach the embedding API.
+    Cache misses are embedded in token-budgeted batches, `embedding_concurrency` requests
+    at a time, backing off on 429 responses.
+
+    Chunks are stored under content-hash IDs. With `incremental=True` an existing collection
+    is diffed against the new chunk set: only new chunks are added and removed ones deleted.
+    With `incremental=False` the collection is emptied and rebuilt.
+
+    The markdown is read and chunked as a stream (split at headings, then by size, with the
+    section path in each chunk's metadata), and chunks are embedded a batch at a time as they
+    are produced, so neither the markdown nor the embeddings of the whole page are held at
+    once. The BM25 index built alongside does keep every chunk's text (it serves them at query
+    time), so ingest memory still grows with the number of chunks, by about the page's size.
+
+    A BM25 index over the same chunks is written next to the collection, and the returned
+    retriever fuses lexical and vector results. See `index_chunks` for `vector_store`.
+    """
+
+    get_image_info(Path(markdown_path).parent)
+
+    return index_chunks(
+        chunk_markdown(markdown_path),
+        collection_name,
+        directory,
+        embedding_cache_size=embedding_cache_size,
+        incremental=incremental,
+        embedding_concurrency=embedding_concurrency,
+        vector_store=vector_store,
+    )
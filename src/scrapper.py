@@ -1,9 +1,13 @@
-from firecrawl import FirecrawlApp
 from dotenv import load_dotenv
 import os
+import json
 import base64
+import hashlib
+from functools import cache
 from datetime import datetime
 import requests
+import requests.adapters
+from telemetry import traced
 from pathlib import Path
 from urllib.parse import urlparse
 
@@ -37,53 +41,162 @@ def extract_page_identifier(url: str) -> str:
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
         return timestamp
 
-def scrape_url(url, output_dir=r"R:\TAZMIC\artifacts\research_papers"):
-    app = FirecrawlApp(api_key=os.getenv('firecrawl_api_key'))
+def default_output_dir() -> Path:
+    """Directory holding one folder of scraped content per paper (`<directory>/<page identifier>`)."""
+    if os.getenv("RESEARCH_PAPERS_DIRECTORY"):
+        return Path(os.getenv("RESEARCH_PAPERS_DIRECTORY"))
+    if os.path.exists("/app/artifacts/research_papers"):
+        return Path("/app/artifacts/research_papers")
+    return Path("artifacts/research_papers")
+
+METADATA_FILE = "metadata.json"
+
+@cache
+def get_session() -> requests.Session:
+    """Process-wide HTTP session, so repeated requests to the same host reuse connections."""
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=16, pool_maxsize=16, max_retries=2)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+def content_hash(markdown: str) -> str:
+    return hashlib.sha256(markdown.encode("utf-8")).hexdigest()
+
+def load_metadata(output_dir) -> dict:
+    """What the last scrape recorded in `<output_dir>/metadata.json`, or {}."""
+    metadata_path = Path(output_dir) / METADATA_FILE
+    if not metadata_path.exists():
+        return {}
+    try:
+        with open(metadata_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def _save_metadata(output_dir, metadata: dict) -> None:
+    metadata_path = Path(output_dir) / METADATA_FILE
+    tmp_path = metadata_path.with_suffix(".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(metadata, f, indent=2)
+    os.replace(tmp_path, metadata_path)
+
+def _validators(response) -> dict:
+    return {"etag": response.headers.get("ETag"), "last_modified": response.headers.get("Last-Modified")}
+
+def check_unchanged(url: str, metadata: dict, timeout: float = 10.0):
+    """
+    Ask the server whether `url` changed since the validators stored in `metadata`.
+
+    Returns (unchanged, validators). A conditional HEAD answered with 304, or with the stored
+    ETag, means unchanged. Any failure means "unknown" and the page is scraped.
+    """
+    headers = {}
+    if metadata.get("etag"):
+        headers["If-None-Match"] = metadata["etag"]
+    if metadata.get("last_modified"):
+        headers["If-Modified-Since"] = metadata["last_modified"]
+    try:
+        response = get_session().head(url, headers=headers, timeout=timeout, allow_redirects=True)
+    except requests.RequestException as e:
+        print(f"Conditional check failed for {url}: {e}")
+        return False, {}
+    if response.status_code == 304:
+        return bool(headers), {}
+    validators = _validators(response)
+    if not response.ok:
+        return False, {}
+    unchanged = bool(metadata.get("etag")) and validators["etag"] == metadata["etag"]
+    return unchanged, validators
+
+def _save_screenshot(screenshot_data: str, output_dir: str) -> None:
+    if screenshot_data.startswith('http'):
+        print(f"Downloading screenshot from: {screenshot_data}")
+        response = get_session().get(screenshot_data, timeout=60)
+        response.raise_for_status()
+
+        with open(f"{output_dir}/screenshot.png", 'wb') as f:
+            f.write(response.content)
+        print("Screenshot downloaded and saved successfully")
+
+    elif screenshot_data.startswith('data:image'):
+        screenshot_data = screenshot_data.split(',')[1]
+
+        def fix_base64_padding(data):
+            missing_padding = len(data) % 4
+            if missing_padding:
+                data += '=' * (4 - missing_padding)
+            return data
+
+        screenshot_data = fix_base64_padding(screenshot_data)
+
+        with open(f"{output_dir}/screenshot.png", 'wb') as f:
+            f.write(base64.b64decode(screenshot_data))
+        print("Screenshot decoded and saved successfully")
+    else:
+        print(f"Unknown screenshot format: {screenshot_data[:50]}...")
+
+@traced("scrape_url")
+def scrape_if_changed(url, output_dir=None, app=None, conditional=True, force=False):
+    """
+    Scrape `url` into `<output_dir>/<page identifier>` unless it has not changed since the last scrape.
+
+    Change detection uses what the last scrape stored in metadata.json:
+        - with `conditional`, a HEAD request with If-None-Match / If-Modified-Since; a 304
+          (or the same ETag) skips the scrape entirely
+        - otherwise the page is scraped and the SHA-256 of its markdown compared with the
+          stored one; if equal, content.md and the screenshot are left untouched
+
+    Returns (output_dir, page_identifier, changed). When `changed` is False nothing
+    downstream (image descriptions, chunks, embeddings) needs to be redone.
+    """
+    page_identifier = extract_page_identifier(url)
+    output_dir = f"{output_dir or default_output_dir()}/{page_identifier}"
+    os.makedirs(output_dir, exist_ok=True)
+
+    metadata = {} if force else load_metadata(output_dir)
+    have_content = os.path.exists(f"{output_dir}/content.md") and metadata.get("url") == url
+    now = datetime.now().isoformat()
+
+    validators = {}
+    if conditional and urlparse(url).scheme in ("http", "https"):
+        unchanged, validators = check_unchanged(url, metadata if have_content else {})
+        if unchanged and have_content:
+            print(f"Not modified since {metadata.get('scraped_at')}: {url}")
+            _save_metadata(output_dir, {**metadata, "checked_at": now})
+            return output_dir, page_identifier, False
+
+    if app is None:
+        from firecrawl import FirecrawlApp
+        app = FirecrawlApp(api_key=os.getenv('firecrawl_api_key'))
 
     result = app.scrape_url(
-        'https://transformer-circuits.pub/2025/attribution-graphs/biology.html',
+        url,
         formats=['markdown', 'screenshot', 'links']
     )
 
-    page_identifier = extract_page_identifier(url)
-    
-    output_dir = f"{output_dir}/{page_identifier}"
-    
-    os.makedirs(output_dir, exist_ok=True)
+    markdown_hash = content_hash(result.markdown)
+    changed = not have_content or markdown_hash != metadata.get("content_hash")
+    metadata = {
+        **metadata,
+        "url": url,
+        "page_identifier": page_identifier,
+        "etag": validators.get("etag") or metadata.get("etag"),
+        "last_modified": validators.get("last_modified") or metadata.get("last_modified"),
+        "content_hash": markdown_hash,
+        "checked_at": now,
+    }
+    if not changed:
+        print(f"Content unchanged since {metadata.get('scraped_at')}: {url}")
+        _save_metadata(output_dir, metadata)
+        return output_dir, page_identifier, False
 
     with open(f"{output_dir}/content.md", 'w', encoding='utf-8') as f:
         f.write(result.markdown)
 
     if hasattr(result, 'screenshot') and result.screenshot:
         try:
-            screenshot_data = result.screenshot
-            
-            if screenshot_data.startswith('http'):
-                print(f"Downloading screenshot from: {screenshot_data}")
-                response = requests.get(screenshot_data)
-                response.raise_for_status()
-                
-                with open(f"{output_dir}/screenshot.png", 'wb') as f:
-                    f.write(response.content)
-                print("Screenshot downloaded and saved successfully")
-                
-            elif screenshot_data.startswith('data:image'):
-                screenshot_data = screenshot_data.split(',')[1]
-                
-                def fix_base64_padding(data):
-                    missing_padding = len(data) % 4
-                    if missing_padding:
-                        data += '=' * (4 - missing_padding)
-                    return data
-                
-                screenshot_data = fix_base64_padding(screenshot_data)
-                
-                with open(f"{output_dir}/screenshot.png", 'wb') as f:
-                    f.write(base64.b64decode(screenshot_data))
-                print("Screenshot decoded and saved successfully")
-            else:
-                print(f"Unknown screenshot format: {screenshot_data[:50]}...")
-                
+            _save_screenshot(result.screenshot, output_dir)
         except Exception as e:
             print(f"Error saving screenshot: {e}")
             with open(f"{output_dir}/screenshot_debug.txt", 'w') as f:
@@ -93,9 +206,24 @@ def scrape_url(url, output_dir=r"R:\TAZMIC\artifacts\research_papers"):
     else:
         print("No screenshot data available")
 
+    # Written last, so an interrupted scrape is redone next time
+    metadata["scraped_at"] = now
+    _save_metadata(output_dir, metadata)
+
     print(f"Data saved to directory: {output_dir}")
     print(f"Content size: {len(result.markdown)} characters")
     print(f"Links found: {len(result.links) if hasattr(result, 'links') and result.links else 0}")
     print(f"Screenshot: {'Available' if hasattr(result, 'screenshot') and result.screenshot else 'Not available'}")
-    
+
+    return output_dir, page_identifier, True
+
+def scrape_url(url, output_dir=None, app=None, conditional=True):
+    """
+    Scrape `url` and save its markdown and screenshot under `<output_dir>/<page identifier>`.
+
+    `app` is any object with Firecrawl's `scrape_url(url, formats=...)`, e.g. the local
+    stand-in in firecrawl_stub.py; by default a FirecrawlApp is created. Unchanged pages
+    are not rewritten (see `scrape_if_changed`).
+    """
+    output_dir, page_identifier, _ = scrape_if_changed(url, output_dir, app=app, conditional=conditional)
     return output_dir, page_identifier
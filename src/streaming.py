@@ -0,0 +1,111 @@
+from langchain_core.messages import HumanMessage, AIMessage, AIMessageChunk
+
+LLM_NODE = "llm"
+TOOL_NODE = "retriever_agent"
+# Retrieves for the question before the first LLM call (see prefetch.py)
+PREFETCH_NODE = "prefetch"
+STREAM_MODES = ["messages", "updates"]
+
+
+def _translate(mode: str, payload, state: dict):
+    """Turn one LangGraph stream item into zero or more progress events."""
+    if mode == "messages":
+        chunk, metadata = payload
+        if metadata.get("langgraph_node") != LLM_NODE or not isinstance(chunk, AIMessageChunk):
+            return
+        if isinstance(chunk.content, str) and chunk.content:
+            yield {"type": "token", "content": chunk.content}
+
+    elif mode == "updates":
+        for node, update in payload.items():
+            for message in (update or {}).get("messages", []):
+                if node == LLM_NODE or (node == PREFETCH_NODE and message.type == "ai"):
+                    tool_calls = getattr(message, "tool_calls", None) or []
+                    for t in tool_calls:
+                        yield {"type": "tool_call", "name": t["name"], "query": t["args"].get("query", "")}
+                    if not tool_calls:
+                        state["final"] = message.content
+                elif node in (TOOL_NODE, PREFETCH_NODE):
+                    yield {"type": "tool_result", "name": message.name, "length": len(str(message.content))}
+
+
+def stream_events(rag_agent, user_input: str, config: dict):
+    """
+    Run the agent graph on one question and yield progress events as they happen.
+
+    Events are dicts with a "type" key:
+        {"type": "token", "content": str}                  a piece of the answer from the LLM
+        {"type": "tool_call", "name": str, "query": str}   the LLM asked for a tool
+        {"type": "tool_result", "name": str, "length": int} a tool finished
+        {"type": "final", "content": str, "cached": False} the complete answer (always last)
+    """
+    state = {"final": ""}
+    events = rag_agent.stream(
+        {"messages": [HumanMessage(content=user_input)]},
+        config,
+        stream_mode=STREAM_MODES,
+    )
+    for mode, payload in events:
+        yield from _translate(mode, payload, state)
+
+    yield {"type": "final", "content": state["final"], "cached": False}
+
+
+async def astream_events(rag_agent, user_input: str, config: dict):
+    """Async version of `stream_events`, for graphs with async nodes."""
+    state = {"final": ""}
+    events = rag_agent.astream(
+        {"messages": [HumanMessage(content=user_input)]},
+        config,
+        stream_mode=STREAM_MODES,
+    )
+    async for mode, payload in events:
+        for event in _translate(mode, payload, state):
+            yield event
+
+    yield {"type": "final", "content": state["final"], "cached": False}
+
+
+def final_answer(events) -> str:
+    """Drain an event stream and return the final answer."""
+    final_response = ""
+    for event in events:
+        if event["type"] == "final":
+            final_response = event["content"]
+    return final_response
+
+
+async def afinal_answer(events) -> str:
+    """Drain an async event stream and return the final answer."""
+    final_response = ""
+    async for event in events:
+        if event["type"] == "final":
+            final_response = event["content"]
+    return final_response
+
+
+def has_history(rag_agent, config: dict) -> bool:
+    """True once the conversation thread holds earlier turns."""
+    return bool(rag_agent.get_state(config).values.get("messages"))
+
+
+async def ahas_history(rag_agent, config: dict) -> bool:
+    """Async version of `has_history`."""
+    return bool((await rag_agent.aget_state(config)).values.get("messages"))
+
+
+def _answered_turn(user_input: str, answer: str) -> dict:
+    return {"messages": [HumanMessage(content=user_input), AIMessage(content=answer)]}
+
+
+def record_answer(rag_agent, config: dict, user_input: str, answer: str) -> None:
+    """
+    Add a question answered outside the graph (e.g. from the answer cache) to the thread,
+    as if the LLM had answered it, so later turns see the exchange.
+    """
+    rag_agent.update_state(config, _answered_turn(user_input, answer), as_node=LLM_NODE)
+
+
+async def arecord_answer(rag_agent, config: dict, user_input: str, answer: str) -> None:
+    """Async version of `record_answer`."""
+    await rag_agent.aupdate_state(config, _answered_turn(user_input, answer), as_node=LLM_NODE)
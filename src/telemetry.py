@@ -0,0 +1,430 @@
+"""
+Tracing and metrics for the ingest and query paths.
+
+    span(name, **attrs)        times a block; the duration goes to the `rag_span_seconds`
+                               histogram and, as a JSON line, to the log (see logger.py)
+    traced(name)               the same as a decorator, for sync and async functions
+    traced_iter(name, it)      times the work done producing the items of a lazy iterator
+    request(name, ...)         groups the spans of one question; emits a summary record,
+                               feeds request hooks and optionally profiles the request
+    record_llm_call(...)       prompt / completion token counters and agent loop iterations
+
+Metrics are kept in process and rendered in the Prometheus text format by `render_metrics()`,
+served over HTTP by `start_metrics_server()` (METRICS_PORT).
+
+Profiling is opt-in per request (`request(..., profile=True)` or PROFILE_REQUESTS=1): each
+top-level span of the request runs under cProfile, and the merged stats are handed to the
+request hooks; with PROFILE_DIR set they are also saved there as `<request id>.prof`.
+"""
+import os
+import time
+import uuid
+import pstats
+import cProfile
+import asyncio
+import threading
+import functools
+from contextlib import contextmanager
+from contextvars import ContextVar
+from logger import get_logger
+
+log = get_logger("rag.telemetry")
+
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+ITERATION_BUCKETS = (1, 2, 3, 4, 5, 6, 8, 10, 15, 25)
+
+
+class Histogram:
+    def __init__(self, buckets: tuple):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.count += 1
+        self.sum += value
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+
+
+class Metrics:
+    """Thread-safe counters and histograms keyed by (name, labels)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+        self.help = {}
+        # Callables returning {metric name: value}, read when metrics are rendered (e.g. cache stats)
+        self.collectors = []
+
+    def inc(self, name: str, value: float = 1, help: str = "", **labels) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+            self.help.setdefault(name, help)
+
+    def observe(self, name: str, value: float, buckets: tuple = SECONDS_BUCKETS, help: str = "", **labels) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram(buckets)
+            histogram.observe(value)
+            self.help.setdefault(name, help)
+
+    def register_collector(self, collector) -> None:
+        with self._lock:
+            self.collectors.append(collector)
+
+    def counter_value(self, name: str, **labels) -> float:
+        with self._lock:
+            return self.counters.get((name, tuple(sorted(labels.items()))), 0)
+
+    def reset(self) -> None:
+        with self._lock:
+            self.counters.clear()
+            self.histograms.clear()
+
+    def render(self) -> str:
+        """Prometheus text exposition format."""
+        lines = []
+        typed = set()
+
+        def header(name: str, kind: str):
+            if name not in typed:
+                typed.add(name)
+                if self.help.get(name):
+                    lines.append(f"# HELP {name} {self.help[name]}")
+                lines.append(f"# TYPE {name} {kind}")
+
+        with self._lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted(self.histograms.items(), key=lambda item: item[0])
+            collectors = list(self.collectors)
+
+        for (name, labels), value in counters:
+            header(name, "counter")
+            lines.append(f"{name}{_labels(labels)} {value}")
+        for (name, labels), histogram in histograms:
+            header(name, "histogram")
+            for bound, count in zip(histogram.buckets, histogram.counts):
+                lines.append(f"{name}_bucket{_labels(labels + (('le', bound),))} {count}")
+            lines.append(f"{name}_bucket{_labels(labels + (('le', '+Inf'),))} {histogram.count}")
+            lines.append(f"{name}_sum{_labels(labels)} {histogram.sum}")
+            lines.append(f"{name}_count{_labels(labels)} {histogram.count}")
+        for collector in collectors:
+            try:
+                gauges = collector()
+            except Exception as e:
+                log.warning("metrics collector failed", extra={"fields": {"error": str(e)}})
+                continue
+            for name, value in sorted(gauges.items()):
+                header(name, "gauge")
+                lines.append(f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+
+def _labels(labels: tuple) -> str:
+    if not labels:
+        return ""
+    def escape(value) -> str:
+        return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return "{" + ",".join(f'{key}="{escape(value)}"' for key, value in labels) + "}"
+
+
+def flatten_stats(prefix: str, stats: dict) -> dict:
+    """{"embeddings": {"hits": 3}} -> {"<prefix>_embeddings_hits": 3}, numeric values only."""
+    flat = {}
+    for key, value in stats.items():
+        name = f"{prefix}_{key}"
+        if isinstance(value, dict):
+            flat.update(flatten_stats(name, value))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[name] = value
+    return flat
+
+
+metrics = Metrics()
+
+
+# Requests and spans
+
+class RequestTrace:
+    def __init__(self, name: str, profile: bool, attrs: dict):
+        self.id = uuid.uuid4().hex[:16]
+        self.name = name
+        self.attrs = attrs
+        self.profile = profile
+        self.spans = []
+        self.tokens = {"input_tokens": 0, "output_tokens": 0}
+        self.llm_calls = 0
+        self.stats = None
+        self._profiling = False
+        self._lock = threading.Lock()
+
+    def summary(self, seconds: float, status: str) -> dict:
+        return {
+            "request_id": self.id,
+            "request": self.name,
+            "status": status,
+            "duration_ms": round(seconds * 1000, 3),
+            "llm_calls": self.llm_calls,
+            **self.tokens,
+            "spans": list(self.spans),
+            **self.attrs,
+        }
+
+
+_current_request = ContextVar("current_request", default=None)
+_request_hooks = []
+
+
+def add_request_hook(hook) -> None:
+    """Call `hook(summary: dict, stats: pstats.Stats | None)` after every traced request."""
+    _request_hooks.append(hook)
+
+
+def current_request_id() -> str:
+    trace = _current_request.get()
+    return trace.id if trace else None
+
+
+def _start_profile(trace: RequestTrace):
+    # cProfile only sees the thread it runs in, and only one profiler can be active at a
+    # time, so only the outermost span of a profiled request is profiled
+    if trace is None or not trace.profile:
+        return None
+    with trace._lock:
+        if trace._profiling:
+            return None
+        trace._profiling = True
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        trace._profiling = False
+        return None
+    return profiler
+
+
+def _stop_profile(trace: RequestTrace, profiler) -> None:
+    if profiler is None:
+        return
+    profiler.disable()
+    with trace._lock:
+        trace._profiling = False
+        if trace.stats is None:
+            trace.stats = pstats.Stats(profiler)
+        else:
+            trace.stats.add(profiler)
+
+
+def _finish_span(name: str, started: float, status: str, attrs: dict) -> None:
+    seconds = time.perf_counter() - started
+    metrics.observe("rag_span_seconds", seconds, help="Duration of traced operations", span=name)
+    if status != "ok":
+        metrics.inc("rag_span_errors_total", help="Traced operations that raised", span=name)
+    record = {"span": name, "duration_ms": round(seconds * 1000, 3), "status": status, **attrs}
+    trace = _current_request.get()
+    if trace is not None:
+        record["request_id"] = trace.id
+        with trace._lock:
+            trace.spans.append({"span": name, "duration_ms": record["duration_ms"], "status": status})
+    log.info("span", extra={"fields": record})
+
+
+@contextmanager
+def span(name: str, **attrs):
+    """
+    Time a block. The yielded dict can be filled with attributes known only at the end
+    (result sizes, token counts); they are logged with the span.
+    """
+    trace = _current_request.get()
+    profiler = _start_profile(trace)
+    started = time.perf_counter()
+    status = "ok"
+    try:
+        yield attrs
+    except BaseException as e:
+        status = "cancelled" if isinstance(e, (GeneratorExit, asyncio.CancelledError)) else "error"
+        if status == "error":
+            attrs["error"] = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        _stop_profile(trace, profiler)
+        _finish_span(name, started, status, attrs)
+
+
+def traced(name: str):
+    """Decorator form of `span` for sync and async functions."""
+    def decorate(func):
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with span(name):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def traced_iter(name: str, iterable, **attrs):
+    """
+    Yield from `iterable`, timing only the work of producing its items (not the consumer's),
+    and record one span with the total and the item count once it is exhausted.
+    """
+    iterator = iter(iterable)
+    busy = 0.0
+    items = 0
+    status = "ok"
+    try:
+        while True:
+            started = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                busy += time.perf_counter() - started
+                break
+            busy += time.perf_counter() - started
+            items += 1
+            yield item
+    except BaseException as e:
+        status = "cancelled" if isinstance(e, GeneratorExit) else "error"
+        raise
+    finally:
+        # _finish_span measures from `started`, so pass a start time `busy` seconds ago
+        _finish_span(name, time.perf_counter() - busy, status, {**attrs, "items": items})
+
+
+@contextmanager
+def request(name: str, profile: bool = None, **attrs):
+    """
+    Trace one request (e.g. a question): its spans, LLM calls and tokens are collected and
+    logged as one summary record when it ends, and passed to the request hooks.
+    """
+    if profile is None:
+        profile = os.getenv("PROFILE_REQUESTS") == "1"
+    trace = RequestTrace(name, profile, attrs)
+    token = _current_request.set(trace)
+    started = time.perf_counter()
+    status = "ok"
+    try:
+        yield trace
+    except BaseException as e:
+        status = "cancelled" if isinstance(e, (GeneratorExit, asyncio.CancelledError)) else "error"
+        raise
+    finally:
+        try:
+            _current_request.reset(token)
+        except ValueError:
+            # Generators may be closed from another context than the one they started in
+            _current_request.set(None)
+        seconds = time.perf_counter() - started
+        metrics.observe("rag_request_seconds", seconds, help="End-to-end duration of traced requests", request=name)
+        summary = trace.summary(seconds, status)
+        log.info("request", extra={"fields": summary})
+        for hook in list(_request_hooks):
+            try:
+                hook(summary, trace.stats)
+            except Exception as e:
+                log.warning("request hook failed", extra={"fields": {"error": str(e)}})
+
+
+def record_llm_call(message, history: list = None, agent: str = "main") -> None:
+    """
+    Count one chat model call: prompt / completion tokens from the message's usage metadata
+    and, when the answer ends the agent loop, how many LLM calls the question took.
+    """
+    usage = getattr(message, "usage_metadata", None) or {}
+    input_tokens = usage.get("input_tokens", 0)
+    output_tokens = usage.get("output_tokens", 0)
+    metrics.inc("rag_llm_calls_total", help="Chat model calls", agent=agent)
+    metrics.inc("rag_llm_prompt_tokens_total", input_tokens, help="Prompt tokens sent to the chat model", agent=agent)
+    metrics.inc("rag_llm_completion_tokens_total", output_tokens, help="Completion tokens returned by the chat model", agent=agent)
+
+    trace = _current_request.get()
+    if trace is not None:
+        with trace._lock:
+            trace.llm_calls += 1
+            trace.tokens["input_tokens"] += input_tokens
+            trace.tokens["output_tokens"] += output_tokens
+
+    if history is not None and not getattr(message, "tool_calls", None):
+        # Imported here: prefetch.py sits on top of the modules this one instruments
+        from prefetch import is_prefetched
+
+        # LLM calls since the question: earlier ones in this turn plus this one. The prefetch
+        # node's tool call is made without the LLM and does not count
+        iterations = 1
+        for previous in reversed(history):
+            if getattr(previous, "type", None) == "human":
+                break
+            if getattr(previous, "type", None) == "ai" and not is_prefetched(previous):
+                iterations += 1
+        metrics.observe("rag_agent_iterations", iterations, buckets=ITERATION_BUCKETS, help="LLM calls per answered question", agent=agent)
+
+
+def save_profile(summary: dict, stats) -> None:
+    """Request hook: write profiled requests to PROFILE_DIR/<request id>.prof."""
+    directory = os.getenv("PROFILE_DIR")
+    if stats is None or not directory:
+        return
+    os.makedirs(directory, exist_ok=True)
+    stats.dump_stats(os.path.join(directory, f"{summary['request_id']}.prof"))
+
+
+add_request_hook(save_profile)
+
+
+# Prometheus endpoint
+
+def render_metrics() -> str:
+    return metrics.render()
+
+
+_server = None
+_server_lock = threading.Lock()
+
+
+def start_metrics_server(port: int = None, host: str = "0.0.0.0"):
+    """
+    Serve `/metrics` on `port` (default: METRICS_PORT) from a background thread.
+
+    Safe to call repeatedly; returns the server, or None when no port is configured.
+    """
+    global _server
+    port = port or int(os.getenv("METRICS_PORT", "0"))
+    if not port:
+        return None
+    with _server_lock:
+        if _server is None:
+            # Imported here so the query path does not pay for http.server unless metrics are served
+            from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+            class MetricsHandler(BaseHTTPRequestHandler):
+                def do_GET(self):
+                    if self.path.split("?")[0] != "/metrics":
+                        self.send_error(404)
+                        return
+                    body = render_metrics().encode("utf-8")
+                    self.send_response(200)
+                    self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+
+                def log_message(self, format, *args):
+                    pass
+
+            _server = ThreadingHTTPServer((host, port), MetricsHandler)
+            threading.Thread(target=_server.serve_forever, name="metrics-server", daemon=True).start()
+            log.info("metrics server started", extra={"fields": {"port": port}})
+        return _server
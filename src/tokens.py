@@ -0,0 +1,23 @@
+_encoding = None
+_encoding_loaded = False
+
+
+def _get_encoding():
+    """Load the cl100k_base tokenizer once; fall back to a character heuristic if it is unavailable."""
+    global _encoding, _encoding_loaded
+    if not _encoding_loaded:
+        _encoding_loaded = True
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding("cl100k_base")
+        except Exception:
+            _encoding = None
+    return _encoding
+
+
+def count_tokens(text: str) -> int:
+    """Number of tokens in `text` for the OpenAI embedding and chat models (approximate without tiktoken)."""
+    encoding = _get_encoding()
+    if encoding is None:
+        return max(1, len(text) // 4)
+    return len(encoding.encode(text, disallowed_special=()))
@@ -0,0 +1,109 @@
+"""
+Runs the tool calls of one agent step concurrently.
+
+Used by the tool nodes of main.py and mas.py. Identical calls in a step (same tool, same
+normalized query) are run once and their result is shared; the distinct ones run in
+parallel on a bounded pool. Every call gets its ToolMessage, in the order of `tool_calls`,
+and a failing call only turns its own ToolMessage into an error.
+"""
+import os
+import asyncio
+import contextvars
+from functools import cache
+from concurrent.futures import ThreadPoolExecutor
+from langchain_core.messages import ToolMessage
+from query_cache import normalize_query
+from telemetry import metrics
+from logger import get_logger
+
+log = get_logger("rag.tools")
+
+UNKNOWN_TOOL = "Incorrect Tool Name, Please Retry and Select tool from List of Available tools."
+TOOL_CONCURRENCY = int(os.getenv("TOOL_CONCURRENCY", "4"))
+
+
+@cache
+def _pool() -> ThreadPoolExecutor:
+    return ThreadPoolExecutor(max_workers=TOOL_CONCURRENCY, thread_name_prefix="tool-call")
+
+
+def _query(tool_call: dict) -> str:
+    return tool_call['args'].get('query', '')
+
+
+def _group(tool_calls: list) -> dict:
+    """{(tool name, normalized query): [indices into tool_calls]}, in first-seen order."""
+    groups = {}
+    for i, tool_call in enumerate(tool_calls):
+        metrics.inc("rag_tool_calls_total", help="Tool calls requested by the LLM", tool=tool_call['name'])
+        groups.setdefault((tool_call['name'], normalize_query(_query(tool_call))), []).append(i)
+    duplicates = len(tool_calls) - len(groups)
+    if duplicates:
+        metrics.inc("rag_tool_calls_deduplicated_total", duplicates, help="Tool calls answered by an identical call in the same step")
+    return groups
+
+
+def _failure(tool_call: dict, error: Exception) -> str:
+    log.error("tool failed", extra={"fields": {"tool": tool_call['name'], "query": _query(tool_call), "error": str(error)}})
+    return f"Tool execution failed: {str(error)}"
+
+
+def _invoke(tools_dict: dict, tool_call: dict) -> str:
+    if tool_call['name'] not in tools_dict:
+        log.warning("unknown tool", extra={"fields": {"tool": tool_call['name']}})
+        return UNKNOWN_TOOL
+    try:
+        return str(tools_dict[tool_call['name']].invoke(_query(tool_call)))
+    except Exception as e:
+        return _failure(tool_call, e)
+
+
+async def _ainvoke(tools_dict: dict, tool_call: dict, semaphore: asyncio.Semaphore) -> str:
+    if tool_call['name'] not in tools_dict:
+        log.warning("unknown tool", extra={"fields": {"tool": tool_call['name']}})
+        return UNKNOWN_TOOL
+    async with semaphore:
+        try:
+            return str(await tools_dict[tool_call['name']].ainvoke(_query(tool_call)))
+        except Exception as e:
+            return _failure(tool_call, e)
+
+
+def _messages(tool_calls: list, groups: dict, results: list) -> list:
+    contents = [None] * len(tool_calls)
+    for indices, result in zip(groups.values(), results):
+        for i in indices:
+            contents[i] = result
+    # Every tool call gets an answer with its own ID, even the deduplicated ones
+    return [
+        ToolMessage(tool_call_id=tool_call['id'], name=tool_call['name'], content=content)
+        for tool_call, content in zip(tool_calls, contents)
+    ]
+
+
+def run_tool_calls(tool_calls: list, tools_dict: dict) -> list:
+    """Run a step's tool calls (deduplicated, in parallel) and return their ToolMessages in order."""
+    groups = _group(tool_calls)
+    first_calls = [tool_calls[indices[0]] for indices in groups.values()]
+
+    if len(first_calls) == 1:
+        results = [_invoke(tools_dict, first_calls[0])]
+    else:
+        # Each call runs in a copy of the caller's context, so context variables (the
+        # collection to search, the request trace) reach the tools
+        futures = [
+            _pool().submit(contextvars.copy_context().run, _invoke, tools_dict, tool_call)
+            for tool_call in first_calls
+        ]
+        results = [future.result() for future in futures]
+    return _messages(tool_calls, groups, results)
+
+
+async def arun_tool_calls(tool_calls: list, tools_dict: dict) -> list:
+    """Async `run_tool_calls`: at most TOOL_CONCURRENCY calls in flight at once."""
+    groups = _group(tool_calls)
+    semaphore = asyncio.Semaphore(TOOL_CONCURRENCY)
+    results = await asyncio.gather(*(
+        _ainvoke(tools_dict, tool_calls[indices[0]], semaphore) for indices in groups.values()
+    ))
+    return _messages(tool_calls, groups, results)
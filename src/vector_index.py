@@ -0,0 +1,478 @@
+"""
+Memory-mapped, quantized vector index: a lightweight alternative to Chroma for serving papers.
+
+A collection of a few thousand chunks does not need an HNSW graph. This store keeps its
+vectors in flat NumPy files next to the collection and searches them by brute force:
+
+    vector_index.json   manifest: dimensions, quantization, generation, chunk IDs and
+                        text offsets
+    vectors.<gen>.q     unit-normalized vectors quantized to float16, or int8 with
+    scales.<gen>.f32    a per-row scale
+    vectors.<gen>.f32   the same vectors at full precision
+    chunks.<gen>.jsonl  chunk texts and metadata, one JSON line per row
+
+Adding chunks appends to the current generation's files past what the manifest covers.
+Deleting or replacing chunks writes the remaining rows to the files of a new generation; in
+both cases the change is committed by replacing the manifest, so bytes a committed manifest
+points at are never changed and a crash part-way leaves the index as it was. The files of
+older generations are removed after the commit (generation 0 has no number in its names).
+
+Every file is memory-mapped, so opening a collection reads the manifest and nothing else. A
+search scores the quantized matrix (2x or 4x smaller than float32), takes the
+`oversample * k` best candidates and re-scores only those rows at full precision, so the
+full-precision file and the texts are paged in a few rows at a time.
+
+The store implements the parts of the LangChain VectorStore / Chroma interface the project
+uses (`as_retriever`, `similarity_search*`, `get`, `add_documents`, `delete`), so it plugs in
+wherever a Chroma store did. Set VECTOR_STORE=mmap (and optionally VECTOR_QUANTIZATION=int8)
+when ingesting, or convert an existing Chroma collection in place, without re-embedding:
+
+    python src/vector_index.py artifacts/Vector_databases/biology --quantization int8
+
+A collection holding a memory-mapped index is served from it.
+"""
+import os
+import re
+import json
+import threading
+from pathlib import Path
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.vectorstores import VectorStore
+from indexing import assign_chunk_ids
+
+MANIFEST_FILE = "vector_index.json"
+INDEX_FILE_PATTERN = re.compile(r"(vectors|scales|chunks)(\.\d+)?\.(q|f32|jsonl)")
+# Files only read a few rows at a time by searches, rather than scanned
+PAGED_FILE_PATTERN = re.compile(r"(vectors(\.\d+)?\.f32|chunks(\.\d+)?\.jsonl)")
+
+QUANTIZATIONS = ("float16", "int8")
+VECTOR_STORES = ("chroma", "mmap")
+# Rows converted to float32 at once while scoring, bounding the temporary memory of a scan
+BLOCK_ROWS = 8192
+
+
+def has_vector_index(persist_directory: Path) -> bool:
+    return (Path(persist_directory) / MANIFEST_FILE).exists()
+
+
+def index_files(generation: int) -> dict:
+    """Name of each file of the index at `generation`."""
+    suffix = f".{generation}" if generation else ""
+    return {
+        "quantized": f"vectors{suffix}.q",
+        "scales": f"scales{suffix}.f32",
+        "full": f"vectors{suffix}.f32",
+        "chunks": f"chunks{suffix}.jsonl",
+    }
+
+
+def is_paged_file(name: str) -> bool:
+    return PAGED_FILE_PATTERN.fullmatch(name) is not None
+
+
+def open_vectorstore(collection_name: str, persist_directory: Path, embedding_function, backend: str = None):
+    """
+    Open (or create) the vector store of a collection.
+
+    `backend` is "chroma" or "mmap"; by default a collection with a memory-mapped index is
+    opened as one and any other as Chroma.
+    """
+    backend = backend or ("mmap" if has_vector_index(persist_directory) else "chroma")
+    if backend not in VECTOR_STORES:
+        raise ValueError(f"Unknown vector store {backend!r}, expected one of {VECTOR_STORES}")
+    if backend == "mmap":
+        return MmapVectorStore(
+            persist_directory,
+            embedding_function,
+            quantization=os.getenv("VECTOR_QUANTIZATION", "float16"),
+            collection_name=collection_name,
+        )
+    from langchain_chroma import Chroma
+    return Chroma(
+        collection_name=collection_name,
+        embedding_function=embedding_function,
+        persist_directory=str(persist_directory),
+    )
+
+
+def normalize(vectors) -> np.ndarray:
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms == 0, 1.0, norms)
+
+
+def quantize(vectors: np.ndarray, quantization: str) -> tuple:
+    """(codes, per-row scales or None) for unit-normalized float32 `vectors`."""
+    if quantization == "float16":
+        return vectors.astype(np.float16), None
+    scales = np.abs(vectors).max(axis=1) / 127
+    scales[scales == 0] = 1.0
+    codes = np.rint(vectors / scales[:, None]).astype(np.int8)
+    return codes, scales.astype(np.float32)
+
+
+def top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """Indices of the `k` highest scores, best first."""
+    if k < len(scores):
+        candidates = np.argpartition(-scores, k - 1)[:k]
+    else:
+        candidates = np.arange(len(scores))
+    return candidates[np.argsort(-scores[candidates], kind="stable")]
+
+
+def _scan(matrix: np.ndarray, query: np.ndarray) -> np.ndarray:
+    scores = np.empty(len(matrix), dtype=np.float32)
+    for start in range(0, len(matrix), BLOCK_ROWS):
+        scores[start:start + BLOCK_ROWS] = matrix[start:start + BLOCK_ROWS].astype(np.float32) @ query
+    return scores
+
+
+class _Snapshot:
+    """The index as of one manifest; searches use a snapshot while writers replace it."""
+
+    def __init__(self, manifest: dict, quantized, scales, full, chunks):
+        self.manifest = manifest
+        self.ids = manifest["ids"]
+        self.offsets = manifest["offsets"]
+        self.ends = self.offsets[1:] + [manifest["chunks_bytes"]]
+        self.rows = {chunk_id: row for row, chunk_id in enumerate(self.ids)}
+        self.quantized = quantized
+        self.scales = scales
+        self.full = full
+        self.chunks = chunks
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+
+class MmapVectorStore(VectorStore):
+    """
+    Flat vector store over memory-mapped NumPy files in `persist_directory` (see module docstring).
+
+    Similarity is cosine. Searches are coarse-to-fine: the quantized vectors pick
+    `max(k * oversample, min_candidates)` candidates, which are re-ranked at full precision.
+    With `exact=True` every row is scored at full precision instead.
+
+    Reads are lock-free: a search works on the snapshot that was current when it started,
+    whose files stay mapped and unchanged while writers commit new ones. Writes (ingestion)
+    are serialized by the store and become visible to its searches all at once, when the
+    manifest is replaced. Only one store may write to a directory at a time, and other
+    stores opened on it keep serving the snapshot they loaded.
+    """
+
+    # Rows are packed, so every delete rewrites the index: callers pass all their IDs at once
+    delete_batch_size = None
+
+    def __init__(
+        self,
+        persist_directory: Path,
+        embedding_function=None,
+        quantization: str = "float16",
+        oversample: int = 4,
+        min_candidates: int = 64,
+        exact: bool = False,
+        collection_name: str = None,
+    ):
+        if quantization not in QUANTIZATIONS:
+            raise ValueError(f"Unknown quantization {quantization!r}, expected one of {QUANTIZATIONS}")
+        self._persist_directory = str(persist_directory)
+        self.directory = Path(persist_directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._embedding_function = embedding_function
+        self.collection_name = collection_name or self.directory.name
+        self.oversample = oversample
+        self.min_candidates = min_candidates
+        self.exact = exact
+        self._lock = threading.Lock()
+        # An existing index keeps the quantization it was built with until it is reset
+        self._quantization = quantization
+        self._snapshot = self._load(quantization)
+
+    @property
+    def embeddings(self):
+        return self._embedding_function
+
+    @property
+    def quantization(self) -> str:
+        return self._snapshot.manifest["quantization"]
+
+    def count(self) -> int:
+        return len(self._snapshot)
+
+    def __len__(self) -> int:
+        return len(self._snapshot)
+
+    # Files
+
+    def _path(self, name: str) -> Path:
+        return self.directory / name
+
+    def _empty_manifest(self, quantization: str, generation: int) -> dict:
+        return {
+            "dim": None,
+            "quantization": quantization,
+            "generation": generation,
+            "ids": [],
+            "offsets": [],
+            "chunks_bytes": 0,
+        }
+
+    def _load(self, quantization: str = None) -> _Snapshot:
+        path = self._path(MANIFEST_FILE)
+        if path.exists():
+            manifest = json.loads(path.read_text(encoding="utf-8"))
+            # Manifests written before generations name the files of generation 0
+            manifest.setdefault("generation", 0)
+        else:
+            manifest = self._empty_manifest(quantization, 0)
+        count, dim = len(manifest["ids"]), manifest["dim"]
+        if not count:
+            return _Snapshot(manifest, None, None, None, None)
+
+        files = index_files(manifest["generation"])
+
+        def mapped(part: str, dtype, shape):
+            return np.memmap(self._path(files[part]), dtype=dtype, mode="r", shape=shape)
+
+        quantized_dtype = np.float16 if manifest["quantization"] == "float16" else np.int8
+        return _Snapshot(
+            manifest,
+            mapped("quantized", quantized_dtype, (count, dim)),
+            mapped("scales", np.float32, (count,)) if manifest["quantization"] == "int8" else None,
+            mapped("full", np.float32, (count, dim)),
+            mapped("chunks", np.uint8, (manifest["chunks_bytes"],)),
+        )
+
+    def _write_manifest(self, manifest: dict) -> None:
+        path = self._path(MANIFEST_FILE)
+        tmp_path = path.with_suffix(".tmp")
+        tmp_path.write_text(json.dumps(manifest), encoding="utf-8")
+        os.replace(tmp_path, path)
+
+    def _commit(self, manifest: dict) -> None:
+        """Make `manifest` the index searches see, then remove the files of other generations."""
+        previous = self._snapshot.manifest["generation"]
+        self._write_manifest(manifest)
+        self._snapshot = self._load()
+        if manifest["generation"] != previous:
+            self._remove_stale_files(manifest["generation"])
+
+    def _remove_stale_files(self, generation: int) -> None:
+        current = set(index_files(generation).values())
+        for path in self.directory.iterdir():
+            if INDEX_FILE_PATTERN.fullmatch(path.name) and path.name not in current:
+                try:
+                    # Searches still mapping the file keep reading it; the data goes with the last mapping
+                    path.unlink()
+                except OSError:
+                    # E.g. still mapped on Windows; removed after a later rewrite
+                    pass
+
+    @staticmethod
+    def _append_bytes(path: Path, valid_bytes: int, data: bytes) -> None:
+        # Anything past the last committed manifest is left over from an interrupted write
+        with open(path, "ab") as f:
+            f.truncate(valid_bytes)
+            f.write(data)
+
+    def _write_rows(self, manifest: dict, ids: list, texts: list, metadatas: list, vectors: np.ndarray) -> dict:
+        """Append rows to the files of `manifest`'s generation; returns the manifest that commits them."""
+        files = index_files(manifest["generation"])
+        count, dim = len(manifest["ids"]), manifest["dim"] or vectors.shape[1]
+        if vectors.shape[1] != dim:
+            raise ValueError(f"Embedding dimension {vectors.shape[1]} does not match the index ({dim})")
+
+        vectors = normalize(vectors)
+        codes, scales = quantize(vectors, manifest["quantization"])
+        self._append_bytes(self._path(files["full"]), count * dim * 4, vectors.tobytes())
+        self._append_bytes(self._path(files["quantized"]), count * dim * codes.itemsize, codes.tobytes())
+        if scales is not None:
+            self._append_bytes(self._path(files["scales"]), count * 4, scales.tobytes())
+
+        offsets = []
+        lines = []
+        position = manifest["chunks_bytes"]
+        for text, metadata in zip(texts, metadatas):
+            line = (json.dumps({"text": text, "metadata": metadata or {}}, ensure_ascii=False) + "\n").encode("utf-8")
+            offsets.append(position)
+            lines.append(line)
+            position += len(line)
+        self._append_bytes(self._path(files["chunks"]), manifest["chunks_bytes"], b"".join(lines))
+
+        return dict(
+            manifest,
+            dim=dim,
+            ids=manifest["ids"] + list(ids),
+            offsets=manifest["offsets"] + offsets,
+            chunks_bytes=position,
+        )
+
+    def _append(self, ids: list, texts: list, metadatas: list, vectors: np.ndarray) -> None:
+        """Append rows and commit them. Caller holds the lock."""
+        self._commit(self._write_rows(self._snapshot.manifest, ids, texts, metadatas, vectors))
+
+    def _rewrite(self, drop: set, ids: list = (), texts: list = (), metadatas: list = (), vectors: np.ndarray = None) -> None:
+        """
+        Write the rows not in `drop`, then the given new rows, to the next generation's files
+        and commit them in one manifest replacement. Caller holds the lock.
+        """
+        snapshot = self._snapshot
+        manifest = self._empty_manifest(snapshot.manifest["quantization"], snapshot.manifest["generation"] + 1)
+        keep = [row for row in range(len(snapshot)) if row not in drop]
+        for start in range(0, len(keep), BLOCK_ROWS):
+            rows = keep[start:start + BLOCK_ROWS]
+            chunks = self._read_chunks(snapshot, rows)
+            manifest = self._write_rows(
+                manifest,
+                [snapshot.ids[row] for row in rows],
+                [text for text, _ in chunks],
+                [metadata for _, metadata in chunks],
+                np.array(snapshot.full[rows]),
+            )
+        if ids:
+            manifest = self._write_rows(manifest, ids, texts, metadatas, vectors)
+        self._commit(manifest)
+
+    def _read_chunks(self, snapshot: _Snapshot, rows: list) -> list:
+        """(text, metadata) of each row, reading only those lines."""
+        chunks = []
+        for row in rows:
+            chunk = json.loads(bytes(snapshot.chunks[snapshot.offsets[row]:snapshot.ends[row]]))
+            chunks.append((chunk["text"], chunk["metadata"]))
+        return chunks
+
+    def _documents(self, snapshot: _Snapshot, rows: list) -> list:
+        return [
+            Document(id=snapshot.ids[row], page_content=text, metadata=metadata)
+            for row, (text, metadata) in zip(rows, self._read_chunks(snapshot, rows))
+        ]
+
+    # Writing
+
+    def add_texts(self, texts, metadatas: list = None, ids: list = None, **kwargs) -> list:
+        texts = list(texts)
+        if not texts:
+            return []
+        metadatas = list(metadatas) if metadatas is not None else [{} for _ in texts]
+        if ids is None:
+            ids = assign_chunk_ids([Document(page_content=text) for text in texts])
+        vectors = np.asarray(self._embedding_function.embed_documents(texts), dtype=np.float32)
+        self.add_vectors(ids, texts, metadatas, vectors)
+        return list(ids)
+
+    def add_vectors(self, ids: list, texts: list, metadatas: list, vectors) -> None:
+        """Store already embedded chunks. Existing IDs are replaced."""
+        ids, texts, metadatas = list(ids), list(texts), list(metadatas)
+        vectors = np.asarray(vectors, dtype=np.float32)
+        with self._lock:
+            replaced = {self._snapshot.rows[chunk_id] for chunk_id in ids if chunk_id in self._snapshot.rows}
+            if replaced:
+                self._rewrite(replaced, ids, texts, metadatas, vectors)
+            else:
+                self._append(ids, texts, metadatas, vectors)
+
+    def delete(self, ids: list = None, **kwargs) -> None:
+        with self._lock:
+            drop = {self._snapshot.rows[chunk_id] for chunk_id in ids or [] if chunk_id in self._snapshot.rows}
+            if drop:
+                self._rewrite(drop)
+
+    def reset_collection(self) -> None:
+        """Empty the index; it is rebuilt with the quantization this store was opened with."""
+        with self._lock:
+            self._commit(self._empty_manifest(self._quantization, self._snapshot.manifest["generation"] + 1))
+
+    # Reading
+
+    def get(self, ids: list = None, include: list = None, **kwargs) -> dict:
+        """Stored chunks in the shape Chroma's `get` returns; all of them without `ids`."""
+        include = ["documents", "metadatas"] if include is None else include
+        snapshot = self._snapshot
+        if ids is None:
+            rows = list(range(len(snapshot)))
+        else:
+            rows = sorted(snapshot.rows[chunk_id] for chunk_id in set(ids) if chunk_id in snapshot.rows)
+
+        result = {"ids": [snapshot.ids[row] for row in rows], "embeddings": None, "documents": None, "metadatas": None}
+        if "embeddings" in include:
+            result["embeddings"] = np.array(snapshot.full[rows]) if rows else np.empty((0, snapshot.manifest["dim"] or 0), dtype=np.float32)
+        if "documents" in include or "metadatas" in include:
+            chunks = self._read_chunks(snapshot, rows)
+            if "documents" in include:
+                result["documents"] = [text for text, _ in chunks]
+            if "metadatas" in include:
+                result["metadatas"] = [metadata for _, metadata in chunks]
+        return result
+
+    def _search(self, embedding, k: int) -> list:
+        """[(row, cosine similarity)] of the top-k rows, best first."""
+        snapshot = self._snapshot
+        if not len(snapshot) or k <= 0:
+            return []
+        query = normalize(embedding)
+
+        if self.exact:
+            scores = _scan(snapshot.full, query)
+            rows = top_k(scores, k)
+            return [(int(row), float(scores[row])) for row in rows]
+
+        coarse = _scan(snapshot.quantized, query)
+        if snapshot.scales is not None:
+            coarse *= snapshot.scales
+        candidates = np.sort(top_k(coarse, max(k * self.oversample, self.min_candidates)))
+        # Only the candidate rows of the full-precision file are read, in file order
+        scores = np.asarray(snapshot.full[candidates]) @ query
+        best = top_k(scores, k)
+        return [(int(candidates[i]), float(scores[i])) for i in best]
+
+    def similarity_search_by_vector_with_relevance_scores(self, embedding, k: int = 4, **kwargs) -> list:
+        """[(Document, cosine distance)], nearest first, like Chroma's method of the same name."""
+        snapshot = self._snapshot
+        hits = self._search(embedding, k)
+        docs = self._documents(snapshot, [row for row, _ in hits])
+        return [(doc, 1.0 - similarity) for doc, (_, similarity) in zip(docs, hits)]
+
+    def similarity_search_by_vector(self, embedding, k: int = 4, **kwargs) -> list:
+        return [doc for doc, _ in self.similarity_search_by_vector_with_relevance_scores(embedding, k)]
+
+    def similarity_search_with_score(self, query: str, k: int = 4, **kwargs) -> list:
+        return self.similarity_search_by_vector_with_relevance_scores(self._embedding_function.embed_query(query), k)
+
+    def similarity_search(self, query: str, k: int = 4, **kwargs) -> list:
+        return [doc for doc, _ in self.similarity_search_with_score(query, k)]
+
+    def _select_relevance_score_fn(self):
+        return self._cosine_relevance_score_fn
+
+    @classmethod
+    def from_texts(cls, texts, embedding, metadatas: list = None, ids: list = None, persist_directory: Path = None, **kwargs):
+        store = cls(persist_directory, embedding, **kwargs)
+        store.add_texts(texts, metadatas=metadatas, ids=ids)
+        return store
+
+    @classmethod
+    def from_vectorstore(cls, source, persist_directory: Path, embedding_function=None, batch_size: int = 1000, **kwargs):
+        """Copy the chunks and stored embeddings of another store (e.g. Chroma) without re-embedding."""
+        store = cls(persist_directory, embedding_function, **kwargs)
+        store.reset_collection()
+        ids = source.get(include=[])["ids"]
+        for start in range(0, len(ids), batch_size):
+            found = source.get(ids=ids[start:start + batch_size], include=["embeddings", "documents", "metadatas"])
+            store.add_vectors(found["ids"], found["documents"], found["metadatas"], found["embeddings"])
+        return store
+
+
+if __name__ == "__main__":
+    import argparse
+    from langchain_chroma import Chroma
+
+    parser = argparse.ArgumentParser(description="Convert a Chroma collection to a memory-mapped index, in place")
+    parser.add_argument("directory", type=Path, help="the collection's directory, e.g. artifacts/Vector_databases/biology")
+    parser.add_argument("--collection", help="Chroma collection name (defaults to the directory name)")
+    parser.add_argument("--quantization", choices=QUANTIZATIONS, default="float16")
+    args = parser.parse_args()
+
+    chroma = Chroma(collection_name=args.collection or args.directory.name, persist_directory=str(args.directory))
+    store = MmapVectorStore.from_vectorstore(chroma, args.directory, quantization=args.quantization)
+    print(f"Converted {store.count()} chunks to a {store.quantization} memory-mapped index in {args.directory}")